@@ -0,0 +1,274 @@
+"""
+Funcchain Benchmarks:
+Offline benchmarks of the framework overhead using the fake model.
+
+Usage:
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --quick --only compile parse
+    python benchmarks/run.py --compare baseline.json --threshold 1.25
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+from importlib.metadata import version
+from typing import Any, Callable, Literal
+
+from funcchain import achain, chain, runnable
+from funcchain.backend.streaming import stream_to
+from funcchain.model.fake import FakeChatModel
+from funcchain.parser.json_schema import RetryJsonPydanticParser
+from funcchain.parser.schema_converter import pydantic_to_grammar
+from funcchain.syntax.executable import compile_runnable
+from funcchain.syntax.output_types import CodeBlock
+from langchain_core.language_models import BaseChatModel
+from pydantic import BaseModel, Field
+
+Result = dict[str, Any]
+
+
+class Address(BaseModel):
+    street: str
+    city: str
+    country: str = Field(description="ISO country code")
+
+
+class Person(BaseModel):
+    name: str
+    age: int = Field(ge=0, le=120)
+    email: str
+    addresses: list[Address]
+    role: Literal["admin", "user", "guest"]
+
+
+class Company(BaseModel):
+    name: str
+    employees: list[Person]
+    headquarter: Address
+
+
+class Note(BaseModel):
+    text: str
+
+
+def extract(text: str, llm: BaseChatModel) -> Person:
+    """
+    Extract the person from the text.
+    """
+    return chain(llm=llm)
+
+
+async def aextract(text: str, llm: BaseChatModel) -> Person:
+    """
+    Extract the person from the text.
+    """
+    return await achain(llm=llm)
+
+
+def summarize(text: str, llm: BaseChatModel) -> str:
+    """
+    Summarize the text.
+    """
+    return chain(llm=llm)
+
+
+def measure(name: str, group: str, fn: Callable[[], Any], repeat: int, **info: Any) -> Result:
+    """
+    Time repeated calls of fn (after one warmup call).
+    """
+    fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return _result(name, group, timings, **info)
+
+
+def _result(name: str, group: str, timings: list[float], **info: Any) -> Result:
+    mean = statistics.fmean(timings)
+    return {
+        "name": name,
+        "group": group,
+        "unit": "s",
+        "mean": mean,
+        "median": statistics.median(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "min": min(timings),
+        "ops": 1 / mean if mean else 0.0,
+        "repeat": len(timings),
+        **info,
+    }
+
+
+def bench_call_overhead(repeat: int) -> list[Result]:
+    llm = FakeChatModel(seed=0)
+    compiled = runnable(settings={"llm": llm})(extract)
+    return [
+        measure("chain", "call_overhead", lambda: extract("John, 42, john@example.com", llm), repeat),
+        measure("runnable", "call_overhead", lambda: compiled.invoke({"text": "John, 42, john@example.com"}), repeat),
+    ]
+
+
+def bench_compile(repeat: int) -> list[Result]:
+    families: dict[str, tuple[list[type], FakeChatModel]] = {
+        "str": ([str], FakeChatModel()),
+        "primitive": ([list[int]], FakeChatModel()),
+        "pydantic": ([Person], FakeChatModel()),
+        "pydantic_functions": ([Person], FakeChatModel(function_calling=True)),
+        "union": ([Person, Note], FakeChatModel(function_calling=True)),
+        "parser_base_model": ([CodeBlock], FakeChatModel()),
+    }
+    return [
+        measure(
+            family,
+            "compile",
+            lambda: compile_runnable(instruction="Extract {text}", input_args=["text"], output_types=types, llm=llm),
+            repeat,
+        )
+        for family, (types, llm) in families.items()
+    ]
+
+
+def bench_parse(repeat: int, sizes: tuple[int, ...] = (1, 10, 100, 1000)) -> list[Result]:
+    parser: RetryJsonPydanticParser = RetryJsonPydanticParser(pydantic_object=Company, retry=0)
+    results = []
+    for employees in sizes:
+        person = {"name": "Jane", "age": 33, "email": "jane@example.com", "role": "user"}
+        address = {"street": "Main Street 1", "city": "Berlin", "country": "DE"}
+        text = json.dumps(
+            {
+                "name": "ACME",
+                "employees": [{**person, "addresses": [address]}] * employees,
+                "headquarter": address,
+            }
+        )
+        chunks = [text[i : i + 4] for i in range(0, len(text), 4)]
+        for mode, fn in (
+            ("parse", lambda: parser.parse(text)),
+            ("stream", lambda: list(parser.transform(iter(chunks)))),
+        ):
+            result = measure(f"{mode}_{employees}", "parse", fn, repeat, size=len(text))
+            result["bytes_per_s"] = len(text) / result["mean"]
+            results.append(result)
+    return results
+
+
+def bench_grammar(repeat: int) -> list[Result]:
+    return [
+        measure(model.__name__, "grammar", lambda: pydantic_to_grammar(model), repeat)
+        for model in (Address, Person, Company)
+    ]
+
+
+def bench_streaming(repeat: int) -> list[Result]:
+    llm = FakeChatModel(text_words=200, chunk_size=1, seed=0)
+    text = "funcchain " * 50
+
+    def streamed() -> None:
+        with stream_to(lambda token: None):
+            summarize(text, llm)
+
+    return [
+        measure("no_callbacks", "streaming", lambda: summarize(text, llm), repeat),
+        measure("stream_to", "streaming", streamed, repeat),
+    ]
+
+
+def bench_throughput(requests: int, concurrency_levels: tuple[int, ...] = (1, 8, 64)) -> list[Result]:
+    # 10ms time to first token, 500 chunks per second
+    llm = FakeChatModel(ttft=0.01, chunk_rate=500, chunk_size=16, seed=0)
+
+    async def run(concurrency: int) -> list[float]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call() -> float:
+            async with semaphore:
+                start = time.perf_counter()
+                await aextract("John, 42, john@example.com", llm)
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*(call() for _ in range(requests)))
+
+    results = []
+    for concurrency in concurrency_levels:
+        start = time.perf_counter()
+        latencies = asyncio.run(run(concurrency))
+        elapsed = time.perf_counter() - start
+        result = _result(f"concurrency_{concurrency}", "throughput", latencies, concurrency=concurrency)
+        result["requests_per_s"] = requests / elapsed
+        results.append(result)
+    return results
+
+
+BENCHMARKS: dict[str, Callable[[bool], list[Result]]] = {
+    "call_overhead": lambda quick: bench_call_overhead(20 if quick else 200),
+    "compile": lambda quick: bench_compile(10 if quick else 100),
+    "parse": lambda quick: bench_parse(5, (1, 10, 100)) if quick else bench_parse(20),
+    "grammar": lambda quick: bench_grammar(10 if quick else 100),
+    "streaming": lambda quick: bench_streaming(5 if quick else 50),
+    "throughput": lambda quick: bench_throughput(32 if quick else 256),
+}
+
+
+def run_benchmarks(only: list[str] | None = None, quick: bool = False) -> dict[str, Any]:
+    results: list[Result] = []
+    for group, benchmark in BENCHMARKS.items():
+        if not only or group in only:
+            print(f"running {group}...", file=sys.stderr)
+            results.extend(benchmark(quick))
+    return {
+        "funcchain": version("funcchain"),
+        "langchain_core": version("langchain-core"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def compare(report: dict[str, Any], baseline: dict[str, Any], threshold: float) -> list[str]:
+    """
+    Benchmarks with a mean slower than threshold times the baseline.
+    """
+    previous = {(r["group"], r["name"]): r["mean"] for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        if (base := previous.get((result["group"], result["name"]))) and result["mean"] > base * threshold:
+            regressions.append(f"{result['group']}/{result['name']}: {base:.6f}s -> {result['mean']:.6f}s")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Funcchain framework overhead benchmarks (offline).")
+    parser.add_argument("--output", "-o", help="write the JSON results to this file (default: stdout)")
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), help="run only these groups")
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown counted as regression")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.only, args.quick)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
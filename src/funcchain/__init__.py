@@ -2,7 +2,7 @@ from pydantic import BaseModel
 
 from .backend.settings import settings
 from .syntax.decorators import runnable
-from .syntax.executable import achain, chain
+from .syntax.executable import achain, astream_chain, chain, stream_chain
 from .syntax.input_types import Image
 from .syntax.output_types import Error
 from .syntax.params import Depends
@@ -11,6 +11,8 @@ __all__ = [
     "settings",
     "chain",
     "achain",
+    "stream_chain",
+    "astream_chain",
     "runnable",
     "BaseModel",
     "Image",
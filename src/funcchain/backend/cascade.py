@@ -0,0 +1,138 @@
+"""
+Model Cascade:
+Try the cheapest model first and escalate to the next tier
+only when parsing/validation or the confidence check fails.
+"""
+
+import time
+from threading import Lock
+from typing import Any, Callable, Optional, Union
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import Runnable, RunnableConfig
+from pydantic import ValidationError
+
+
+class TierStats:
+    """
+    Outcome counters of one cascade tier.
+    """
+
+    def __init__(self) -> None:
+        self.attempts = 0
+        self.successes = 0
+        self.parse_failures = 0
+        self.check_failures = 0
+        self.total_latency = 0.0
+        self._lock = Lock()
+
+    def record(self, latency: float, outcome: str) -> None:
+        with self._lock:
+            self.attempts += 1
+            self.total_latency += latency
+            if outcome == "success":
+                self.successes += 1
+            elif outcome == "parse_failure":
+                self.parse_failures += 1
+            elif outcome == "check_failure":
+                self.check_failures += 1
+
+    def snapshot(self) -> dict[str, float]:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "successes": self.successes,
+                "parse_failures": self.parse_failures,
+                "check_failures": self.check_failures,
+                "success_rate": self.successes / self.attempts if self.attempts else 0.0,
+                "avg_latency": self.total_latency / self.attempts if self.attempts else 0.0,
+            }
+
+
+_cascade_stats: dict[str, dict[str, TierStats]] = {}
+_registry_lock = Lock()
+
+
+def get_tier_stats(cascade: list[str], tier: str) -> TierStats:
+    key = " > ".join(cascade)
+    with _registry_lock:
+        tiers = _cascade_stats.setdefault(key, {})
+        if tier not in tiers:
+            tiers[tier] = TierStats()
+        return tiers[tier]
+
+
+def cascade_stats() -> dict[str, dict[str, dict[str, float]]]:
+    """
+    Per-tier success rates and latencies of every cascade, keyed by "tier1 > tier2 > ...".
+    """
+    with _registry_lock:
+        return {key: {tier: stats.snapshot() for tier, stats in tiers.items()} for key, tiers in _cascade_stats.items()}
+
+
+Tier = Union[Runnable[dict[str, Any], Any], Callable[[], Runnable[dict[str, Any], Any]]]
+
+
+class CascadeChain(Runnable[dict[str, Any], Any]):
+    """
+    Runs the compiled chain of each tier in order and returns the first result
+    that parses and passes the optional confidence check.
+    The last tier always returns its result (or raises its error).
+    Tiers can be given as function compiling the chain on the first escalation to it.
+    """
+
+    def __init__(
+        self,
+        tiers: list[tuple[str, Tier]],
+        check: Optional[Callable[[Any], bool]] = None,
+    ) -> None:
+        self.tiers = tiers
+        self.check = check
+        self.stats = [get_tier_stats([name for name, _ in tiers], name) for name, _ in tiers]
+        self._lock = Lock()
+
+    def _chain(self, i: int) -> Runnable[dict[str, Any], Any]:
+        name, chain = self.tiers[i]
+        if isinstance(chain, Runnable):
+            return chain
+        with self._lock:
+            if not isinstance(chain := self.tiers[i][1], Runnable):
+                chain = chain()
+                self.tiers[i] = (name, chain)
+            return chain
+
+    def invoke(self, input: dict[str, Any], config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        for i in range(len(self.tiers)):
+            start = time.monotonic()
+            try:
+                result = self._chain(i).invoke(input, config, **kwargs)
+            except (OutputParserException, ValidationError):
+                self.stats[i].record(time.monotonic() - start, "parse_failure")
+                if self._is_last(i):
+                    raise
+                continue
+            if self._accept(i, result, time.monotonic() - start):
+                return result
+
+    async def ainvoke(self, input: dict[str, Any], config: RunnableConfig | None = None, **kwargs: Any) -> Any:
+        for i in range(len(self.tiers)):
+            start = time.monotonic()
+            try:
+                result = await self._chain(i).ainvoke(input, config, **kwargs)
+            except (OutputParserException, ValidationError):
+                self.stats[i].record(time.monotonic() - start, "parse_failure")
+                if self._is_last(i):
+                    raise
+                continue
+            if self._accept(i, result, time.monotonic() - start):
+                return result
+
+    def _is_last(self, i: int) -> bool:
+        return i == len(self.tiers) - 1
+
+    def _accept(self, i: int, result: Any, latency: float) -> bool:
+        if self.check and not self.check(result):
+            self.stats[i].record(latency, "check_failure")
+            return self._is_last(i)
+        self.stats[i].record(latency, "success")
+        return True
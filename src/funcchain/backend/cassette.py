@@ -0,0 +1,374 @@
+"""
+Cassettes:
+Record the model traffic of funcchain calls (prompt messages, model parameters, bindings,
+generations and stream chunk timing) into a compact file and replay it offline
+through a stand-in model, with the original or zero latency.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, AsyncIterator, Generator, Iterator, Literal, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, BaseCallbackHandler, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableBinding, RunnableConfig
+from langchain_core.runnables.config import merge_configs
+
+from ..model.abilities import gather_llm_type, get_model_id
+from ..utils.msg_tools import join_message_chunks
+from .tracing import current_chain_name
+from .wrapper import RunnableWrapper, WrappedCall
+
+Latency = Literal["original", "zero"]
+
+
+class Cassette:
+    """
+    Recorded model interactions, looked up by model and prompt messages when replaying.
+    """
+
+    def __init__(self, replaying: bool = False, latency: Latency = "original") -> None:
+        self.replaying = replaying
+        self.latency = latency
+        self.models: dict[str, dict[str, str]] = {}
+        """ Model selector -> model id, llm type, model name and kind (function_model, ...). """
+        self.interactions: list[dict[str, Any]] = []
+        self._queues: dict[str, list[dict[str, Any]]] = {}
+        self._lock = Lock()
+
+    def add_model(self, selector: str, llm: BaseChatModel) -> None:
+        if selector in self.models:
+            return
+        model = {
+            "model_id": get_model_id(llm),
+            "llm_type": llm._llm_type,
+            "model_name": _model_name(llm),
+            "kind": gather_llm_type(llm),
+        }
+        with self._lock:
+            self.models[selector] = model
+
+    def stand_in(self, selector: str) -> Optional["ReplayChatModel"]:
+        """
+        Model replacing the recorded model of the selector, compiles like the original one.
+        """
+        if not (model := self.models.get(selector)):
+            return None
+        return ReplayChatModel(
+            model_name=model["model_name"], recorded_type=model["llm_type"], kind=model["kind"], cassette=self
+        )
+
+    def replay_model(self, llm: BaseChatModel) -> "ReplayChatModel":
+        """
+        Model answering from the cassette in place of the model instance.
+        """
+        if isinstance(llm, ReplayChatModel):
+            return llm
+        return ReplayChatModel(model_name=_model_name(llm), recorded_type=llm._llm_type, cassette=self)
+
+    def record(self, model_id: str, input: LanguageModelInput, params: dict[str, Any], **response: Any) -> None:
+        messages = _messages(input)
+        interaction = {
+            "chain": current_chain_name() or "<runnable>",
+            "model": model_id,
+            "key": _key(model_id, messages),
+            "messages": [_pack(message, type=True) for message in messages],
+            "params": params,
+            **response,
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def lookup(self, model_id: str, input: LanguageModelInput) -> dict[str, Any]:
+        """
+        Next recorded interaction for the prompt (the last one is repeated if called more often).
+        """
+        key = _key(model_id, _messages(input))
+        with self._lock:
+            if not (queue := self._queues.get(key)):
+                raise LookupError(f"No recorded response of {model_id} for this prompt in the cassette.")
+            return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"version": 1, "models": self.models, "interactions": self.interactions}
+
+    def save(self, path: str) -> None:
+        data = json.dumps(self.to_dict(), separators=(",", ":"), default=str).encode()
+        with open(path, "wb") as f:
+            f.write(gzip.compress(data) if path.endswith(".gz") else data)
+
+    @classmethod
+    def load(cls, path: str, latency: Latency = "original") -> "Cassette":
+        with open(path, "rb") as f:
+            data = f.read()
+        return cls.from_dict(json.loads(gzip.decompress(data) if path.endswith(".gz") else data), latency)
+
+    @classmethod
+    def from_dict(cls, content: dict[str, Any], latency: Latency = "original") -> "Cassette":
+        """
+        Cassette replaying the recorded interactions.
+        """
+        cassette = cls(replaying=True, latency=latency)
+        cassette.models = dict(content["models"])
+        cassette.interactions = list(content["interactions"])
+        for interaction in cassette.interactions:
+            cassette._queues.setdefault(interaction["key"], []).append(interaction)
+        return cassette
+
+    def __repr__(self) -> str:
+        mode = "replaying" if self.replaying else "recording"
+        return f"Cassette({mode}, {len(self.interactions)} interactions)"
+
+
+_active_cassette: ContextVar[Optional[Cassette]] = ContextVar("active_cassette", default=None)
+
+
+def active_cassette() -> Optional[Cassette]:
+    return _active_cassette.get()
+
+
+@contextmanager
+def record_cassette(path: Optional[str] = None) -> Generator[Cassette, None, None]:
+    """
+    Record the model traffic of the funcchain calls inside the context (saved to path on exit,
+    use a ".gz" suffix to compress).
+
+    Example:
+        >>> with record_cassette("workflow.json"):
+        ...     run_workflow()
+    """
+    cassette = Cassette()
+    token = _active_cassette.set(cassette)
+    try:
+        yield cassette
+    finally:
+        _active_cassette.reset(token)
+        if path:
+            cassette.save(path)
+
+
+@contextmanager
+def replay_cassette(cassette: str | Cassette, latency: Latency = "original") -> Generator[Cassette, None, None]:
+    """
+    Serve the recorded responses (of a cassette file or recorded cassette) instead of calling the models.
+    Models selected by string are replaced by a stand-in, so no provider (or API key) is needed.
+
+    Example:
+        >>> with replay_cassette("workflow.json", latency="zero"):
+        ...     run_workflow()
+    """
+    if isinstance(cassette, str):
+        cassette = Cassette.load(cassette, latency)
+    else:
+        cassette = Cassette.from_dict(cassette.to_dict(), latency)
+    token = _active_cassette.set(cassette)
+    try:
+        yield cassette
+    finally:
+        _active_cassette.reset(token)
+
+
+class CassetteModel(RunnableWrapper[LanguageModelInput, BaseMessage]):
+    """
+    Wraps a (bound) chat model and records its interactions into the cassette,
+    including the chunk timing when streamed (or streamed internally to callbacks).
+    """
+
+    def __init__(
+        self, bound: Runnable[LanguageModelInput, BaseMessage], cassette: Cassette, llm: BaseChatModel
+    ) -> None:
+        super().__init__(bound)
+        self.cassette = cassette
+        self.model_id = get_model_id(llm)
+        self.params = {
+            **{key: value for key, value in llm._identifying_params.items() if _is_json(value)},
+            **_binding_kwargs(bound),
+        }
+
+    @contextmanager
+    def call(
+        self, input: LanguageModelInput, config: RunnableConfig | None, stream: bool
+    ) -> Iterator[WrappedCall[BaseMessage]]:
+        recorder = _ChunkRecorder()
+        if stream:
+            call = _CassetteCall(config, recorder)
+        else:
+            # chunks streamed internally to the callbacks
+            call = _CassetteCall(merge_configs(config, {"callbacks": [recorder]}), recorder)
+        try:
+            yield call
+        finally:
+            if stream or call.output is not None:
+                self._record(input, call.output, recorder)
+
+    def _record(self, input: LanguageModelInput, message: Optional[BaseMessage], recorder: "_ChunkRecorder") -> None:
+        latency = time.perf_counter() - recorder.start
+        if recorder.chunks:
+            self.cassette.record(self.model_id, input, self.params, chunks=recorder.chunks, latency=latency)
+        elif message is not None:
+            self.cassette.record(self.model_id, input, self.params, response=_pack(message), latency=latency)
+
+
+class _CassetteCall(WrappedCall[BaseMessage]):
+    def __init__(self, config: RunnableConfig | None, recorder: "_ChunkRecorder") -> None:
+        super().__init__(config)
+        self.recorder = recorder
+        self.output: Optional[BaseMessage] = None
+
+    def on_chunk(self, chunk: BaseMessage) -> bool:
+        self.recorder.add(chunk)
+        return False
+
+    def on_output(self, output: BaseMessage) -> None:
+        self.output = output
+
+
+class _ChunkRecorder(BaseCallbackHandler):
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.chunks: list[tuple[float, dict[str, Any]]] = []
+
+    def add(self, chunk: BaseMessage) -> None:
+        self.chunks.append((time.perf_counter() - self.start, _pack(chunk)))
+
+    def on_llm_new_token(self, token: str, *, chunk: Any = None, **kwargs: Any) -> None:
+        if isinstance(chunk, ChatGenerationChunk):
+            self.add(chunk.message)
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Stand-in for a recorded model: compiles like the original model
+    (same model id, stop sequence support and kind) and answers from the cassette,
+    with the recorded chunk timing unless replaying with zero latency.
+    """
+
+    model_name: str
+    recorded_type: str
+    kind: str = "chat_model"
+    """ Result of gather_llm_type for the recorded model (function_model, json_model, ...). """
+    cassette: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return self.recorded_type
+
+    @property
+    def _delays(self) -> bool:
+        return self.cassette.latency == "original"
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        interaction = self.cassette.lookup(get_model_id(self), messages)
+        if self._delays:
+            time.sleep(interaction["latency"])
+        return ChatResult(generations=[ChatGeneration(message=_response(interaction))])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        interaction = self.cassette.lookup(get_model_id(self), messages)
+        if self._delays:
+            await asyncio.sleep(interaction["latency"])
+        return ChatResult(generations=[ChatGeneration(message=_response(interaction))])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        start = time.perf_counter()
+        for offset, chunk in _chunks(self.cassette.lookup(get_model_id(self), messages)):
+            if self._delays:
+                time.sleep(max(0.0, start + offset - time.perf_counter()))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        start = time.perf_counter()
+        for offset, chunk in _chunks(self.cassette.lookup(get_model_id(self), messages)):
+            if self._delays:
+                await asyncio.sleep(max(0.0, start + offset - time.perf_counter()))
+            yield ChatGenerationChunk(message=chunk)
+
+
+def _messages(input: LanguageModelInput) -> list[BaseMessage]:
+    if isinstance(input, PromptValue):
+        return input.to_messages()
+    if isinstance(input, str):
+        return [HumanMessage(content=input)]
+    return [message for message in input if isinstance(message, BaseMessage)]
+
+
+def _key(model_id: str, messages: list[BaseMessage]) -> str:
+    content = json.dumps([model_id, [(m.type, m.content) for m in messages]], sort_keys=True, default=str)
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def _pack(message: BaseMessage, type: bool = False) -> dict[str, Any]:
+    """
+    Compact dict of the message (only the set fields).
+    """
+    data: dict[str, Any] = {"type": message.type} if type else {}
+    data["content"] = message.content
+    for field in ("additional_kwargs", "response_metadata", "usage_metadata"):
+        if value := getattr(message, field, None):
+            data[field] = value
+    return data
+
+
+def _response(interaction: dict[str, Any]) -> AIMessage:
+    if response := interaction.get("response"):
+        return AIMessage(**response)
+    return message_chunk_to_message(
+        join_message_chunks([AIMessageChunk(**chunk) for _, chunk in interaction["chunks"]])
+    )  # type: ignore
+
+
+def _chunks(interaction: dict[str, Any]) -> list[tuple[float, AIMessageChunk]]:
+    if chunks := interaction.get("chunks"):
+        return [(offset, AIMessageChunk(**chunk)) for offset, chunk in chunks]
+    # recorded without streaming
+    return [(interaction["latency"], AIMessageChunk(**interaction["response"]))]
+
+
+def _model_name(llm: BaseChatModel) -> str:
+    return str(getattr(llm, "model_name", None) or getattr(llm, "model", None) or getattr(llm, "model_path", ""))
+
+
+def _binding_kwargs(bound: Runnable) -> dict[str, Any]:
+    """
+    Kwargs of all bindings (functions, grammar, stop sequences, ...) of the bound model.
+    """
+    if isinstance(bound, RunnableBinding):
+        return {**_binding_kwargs(bound.bound), **bound.kwargs}
+    return {}
+
+
+def _is_json(value: Any) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool, list, dict))
@@ -1,15 +1,22 @@
 from operator import itemgetter
-from typing import Annotated, Any, TypeVar, get_args, get_origin
+from typing import Annotated, Any, Callable, TypeVar, get_args, get_origin
 
-from langchain_core.callbacks import Callbacks
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langchain_core.output_parsers import BaseGenerationOutputParser, BaseOutputParser
-from langchain_core.runnables import Runnable, RunnableParallel
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableBinding, RunnableParallel
 from pydantic import BaseModel
 
-from ..model.abilities import is_json_mode_model, is_openai_function_model, is_vision_model
+from ..model.abilities import (
+    get_model_id,
+    is_json_mode_model,
+    is_openai_function_model,
+    is_vision_model,
+    supports_stop_sequences,
+)
 from ..model.defaults import univeral_model_selector
 from ..parser.json_schema import RetryJsonPydanticParser
 from ..parser.openai_functions import (
@@ -24,16 +31,25 @@ from ..schema.signature import Signature
 from ..syntax.input_types import Image
 from ..syntax.output_types import ParserBaseModel
 from ..syntax.params import Depends
+from ..utils.memory import ChatMessageHistory, history_stats
 from ..utils.msg_tools import msg_to_str
 from ..utils.pydantic import multi_pydantic_to_functions, pydantic_to_functions
-from ..utils.token_counter import count_tokens
+from ..utils.token_counter import estimate_tokens
+from .cascade import CascadeChain, Tier
+from .cassette import CassetteModel, active_cassette
+from .concurrency import concurrency_limited
+from .early_stop import EarlyStopModel, completion_for, stop_sequences_for
+from .hedging import HedgedModel, rebind
 from .prompt import (
     HumanImageMessagePromptTemplate,
     create_chat_prompt,
     create_instruction_prompt,
 )
+from .ratelimit import rate_limit_gate, rate_limiter_for
 from .settings import FuncchainSettings
-from .streaming import stream_handler
+from .streaming import InvokeStreamBinding, stream_handler
+from .tracing import TracedRunnable
+from .usage import metered, price_for
 
 ChainOutput = TypeVar("ChainOutput")
 
@@ -48,6 +64,8 @@ def create_union_chain(
     llm: BaseChatModel,
     leading_runnable: Runnable[dict[str, Any], Any],
     input_kwargs: dict[str, Any],
+    settings: FuncchainSettings,
+    callbacks: list[BaseCallbackHandler] = [],
 ) -> Runnable[dict[str, Any], Any]:
     """
     Compile a langchain runnable chain from the funcchain syntax.
@@ -61,8 +79,7 @@ def create_union_chain(
 
     functions = multi_pydantic_to_functions(output_types)
 
-    _llm = llm
-    llm = _llm.bind(**functions)  # type: ignore
+    bound = _add_custom_callbacks(llm.bind(**functions), llm, callbacks, settings)
 
     prompt = create_chat_prompt(
         system,
@@ -77,9 +94,17 @@ def create_union_chain(
 
     return (
         leading_runnable
-        | prompt
-        | llm
-        | RetryOpenAIFunctionPydanticUnionParser(output_types=output_types, retry=3, retry_llm=_llm)
+        | _add_rate_limit(TracedRunnable("prompt_format", prompt), llm, settings)
+        | _trace_model(_wrap_model(bound, llm, settings), llm)
+        | TracedRunnable(
+            "parse",
+            RetryOpenAIFunctionPydanticUnionParser(
+                output_types=output_types,
+                retry=settings.retry_parse,
+                retry_llm=llm,
+                retry_policy=settings.retry_policy(),
+            ),
+        )
     )
 
 
@@ -87,17 +112,23 @@ def patch_openai_function_to_pydantic(
     llm: BaseChatModel,
     output_type: type[BaseModel],
     input_kwargs: dict[str, Any],
+    settings: FuncchainSettings,
     primitive_type: bool = False,
-) -> tuple[BaseChatModel, BaseGenerationOutputParser]:
+) -> tuple[Runnable[Any, BaseMessage], BaseGenerationOutputParser]:
     input_kwargs["format_instructions"] = f"Extract to {output_type.__name__}."
     functions = pydantic_to_functions(output_type)
 
-    _llm = llm
-    llm = llm.bind(**functions)  # type: ignore
+    bound = llm.bind(**functions)
 
+    parser_kwargs: dict[str, Any] = {
+        "pydantic_schema": output_type,
+        "retry": settings.retry_parse,
+        "retry_llm": llm,
+        "retry_policy": settings.retry_policy(),
+    }
     if not primitive_type:
-        return llm, RetryOpenAIFunctionPydanticParser(pydantic_schema=output_type, retry=3, retry_llm=_llm)
-    return llm, RetryOpenAIFunctionPrimitiveTypeParser(pydantic_schema=output_type, retry=3, retry_llm=_llm)
+        return bound, RetryOpenAIFunctionPydanticParser(**parser_kwargs)
+    return bound, RetryOpenAIFunctionPrimitiveTypeParser(**parser_kwargs)
 
 
 def create_chain(
@@ -114,10 +145,17 @@ def create_chain(
     Compile a langchain runnable chain from the funcchain syntax.
     """
     # large language model
-    _llm = _gather_llm(settings)
-    llm = _add_custom_callbacks(_llm, settings)
-
-    parser = parser_for(output_types, retry=settings.retry_parse, llm=llm)
+    # (shared instance, per call configuration is only applied through bindings)
+    llm = _gather_llm(settings)
+    callbacks = _gather_callbacks(settings)
+    streaming = settings.streaming or bool(callbacks)
+
+    parser = parser_for(
+        output_types,
+        retry=settings.retry_parse,
+        llm=llm,
+        retry_policy=settings.retry_policy(),
+    )
 
     # TODO collect types from input_args
     # -> this would allow special prompt templating based on certain types
@@ -159,15 +197,16 @@ def create_chain(
             **{name: dep.dependency for name, dep in dependencies},  # type: ignore
         }
     )
+    if dependencies:
+        leading_runnable = TracedRunnable("dependencies", leading_runnable)
 
     # TODO: change this into input_args
     input_kwargs = {k: "" for k in (prompt_args + pydantic_args)}
 
     # add format instructions for parser
     f_instructions = None
-    if parser and (settings.streaming or not is_openai_function_model(llm)):
-        # streaming behavior is not supported for function models
-        # but for normal function models we do not need to add format instructions
+    if parser and not is_openai_function_model(llm):
+        # function models (also when streaming) do not need format instructions
         if not isinstance(parser, BaseOutputParser):
             raise NotImplementedError("Fix this")
         instruction, f_instructions = _add_format_instructions(
@@ -195,7 +234,7 @@ def create_chain(
         input_kwargs,
         format_instructions=f_instructions,
     )
-    chat_prompt = create_chat_prompt(system, instruction_prompt, context, memory)
+    chat_prompt = create_chat_prompt(system, instruction_prompt, context, memory, strip_images=not is_vision_model(llm))
 
     # TODO: think why this was needed
     # # add formatted instruction to chat history
@@ -213,7 +252,7 @@ def create_chain(
     # else:
     #     structured_llm = None
 
-    _inject_grammar_for_local_models(llm, output_types, parser)
+    bound = _bind_grammar_for_local_models(llm, output_types, parser)
 
     # function model patches
     if is_openai_function_model(llm):
@@ -227,20 +266,22 @@ def create_chain(
                 llm,
                 leading_runnable,
                 input_kwargs,
+                settings,
+                callbacks,
             )
         if isinstance(parser, RetryJsonPydanticParser) or isinstance(parser, RetryJsonPrimitiveTypeParser):
             output_type = parser.pydantic_object
             if issubclass(output_type, BaseModel) and not issubclass(output_type, ParserBaseModel):
-                # openai json streaming
-                if settings.streaming and hasattr(llm, "model_kwargs"):
-                    llm.model_kwargs = {"response_format": {"type": "json_object"}}
                 # primitive types
-                elif isinstance(parser, RetryJsonPrimitiveTypeParser):
-                    llm, parser = patch_openai_function_to_pydantic(llm, output_type, input_kwargs, primitive_type=True)
+                # (streamed as function call argument deltas when streaming)
+                if isinstance(parser, RetryJsonPrimitiveTypeParser):
+                    bound, parser = patch_openai_function_to_pydantic(
+                        llm, output_type, input_kwargs, settings, primitive_type=True
+                    )
                 # pydantic types
                 else:
                     assert isinstance(parser, RetryJsonPydanticParser)
-                    llm, parser = patch_openai_function_to_pydantic(llm, output_type, input_kwargs)
+                    bound, parser = patch_openai_function_to_pydantic(llm, output_type, input_kwargs, settings)
             # custom parsers
             elif issubclass(output_type, ParserBaseModel):
                 # todo maybe add custom openai function parsing
@@ -251,31 +292,43 @@ def create_chain(
             # todo implement
             raise NotImplementedError("Union types are not yet supported for json mode models.")
         if isinstance(parser, RetryJsonPydanticParser) or isinstance(parser, RetryJsonPrimitiveTypeParser):
-            output_type = parser.pydantic_object
-            assert hasattr(llm, "model_kwargs")
-            llm.model_kwargs = {"response_format": {"type": "json_object"}}
+            bound = bound.bind(response_format={"type": "json_object"})
 
     assert parser is not None
-    return leading_runnable | chat_prompt | llm | parser
+    bound = _add_stop_sequences(bound, llm, parser, settings)
+    bound = _add_custom_callbacks(bound, llm, callbacks, settings)
+
+    return (
+        leading_runnable
+        | _add_rate_limit(TracedRunnable("prompt_format", chat_prompt), llm, settings)
+        | _trace_model(_wrap_model(bound, llm, settings, parser, streaming), llm)
+        | TracedRunnable("parse", parser)
+    )
 
 
 def compile_chain(signature: Signature, temp_images: list[Image] = []) -> Runnable[dict[str, Any], ChainOutput]:
     """
     Compile a signature to a runnable chain.
     """
+    if signature.settings.cascade:
+        return create_cascade_chain(signature, temp_images)
+
     system = (
         [msg for msg in signature.history if isinstance(msg, SystemMessage)] or [None]  # type: ignore
     )[0]
 
-    from ..utils.memory import ChatMessageHistory
-
-    memory = ChatMessageHistory(messages=signature.history)
+    if signature.memory is not None:
+        memory = signature.memory
+        context = [msg for msg in signature.history if msg is not system]
+    else:
+        # history referenced without validating (copying) the messages
+        memory, context = ChatMessageHistory.construct(messages=signature.history), []
 
     return create_chain(
         msg_to_str(system) if system else "",
         signature.instruction,
         signature.output_types,
-        signature.history,
+        context,
         memory,
         signature.settings,
         signature.input_args,
@@ -283,6 +336,33 @@ def compile_chain(signature: Signature, temp_images: list[Image] = []) -> Runnab
     )
 
 
+def create_cascade_chain(signature: Signature, temp_images: list[Image] = []) -> CascadeChain:
+    """
+    Compile one chain per model of the cascade, the higher tiers only when escalating to them.
+    Only the last tier retries parsing, lower tiers escalate instead.
+    """
+    settings = signature.settings
+    history = list(signature.history)
+
+    def compile_tier(i: int, llm: str | BaseChatModel) -> Callable[[], Runnable[dict[str, Any], Any]]:
+        update: dict[str, Any] = {"llm": llm, "cascade": []}
+        if i < len(settings.cascade) - 1:
+            update["retry_parse"] = 0
+        tier_signature = signature.copy(
+            update={
+                "settings": settings.model_copy(update=update),
+                "history": list(history),
+            }
+        )
+        return lambda: compile_chain(tier_signature, temp_images)
+
+    tiers: list[tuple[str, Tier]] = [
+        (llm if isinstance(llm, str) else get_model_id(llm), compile_tier(i, llm))
+        for i, llm in enumerate(settings.cascade)
+    ]
+    return CascadeChain(tiers, check=settings.cascade_check)
+
+
 def _add_format_instructions(
     parser: BaseOutputParser,
     instruction: str,
@@ -311,10 +391,10 @@ def _crop_large_inputs(
     """
     Crop large inputs to avoid exceeding the maximum number of tokens.
     """
-    base_tokens = count_tokens(instruction + system)
+    base_tokens = estimate_tokens(instruction + system)
     for k, v in input_kwargs.copy().items():
         if isinstance(v, str):
-            content_tokens = count_tokens(v)
+            content_tokens = estimate_tokens(v)
             if base_tokens + content_tokens > settings.context_lenght:
                 input_kwargs[k] = v[: (settings.context_lenght - base_tokens) * 2 // 3]
                 print("Truncated: ", len(input_kwargs[k]))
@@ -335,20 +415,19 @@ def _handle_images(
                 del input_kwargs[k]
     elif images:
         raise RuntimeError("Images as input are only supported for vision models.")
-    elif _history_contains_images(memory):
+    elif history_stats(memory).images:
         print("Warning: Images in chat history are ignored for non-vision models.")
-        memory.messages = _clear_images_from_history(memory.messages)
 
     return images
 
 
-def _inject_grammar_for_local_models(
+def _bind_grammar_for_local_models(
     llm: BaseChatModel,
     output_types: list[type],
     parser: BaseOutputParser | BaseGenerationOutputParser,
-) -> None:
+) -> Runnable[Any, BaseMessage]:
     """
-    Inject GBNF grammar into local models.
+    Bind the GBNF grammar of the output type to local models.
     """
     try:
         from funcchain.model.patches.ollama import ChatOllama
@@ -362,9 +441,9 @@ def _inject_grammar_for_local_models(
             if issubclass(output_type, BaseModel) and not issubclass(output_type, ParserBaseModel):
                 assert isinstance(parser, RetryJsonPydanticParser)
                 output_type = parser.pydantic_object
-                llm.grammar = pydantic_to_grammar(output_type)
+                return llm.bind(grammar=pydantic_to_grammar(output_type))
             if issubclass(output_type, ParserBaseModel):
-                llm.grammar = output_type.custom_grammar()
+                return llm.bind(grammar=output_type.custom_grammar())
     try:
         from llama_cpp import LlamaGrammar
 
@@ -379,19 +458,17 @@ def _inject_grammar_for_local_models(
             output_type = output_types[0]
             if isinstance(parser, RetryJsonPydanticParser) or isinstance(parser, RetryJsonPrimitiveTypeParser):
                 output_type = parser.pydantic_object
+                grammar: str | None = None
 
                 if issubclass(output_type, BaseModel) and not issubclass(output_type, ParserBaseModel):
                     assert isinstance(parser, RetryJsonPydanticParser)
                     output_type = parser.pydantic_object
-                    grammar: str | None = pydantic_to_grammar(output_type)
+                    grammar = pydantic_to_grammar(output_type)
                 if issubclass(output_type, ParserBaseModel):
                     grammar = output_type.custom_grammar()
                 if grammar:
-                    setattr(
-                        llm,
-                        "grammar",
-                        LlamaGrammar.from_string(grammar, verbose=False),
-                    )
+                    return llm.bind(grammar=LlamaGrammar.from_string(grammar, verbose=False))
+    return llm
 
 
 def _gather_llm(settings: FuncchainSettings) -> BaseChatModel:
@@ -408,8 +485,8 @@ def _gather_llm(settings: FuncchainSettings) -> BaseChatModel:
     return llm
 
 
-def _add_custom_callbacks(llm: BaseChatModel, settings: FuncchainSettings) -> BaseChatModel:
-    callbacks: Callbacks = []
+def _gather_callbacks(settings: FuncchainSettings) -> list[BaseCallbackHandler]:
+    callbacks: list[BaseCallbackHandler] = []
 
     if handler := stream_handler.get():
         callbacks = [handler]
@@ -421,34 +498,164 @@ def _add_custom_callbacks(llm: BaseChatModel, settings: FuncchainSettings) -> Ba
             AsyncStreamHandler(print, {"end": "", "flush": True}),
         ]
 
-    if callbacks:
-        settings.streaming = True
-        if hasattr(llm, "streaming"):
-            llm.streaming = True
-        llm.callbacks = callbacks
+    return callbacks
 
-    return llm
+
+def _add_custom_callbacks(
+    bound: Runnable[Any, BaseMessage],
+    llm: BaseChatModel,
+    callbacks: list[BaseCallbackHandler],
+    settings: FuncchainSettings,
+) -> Runnable[Any, BaseMessage]:
+    """
+    Stream tokens of this call to the custom callbacks,
+    the token price is passed as metadata to count the cost.
+    """
+    if not callbacks:
+        return bound
+    if type(llm)._stream is not BaseChatModel._stream:
+        bound = InvokeStreamBinding(bound=bound, kwargs={"stream": True})
+    if price := price_for(get_model_id(llm), settings.token_prices):
+        return bound.with_config(callbacks=callbacks, metadata={"token_price": price})
+    return bound.with_config(callbacks=callbacks)
 
 
-def _history_contains_images(history: BaseChatMessageHistory) -> bool:
+def _add_rate_limit(
+    prompt: Runnable[Any, PromptValue],
+    llm: BaseChatModel,
+    settings: FuncchainSettings,
+) -> Runnable[Any, PromptValue]:
     """
-    Check if the chat history contains images.
+    Throttle the prompt before it reaches the model
+    in case a rate limit is configured for it.
     """
-    for message in history.messages:
-        if isinstance(message.content, list):
-            for content in message.content:
-                if isinstance(content, dict) and content.get("type") == "image_url":
-                    return True
-    return False
+    if limiter := rate_limiter_for(llm, settings.rate_limits):
+        return prompt | rate_limit_gate(limiter, settings.max_tokens)
+    return prompt
 
 
-def _clear_images_from_history(history: list[BaseMessage]) -> list[BaseMessage]:
+def _trace_model(model: Runnable[Any, BaseMessage], llm: BaseChatModel) -> Runnable[Any, BaseMessage]:
+    """
+    Record the generation (and time to first token when streaming) of the model.
+    """
+    return TracedRunnable("generation", model, model=get_model_id(llm))
+
+
+def _wrap_model(
+    bound: Runnable[Any, BaseMessage],
+    llm: BaseChatModel,
+    settings: FuncchainSettings,
+    parser: BaseOutputParser | BaseGenerationOutputParser | None = None,
+    streaming: bool = False,
+) -> Runnable[Any, BaseMessage]:
+    """
+    Add cassette recording/replay, usage accounting, early termination,
+    the adaptive concurrency limiter and request hedging to the (bound) model.
+    """
+    model = _add_concurrency_limit(
+        _add_early_stop(
+            _add_usage_accounting(_add_cassette(bound, llm, settings.llm), llm, settings), parser, settings, streaming
+        ),
+        llm,
+        settings,
+    )
+    if not settings.hedging:
+        return model
+
+    if not settings.hedge_llm:
+        limiter = rate_limiter_for(llm, settings.rate_limits)
+        return HedgedModel(model, llm, limiter=limiter, max_tokens=settings.max_tokens, **settings.hedge_kwargs())
+
+    # hedge requests to a fallback model with the same bindings
+    hedge_llm = univeral_model_selector(settings.model_copy(update={"llm": settings.hedge_llm}))
+    hedge_bound = _add_usage_accounting(
+        _add_cassette(rebind(bound, hedge_llm), hedge_llm, settings.hedge_llm), hedge_llm, settings
+    )
+    hedge = _add_concurrency_limit(_add_early_stop(hedge_bound, parser, settings, streaming), hedge_llm, settings)
+    return HedgedModel(
+        model,
+        llm,
+        hedge=hedge,
+        hedge_llm=hedge_llm,
+        limiter=rate_limiter_for(hedge_llm, settings.rate_limits),
+        max_tokens=settings.max_tokens,
+        **settings.hedge_kwargs(),
+    )
+
+
+def _add_cassette(
+    bound: Runnable[Any, BaseMessage],
+    llm: BaseChatModel,
+    selector: str | BaseChatModel | None,
+) -> Runnable[Any, BaseMessage]:
+    """
+    Record the model interactions into the active cassette
+    or replay them by binding a stand-in model instead.
+    """
+    if not (cassette := active_cassette()):
+        return bound
+    if cassette.replaying:
+        return rebind(bound, cassette.replay_model(llm))
+    if isinstance(selector, str):
+        cassette.add_model(selector, llm)
+    return CassetteModel(bound, cassette, llm)
+
+
+def _add_usage_accounting(
+    bound: Runnable[Any, BaseMessage],
+    llm: BaseChatModel,
+    settings: FuncchainSettings,
+) -> Runnable[Any, BaseMessage]:
+    """
+    Record the tokens, cost and latency of every model request.
+    """
+    if settings.usage_accounting:
+        return metered(bound, llm, settings.token_prices)
+    return bound
+
+
+def _add_early_stop(
+    bound: Runnable[Any, BaseMessage],
+    parser: BaseOutputParser | BaseGenerationOutputParser | None,
+    settings: FuncchainSettings,
+    streaming: bool,
+) -> Runnable[Any, BaseMessage]:
+    """
+    Close the model stream as soon as the structured output is complete and valid,
+    streaming calls also stream internally when invoked.
+    """
+    if settings.early_stop and parser and (completion := completion_for(parser)):
+        return EarlyStopModel(bound, completion, stream_invoke=streaming)
+    return bound
+
+
+def _add_stop_sequences(
+    bound: Runnable[Any, BaseMessage],
+    llm: BaseChatModel,
+    parser: BaseOutputParser | BaseGenerationOutputParser,
+    settings: FuncchainSettings,
+) -> Runnable[Any, BaseMessage]:
+    """
+    Derive stop sequences from the output type
+    unless the output is already constrained (grammar, json mode, function calling).
+    """
+    if not settings.stop_sequences or not supports_stop_sequences(llm):
+        return bound
+    if isinstance(bound, RunnableBinding) and {"grammar", "response_format", "functions"} & set(bound.kwargs):
+        return bound
+    if stop := stop_sequences_for(parser):
+        return bound.bind(stop=stop)
+    return bound
+
+
+def _add_concurrency_limit(
+    bound: Runnable[Any, BaseMessage],
+    llm: BaseChatModel,
+    settings: FuncchainSettings,
+) -> Runnable[Any, BaseMessage]:
     """
-    Remove images from the chat history.
+    Run async model calls inside the adaptive concurrency limiter of the model.
     """
-    for message in history:
-        if isinstance(message.content, list):
-            for content in message.content:
-                if isinstance(content, dict) and content.get("type") == "image_url":
-                    message.content.remove(content)
-    return history
+    if settings.adaptive_concurrency:
+        return concurrency_limited(bound, llm, **settings.concurrency_kwargs())
+    return bound
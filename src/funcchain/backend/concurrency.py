@@ -0,0 +1,237 @@
+"""
+Adaptive Concurrency:
+AIMD controller limiting the in-flight requests per provider/model on the async path.
+"""
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from threading import Lock
+from typing import Any, AsyncIterator, Optional
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from ..model.abilities import get_model_id
+from .metrics import Gauge, Metric, metrics
+from .wrapper import RunnableWrapper, WrappedCall
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """
+    Check if an exception signals provider overload (429 or 5xx).
+    """
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    name = type(error).__name__
+    return "RateLimit" in name or "Overloaded" in name or "ServiceUnavailable" in name
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Additive increase / multiplicative decrease of the in-flight limit.
+    The limit grows by ~1 per window of successful requests while latency is healthy
+    and gets cut on 429/5xx errors or when latency exceeds the tolerated baseline.
+
+    Waiters are woken in FIFO order and can live on different event loops.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.initial_limit = initial_limit
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.baseline_latency: float | None = None
+        self._last_decrease = 0.0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._granted: set[asyncio.Future[None]] = set()
+        self._lock = Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def metrics(self) -> dict[str, float]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "baseline_latency": self.baseline_latency or 0.0,
+        }
+
+    def configure(
+        self,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 256,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        """
+        Apply changed settings, the learned limit only restarts if the initial limit changed.
+        """
+        with self._lock:
+            if initial_limit != self.initial_limit:
+                self.initial_limit = initial_limit
+                self.limit = float(initial_limit)
+            self.min_limit = min_limit
+            self.max_limit = max_limit
+            self.latency_tolerance = latency_tolerance
+            self.decrease_factor = decrease_factor
+            self.limit = min(max(self.limit, min_limit), max_limit)
+            self._wake_waiters()
+
+    async def acquire(self) -> None:
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                return
+            waiter: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                granted = waiter in self._granted
+                self._granted.discard(waiter)
+            if granted:
+                self.release()
+            raise
+        with self._lock:
+            self._granted.discard(waiter)
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if overloaded or (latency is not None and self._is_spike(latency)):
+                self._decrease()
+            elif latency is not None:
+                self._increase(latency)
+            self._wake_waiters()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(overloaded=is_overload_error(e))
+            raise
+        else:
+            self.release(latency=time.monotonic() - start)
+
+    def _is_spike(self, latency: float) -> bool:
+        return self.baseline_latency is not None and latency > self.baseline_latency * self.latency_tolerance
+
+    def _increase(self, latency: float) -> None:
+        self.baseline_latency = (
+            latency if self.baseline_latency is None else 0.9 * self.baseline_latency + 0.1 * latency
+        )
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self) -> None:
+        # only back off once per latency window to not collapse on a burst of errors
+        now = time.monotonic()
+        if now - self._last_decrease < (self.baseline_latency or 0.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    def _wake_waiters(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            self._granted.add(waiter)
+            waiter.get_loop().call_soon_threadsafe(_resolve, waiter)
+
+
+def _resolve(waiter: asyncio.Future[None]) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_concurrency_limiters: dict[str, AdaptiveConcurrencyLimiter] = {}
+_registry_lock = Lock()
+
+
+_limiter_kwargs: dict[str, dict[str, Any]] = {}
+
+
+def get_concurrency_limiter(model_id: str, **limiter_kwargs: Any) -> AdaptiveConcurrencyLimiter:
+    """
+    Get the shared concurrency limiter for a provider/model,
+    reconfigured when the settings changed.
+    """
+    with _registry_lock:
+        if (limiter := _concurrency_limiters.get(model_id)) is None:
+            limiter = _concurrency_limiters[model_id] = AdaptiveConcurrencyLimiter(**limiter_kwargs)
+        elif _limiter_kwargs[model_id] != limiter_kwargs:
+            limiter.configure(**limiter_kwargs)
+        _limiter_kwargs[model_id] = limiter_kwargs
+        return limiter
+
+
+def concurrency_metrics() -> dict[str, dict[str, float]]:
+    """
+    Current limit, in-flight requests and queue depth per provider/model.
+    """
+    with _registry_lock:
+        return {model_id: limiter.metrics() for model_id, limiter in _concurrency_limiters.items()}
+
+
+def _collect_metrics() -> list[Metric]:
+    limit = Gauge("funcchain_concurrency_limit", "Adaptive in-flight limit.", ("model",))
+    in_flight = Gauge("funcchain_concurrency_in_flight", "Requests holding a concurrency slot.", ("model",))
+    queue_depth = Gauge("funcchain_concurrency_queue_depth", "Requests waiting for a concurrency slot.", ("model",))
+    for model_id, values in concurrency_metrics().items():
+        limit.set(model_id, value=values["limit"])
+        in_flight.set(model_id, value=values["in_flight"])
+        queue_depth.set(model_id, value=values["queue_depth"])
+    return [limit, in_flight, queue_depth] if _concurrency_limiters else []
+
+
+metrics.register_collector("concurrency", _collect_metrics)
+
+
+class ConcurrencyLimitedModel(RunnableWrapper[LanguageModelInput, BaseMessage]):
+    """
+    Wraps a (bound) chat model to run async calls inside the adaptive limiter.
+    Sync calls pass through unchanged.
+    """
+
+    def __init__(self, bound: Runnable[LanguageModelInput, BaseMessage], limiter: AdaptiveConcurrencyLimiter) -> None:
+        super().__init__(bound)
+        self.limiter = limiter
+
+    @asynccontextmanager
+    async def acall(
+        self, input: LanguageModelInput, config: RunnableConfig | None, stream: bool
+    ) -> AsyncIterator[WrappedCall[BaseMessage]]:
+        async with self.limiter.slot():
+            yield WrappedCall(config)
+
+
+def concurrency_limited(
+    bound: Runnable[LanguageModelInput, BaseMessage],
+    llm: BaseChatModel,
+    **limiter_kwargs: Any,
+) -> ConcurrencyLimitedModel:
+    return ConcurrencyLimitedModel(bound, get_concurrency_limiter(get_model_id(llm), **limiter_kwargs))
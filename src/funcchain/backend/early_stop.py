@@ -0,0 +1,134 @@
+"""
+Early Termination:
+Stop the generation as soon as the structured output is complete and valid
+instead of paying for trailing commentary or repeated output.
+"""
+
+import json
+import re
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+from langchain_core.language_models import LanguageModelInput
+from langchain_core.messages import BaseMessage
+from langchain_core.output_parsers import BaseGenerationOutputParser, BaseOutputParser
+from langchain_core.runnables import Runnable, RunnableConfig
+from pydantic import BaseModel, ValidationError
+
+from ..parser.custom import CustomPydanticOutputParser
+from ..parser.json_schema import RetryJsonPydanticParser
+from ..parser.partial import PartialJsonScanner
+from ..syntax.output_types import CodeBlock
+from ..utils.msg_tools import msg_to_str
+from .wrapper import RunnableWrapper, WrappedCall
+
+
+class CompletionCheck:
+    """
+    Consumes the streamed text and tells when the output is complete.
+    """
+
+    def feed(self, delta: str) -> bool:
+        raise NotImplementedError
+
+
+class JsonCompletion(CompletionCheck):
+    """
+    Complete once the outer JSON object is balanced and validates.
+    """
+
+    def __init__(self, model: type[BaseModel]) -> None:
+        self.model = model
+        self.scanner = PartialJsonScanner(track_fields=False)
+
+    def feed(self, delta: str) -> bool:
+        if self.scanner.done:
+            # checked once, an invalid object is left to the parser (and its retries)
+            return False
+        self.scanner.feed(delta)
+        if not (text := self.scanner.object_text()):
+            return False
+        try:
+            self.model.model_validate(json.loads(text, strict=False))
+            return True
+        except (json.JSONDecodeError, ValidationError):
+            return False
+
+
+class FenceCompletion(CompletionCheck):
+    """
+    Complete once the closing fence of the code block arrived.
+    Markdown blocks are never complete early as they can contain nested fences.
+    """
+
+    def __init__(self) -> None:
+        self._text = ""
+        self._searched = 0
+        self._fences: list[int] = []
+
+    def feed(self, delta: str) -> bool:
+        self._text += delta
+        while len(self._fences) < 2 and (i := self._text.find("```", self._searched)) != -1:
+            self._fences.append(i)
+            self._searched = i + 3
+        if len(self._fences) < 2:
+            self._searched = max(self._searched, len(self._text) - 2)
+            return False
+        language = re.match(r"```(\w*)", self._text[self._fences[0] :])
+        return not (language and language.group(1) == "markdown")
+
+
+def completion_for(
+    parser: BaseOutputParser | BaseGenerationOutputParser,
+) -> Optional[Callable[[], CompletionCheck]]:
+    """
+    Completion check factory for the text based structured output parsers.
+    """
+    if isinstance(parser, RetryJsonPydanticParser):
+        return lambda: JsonCompletion(parser.pydantic_object)
+    if isinstance(parser, CustomPydanticOutputParser) and issubclass(parser.pydantic_object, CodeBlock):
+        return FenceCompletion
+    return None
+
+
+def stop_sequences_for(parser: BaseOutputParser | BaseGenerationOutputParser) -> list[str]:
+    """
+    Stop sequences marking the end of the structured output (commentary after a fenced json block).
+    Only used when enabled, as the parsers also accept strings with raw newlines
+    which can contain the closing fence of a nested code block.
+    """
+    if isinstance(parser, RetryJsonPydanticParser):
+        return ["\n```\n"]
+    return []
+
+
+class EarlyStopModel(RunnableWrapper[LanguageModelInput, BaseMessage]):
+    """
+    Wraps a (bound) chat model and closes the stream (cancelling the generation)
+    as soon as the completion check succeeds.
+    If stream_invoke is set, invoke calls are also streamed internally to stop early.
+    """
+
+    def __init__(
+        self,
+        bound: Runnable[LanguageModelInput, BaseMessage],
+        completion: Callable[[], CompletionCheck],
+        stream_invoke: bool = False,
+    ) -> None:
+        super().__init__(bound, stream_invoke)
+        self.completion = completion
+
+    @contextmanager
+    def call(
+        self, input: LanguageModelInput, config: RunnableConfig | None, stream: bool
+    ) -> Iterator[WrappedCall[BaseMessage]]:
+        yield _EarlyStopCall(config, self.completion())
+
+
+class _EarlyStopCall(WrappedCall[BaseMessage]):
+    def __init__(self, config: RunnableConfig | None, completion: CompletionCheck) -> None:
+        super().__init__(config)
+        self.completion = completion
+
+    def on_chunk(self, chunk: BaseMessage) -> bool:
+        return self.completion.feed(msg_to_str(chunk) if chunk.content else "")
@@ -0,0 +1,226 @@
+"""
+Hedged Requests:
+Fire a duplicate request when the first one is slower than usual
+and continue with whichever finishes first.
+"""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from threading import Lock
+from typing import Any, AsyncIterator, Optional
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable, RunnableBinding, RunnableConfig
+
+from ..model.abilities import get_model_id
+from .ratelimit import RateLimiter, request_tokens
+from .wrapper import RunnableWrapper
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent latencies for one model.
+    """
+
+    def __init__(self, window: int = 200) -> None:
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = Lock()
+
+    def record(self, latency: float) -> None:
+        with self._lock:
+            self._samples.append(latency)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> float | None:
+        """Latency below which p (0-1) of the recent requests finished."""
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+_latency_trackers: dict[str, LatencyTracker] = {}
+_registry_lock = Lock()
+
+
+def get_latency_tracker(model_id: str, kind: str = "total") -> LatencyTracker:
+    """
+    Shared latency tracker per provider/model,
+    kind is "total" for completions or "first_token" for streams.
+    """
+    key = f"{model_id}:{kind}"
+    with _registry_lock:
+        if key not in _latency_trackers:
+            _latency_trackers[key] = LatencyTracker()
+        return _latency_trackers[key]
+
+
+def rebind(bound: Runnable, llm: BaseChatModel) -> Runnable:
+    """
+    Apply the bindings (functions, response format, config) of a bound model to another model.
+    """
+    if isinstance(bound, RunnableBinding):
+        return bound.copy(update={"bound": rebind(bound.bound, llm)})
+    return llm
+
+
+class _Request:
+    def __init__(self, model_id: str) -> None:
+        self.model_id = model_id
+        self.start = time.monotonic()
+
+    def record(self, kind: str = "total") -> None:
+        get_latency_tracker(self.model_id, kind).record(time.monotonic() - self.start)
+
+
+class HedgedModel(RunnableWrapper[LanguageModelInput, BaseMessage]):
+    """
+    Wraps a (bound) chat model and sends a hedge request to the same or a fallback model
+    when no result (or no first token when streaming) arrived within
+    the configured percentile of the recent latencies.
+
+    The hedge request counts against the rate limiter of its model and is skipped
+    when that would exceed the limit. Sync streams (`stream`) are not hedged.
+    """
+
+    def __init__(
+        self,
+        bound: Runnable[LanguageModelInput, BaseMessage],
+        llm: BaseChatModel,
+        hedge: Optional[Runnable[LanguageModelInput, BaseMessage]] = None,
+        hedge_llm: Optional[BaseChatModel] = None,
+        percentile: float = 0.95,
+        default_delay: float = 2.0,
+        min_samples: int = 20,
+        limiter: Optional[RateLimiter] = None,
+        max_tokens: int = 0,
+    ) -> None:
+        super().__init__(bound)
+        self.model_id = get_model_id(llm)
+        self.hedge = hedge or bound
+        self.hedge_model_id = get_model_id(hedge_llm) if hedge_llm else self.model_id
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self.limiter = limiter
+        self.max_tokens = max_tokens
+
+    def hedge_delay(self, kind: str = "total") -> float:
+        tracker = get_latency_tracker(self.model_id, kind)
+        if len(tracker) < self.min_samples:
+            return self.default_delay
+        return tracker.percentile(self.percentile) or self.default_delay
+
+    def _may_hedge(self, input: LanguageModelInput) -> bool:
+        # the primary request passed the rate limit gate before reaching the model
+        return self.limiter is None or self.limiter.try_acquire(request_tokens(input, self.max_tokens))
+
+    def invoke(self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any) -> BaseMessage:
+        # running threads can not be cancelled, the result of the slower request is discarded
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            requests = {}
+
+            def submit(model: Runnable, model_id: str) -> None:
+                future = executor.submit(copy_context().run, lambda: model.invoke(input, config, **kwargs))
+                requests[future] = _Request(model_id)
+
+            submit(self.bound, self.model_id)
+            done, _ = wait(list(requests), timeout=self.hedge_delay())
+            if not done and self._may_hedge(input):
+                submit(self.hedge, self.hedge_model_id)
+            pending = set(requests)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        requests[future].record()
+                        return future.result()
+                    if not pending:
+                        return future.result()
+            raise RuntimeError("unreachable")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def ainvoke(
+        self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any
+    ) -> BaseMessage:
+        requests: dict[asyncio.Future, _Request] = {}
+
+        def start(model: Runnable, model_id: str) -> None:
+            requests[asyncio.ensure_future(model.ainvoke(input, config, **kwargs))] = _Request(model_id)
+
+        start(self.bound, self.model_id)
+        try:
+            done, _ = await asyncio.wait(list(requests), timeout=self.hedge_delay())
+            if not done and self._may_hedge(input):
+                start(self.hedge, self.hedge_model_id)
+            pending = set(requests)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        requests[task].record()
+                        return task.result()
+                    if not pending:
+                        return task.result()
+            raise RuntimeError("unreachable")
+        finally:
+            for task in requests:
+                task.cancel()
+
+    async def astream(
+        self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any | None
+    ) -> AsyncIterator[BaseMessage]:
+        streams: dict[asyncio.Future, tuple[AsyncIterator[BaseMessage], _Request]] = {}
+
+        def start(model: Runnable, model_id: str) -> None:
+            iterator = model.astream(input, config, **kwargs).__aiter__()
+            streams[asyncio.ensure_future(iterator.__anext__())] = (iterator, _Request(model_id))
+
+        start(self.bound, self.model_id)
+        winner: Optional[AsyncIterator[BaseMessage]] = None
+        first_chunk: Optional[BaseMessage] = None
+        try:
+            done, _ = await asyncio.wait(list(streams), timeout=self.hedge_delay("first_token"))
+            if not done and self._may_hedge(input):
+                start(self.hedge, self.hedge_model_id)
+            pending = set(streams)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    iterator, request = streams[task]
+                    if isinstance(task.exception(), StopAsyncIteration):
+                        return
+                    if task.exception() is None:
+                        request.record("first_token")
+                        winner, first_chunk = iterator, task.result()
+                        break
+                    if not pending:
+                        task.result()
+        finally:
+            for task, (iterator, _) in streams.items():
+                if iterator is not winner:
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                    await _aclose(iterator)
+
+        assert winner is not None and first_chunk is not None
+        yield first_chunk
+        async for chunk in winner:
+            yield chunk
+
+
+async def _aclose(iterator: AsyncIterator) -> None:
+    if aclose := getattr(iterator, "aclose", None):
+        try:
+            await aclose()
+        except (Exception, asyncio.CancelledError):
+            pass
@@ -0,0 +1,260 @@
+"""
+Load Testing:
+Drive a funcchain function with concurrent callers (closed loop) or at a fixed arrival rate (open loop)
+and report throughput, latency percentiles, time to first token, retry rate and errors.
+
+Usage:
+    python -m funcchain.backend.loadtest my_app.chains:summarize --kwargs '{"text": "..."}' \\
+        --llm fake/gpt-4o --concurrency 16 --duration 30
+"""
+
+import argparse
+import asyncio
+import importlib
+import inspect
+import json
+import random
+import time
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, Optional, Union
+
+from .settings import settings
+from .streaming import astream_to
+from .tracing import Trace, trace_to
+
+CallKwargs = Union[dict[str, Any], Callable[[int], dict[str, Any]]]
+
+
+def percentile(values: list[float], p: float) -> Optional[float]:
+    """
+    Value below which p (0-1) of the values are.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+def _distribution(values: list[float]) -> Optional[dict[str, Optional[float]]]:
+    if not values:
+        return None
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values),
+    }
+
+
+class LoadTestReport:
+    """
+    Results of a load test, latencies are in seconds.
+    """
+
+    def __init__(self, name: str, concurrency: Optional[int], rate: Optional[float]) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = 0.0
+        self.latencies: list[float] = []
+        """ Latencies of the successful calls (including queueing in open loop mode). """
+        self.ttfts: list[float] = []
+        self.retries = 0
+        self.errors: dict[str, int] = {}
+
+    @property
+    def succeeded(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def failed(self) -> int:
+        return sum(self.errors.values())
+
+    @property
+    def requests(self) -> int:
+        return self.succeeded + self.failed
+
+    @property
+    def requests_per_s(self) -> float:
+        return self.requests / self.duration if self.duration else 0.0
+
+    @property
+    def retry_rate(self) -> float:
+        """Parse retries per request."""
+        return self.retries / self.requests if self.requests else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "mode": "open" if self.rate else "closed",
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "duration": self.duration,
+            "requests": self.requests,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "requests_per_s": self.requests_per_s,
+            "latency": _distribution(self.latencies),
+            "ttft": _distribution(self.ttfts),
+            "retry_rate": self.retry_rate,
+            "errors": dict(self.errors),
+        }
+
+    def __str__(self) -> str:
+        def ms(distribution: Optional[dict[str, Optional[float]]]) -> str:
+            if not distribution:
+                return "-"
+            return "  ".join(f"{key} {(value or 0) * 1000:.1f}ms" for key, value in distribution.items())
+
+        mode = f"{self.rate}/s open loop" if self.rate else f"{self.concurrency} concurrent callers"
+        lines = [
+            f"{self.name}: {self.requests} requests in {self.duration:.2f}s ({mode})",
+            f"  throughput  {self.requests_per_s:.2f} req/s",
+            f"  latency     {ms(_distribution(self.latencies))}",
+            f"  ttft        {ms(_distribution(self.ttfts))}",
+            f"  retry rate  {self.retry_rate:.3f}",
+            f"  errors      {self.failed} {self.errors or ''}",
+        ]
+        return "\n".join(lines)
+
+    def __repr__(self) -> str:
+        return f"LoadTestReport({self.name!r}, {self.requests} requests, {self.requests_per_s:.2f} req/s)"
+
+
+async def load_test(
+    fn: Callable[..., Any],
+    kwargs: CallKwargs = {},
+    *,
+    requests: Optional[int] = None,
+    duration: Optional[float] = None,
+    concurrency: Optional[int] = None,
+    rate: Optional[float] = None,
+    arrivals: str = "poisson",
+    stream: bool = False,
+) -> LoadTestReport:
+    """
+    Load test a funcchain function (async or sync, sync ones run in threads).
+
+    Closed loop (default): `concurrency` callers (default 8) call the function back to back.
+    Open loop: with `rate` requests per second arriving independently of the completions
+    ("poisson" or "uniform" arrivals), `concurrency` then optionally caps the in-flight requests.
+    Stops after `requests` calls or `duration` seconds (default 100 requests).
+    Set `stream` to stream the calls, which is needed to measure the time to first token.
+
+    Example:
+        >>> report = await load_test(summarize, {"text": "..."}, concurrency=16, duration=30)
+        >>> print(report)
+    """
+    if requests is None and duration is None:
+        requests = 100
+    if rate is None and concurrency is None:
+        concurrency = 8
+    report = LoadTestReport(getattr(fn, "__name__", str(fn)), concurrency, rate)
+    call = _as_async(fn)
+    kwargs_for = kwargs if callable(kwargs) else lambda _: kwargs
+
+    def collect(trace: Trace) -> None:
+        report.retries += sum(1 for span in trace.spans if span.stage == "retry")
+        report.ttfts.extend(span.duration for span in trace.spans if span.stage == "ttft")
+
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+    issued = 0
+
+    def next_index() -> Optional[int]:
+        nonlocal issued
+        if (requests is not None and issued >= requests) or (deadline and time.perf_counter() >= deadline):
+            return None
+        issued += 1
+        return issued - 1
+
+    async def timed_call(index: int, scheduled: float) -> None:
+        try:
+            await call(**kwargs_for(index))
+        except Exception as e:
+            name = type(e).__name__
+            report.errors[name] = report.errors.get(name, 0) + 1
+        else:
+            report.latencies.append(time.perf_counter() - scheduled)
+
+    with trace_to(collect):
+        async with astream_to(lambda token: None) if stream else nullcontext():
+            if rate is None:
+
+                async def worker() -> None:
+                    while (index := next_index()) is not None:
+                        await timed_call(index, time.perf_counter())
+
+                await asyncio.gather(*(worker() for _ in range(concurrency or 1)))
+            else:
+                limit = asyncio.Semaphore(concurrency) if concurrency else None
+
+                async def limited_call(index: int, scheduled: float) -> None:
+                    if limit is None:
+                        return await timed_call(index, scheduled)
+                    async with limit:
+                        await timed_call(index, scheduled)
+
+                tasks = []
+                scheduled = time.perf_counter()
+                while (index := next_index()) is not None:
+                    tasks.append(asyncio.create_task(limited_call(index, scheduled)))
+                    scheduled += random.expovariate(rate) if arrivals == "poisson" else 1 / rate
+                    await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                await asyncio.gather(*tasks)
+
+    report.duration = time.perf_counter() - start
+    return report
+
+
+def _as_async(fn: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    if inspect.iscoroutinefunction(fn):
+        return fn
+
+    async def call(**kwargs: Any) -> Any:
+        return await asyncio.to_thread(fn, **kwargs)
+
+    return call
+
+
+def _load_function(path: str) -> Callable[..., Any]:
+    module, _, name = path.partition(":")
+    if not name:
+        raise ValueError("Please pass the function as module.path:function_name.")
+    return getattr(importlib.import_module(module), name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test a funcchain function.")
+    parser.add_argument("function", help="module.path:function_name")
+    parser.add_argument("--kwargs", default="{}", help="JSON object of the keyword arguments of every call")
+    parser.add_argument("--llm", help="model selector string, e.g. fake/gpt-4o (default: settings.llm)")
+    parser.add_argument("--requests", type=int)
+    parser.add_argument("--duration", type=float, help="seconds")
+    parser.add_argument("--concurrency", type=int)
+    parser.add_argument("--rate", type=float, help="requests per second (open loop)")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--stream", action="store_true", help="stream the calls to measure the time to first token")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    if args.llm:
+        settings.llm = args.llm
+    report = asyncio.run(
+        load_test(
+            _load_function(args.function),
+            json.loads(args.kwargs),
+            requests=args.requests,
+            duration=args.duration,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            arrivals=args.arrivals,
+            stream=args.stream,
+        )
+    )
+    print(json.dumps(report.to_dict(), indent=2) if args.json else report)
+
+
+if __name__ == "__main__":
+    main()
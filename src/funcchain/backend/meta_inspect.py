@@ -60,11 +60,11 @@ def kwargs_from_parent() -> dict[str, Any]:
     return get_parent_frame(FUNC_DEPTH - 1).frame.f_locals
 
 
-def args_from_parent() -> list[tuple[str, type]]:
+def args_from_parent(f: Optional[FunctionType] = None) -> list[tuple[str, type]]:
     """
     Get input args with type hints from parent function
     """
-    return [(arg, t) for arg, t in get_func_obj().__annotations__.items() if arg != "return" and arg != "self"]
+    return [(arg, t) for arg, t in (f or get_func_obj()).__annotations__.items() if arg != "return" and arg != "self"]
 
 
 def gather_signature(
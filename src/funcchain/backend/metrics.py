@@ -0,0 +1,292 @@
+"""
+Metrics:
+In-process counters, gauges and histograms of funcchain calls, model requests, retries and caches.
+Exported as Prometheus text format or as plain dict snapshot, no external service needed.
+"""
+
+import math
+from bisect import bisect_left
+from threading import Lock
+from typing import Any, Callable, Optional, Sequence
+
+LabelValues = tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric:
+    """
+    Base of all metrics, values are stored per tuple of label values.
+    Updates hold a (per metric, uncontended in the common case) lock only for a dict update.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+
+    def _labels(self, labelvalues: tuple[Any, ...]) -> LabelValues:
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects the labels {self.labelnames}, got {labelvalues}.")
+        return tuple(str(value) for value in labelvalues)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        """
+        (sample name, labels, value) of all label combinations.
+        """
+        raise NotImplementedError
+
+    def snapshot(self) -> dict[str, Any]:
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[LabelValues, float] = {}
+
+    def inc(self, *labelvalues: Any, amount: float = 1.0) -> None:
+        key = self._labels(labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, *labelvalues: Any) -> float:
+        return self._values.get(self._labels(labelvalues), 0.0)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {"/".join(key): value for key, value in self._values.items()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labelvalues: Any, amount: float = 1.0) -> None:
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues: Any, value: float) -> None:
+        key = self._labels(labelvalues)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: counts per bucket (+Inf last), sum
+        self._values: dict[LabelValues, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labelvalues: Any) -> None:
+        key = self._labels(labelvalues)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            if (entry := self._values.get(key)) is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def _cumulative(self, counts: list[int]) -> list[int]:
+        total, cumulative = 0, []
+        for count in counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        samples: list[tuple[str, dict[str, str], float]] = []
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = self._cumulative(counts)
+            for bound, count in zip((*self.buckets, math.inf), cumulative):
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, count))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative[-1]))
+        return samples
+
+    def quantile(self, q: float, *labelvalues: Any) -> Optional[float]:
+        """
+        Estimated quantile (upper bound of the bucket containing it).
+        """
+        entry = self._values.get(self._labels(labelvalues))
+        if not entry or not (cumulative := self._cumulative(entry[0]))[-1]:
+            return None
+        rank = q * cumulative[-1]
+        for bound, count in zip((*self.buckets, math.inf), cumulative):
+            if count >= rank:
+                return bound
+        return math.inf
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        return {
+            "/".join(key): {"count": sum(counts), "sum": total, "buckets": dict(zip((*self.buckets, math.inf), counts))}
+            for key, counts, total in items
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics plus cache statistics collected at export time.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._caches: dict[str, Callable[[], Any]] = {}
+        self._collectors: dict[str, Callable[[], list[Metric]]] = {}
+        self._lock = Lock()
+
+    def _register(self, metric: Metric) -> Any:
+        with self._lock:
+            if existing := self._metrics.get(metric.name):
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} is already registered as {existing.type}.")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_cache(self, name: str, cache_info: Callable[[], Any]) -> None:
+        """
+        Report the hits and misses of a cache (e.g. `fn.cache_info` of a lru_cache).
+        """
+        self._caches[name] = cache_info
+
+    def register_collector(self, name: str, collect: Callable[[], list[Metric]]) -> None:
+        """
+        Add metrics created at export time from the current state of a component (e.g. limiters).
+        """
+        self._collectors[name] = collect
+
+    def _cache_metrics(self) -> list[Metric]:
+        hits = Counter("funcchain_cache_hits_total", "Cache hits.", ("cache",))
+        misses = Counter("funcchain_cache_misses_total", "Cache misses.", ("cache",))
+        for name, cache_info in self._caches.items():
+            info = cache_info()
+            hits.inc(name, amount=info.hits)
+            misses.inc(name, amount=info.misses)
+        return [hits, misses] if self._caches else []
+
+    def collect(self) -> list[Metric]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        collected = [metric for collect in list(self._collectors.values()) for metric in collect()]
+        return metrics + collected + self._cache_metrics()
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Plain dict of all metrics, label values joined by "/".
+        """
+        snapshot = {metric.name: metric.snapshot() for metric in self.collect()}
+        snapshot["funcchain_cache_hit_ratio"] = {
+            name: info.hits / (info.hits + info.misses) if info.hits + info.misses else 0.0
+            for name, info in ((name, cache_info()) for name, cache_info in self._caches.items())
+        }
+        return snapshot
+
+    def to_prometheus(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+        """
+        lines: list[str] = []
+        for metric in self.collect():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        for metric in self.collect():
+            metric.reset()
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+metrics = MetricsRegistry()
+""" Process wide metrics registry. """
+
+# funcchain calls
+chain_calls = metrics.counter("funcchain_calls_total", "Funcchain calls.", ("funcchain", "status"))
+chain_duration = metrics.histogram("funcchain_call_duration_seconds", "Funcchain call latency.", ("funcchain",))
+chain_in_flight = metrics.gauge("funcchain_calls_in_flight", "Running funcchain calls.", ("funcchain",))
+
+# model requests
+model_requests = metrics.counter("funcchain_model_requests_total", "Model requests.", ("model", "status"))
+model_duration = metrics.histogram("funcchain_model_request_duration_seconds", "Model request latency.", ("model",))
+model_ttft = metrics.histogram("funcchain_model_ttft_seconds", "Time to the first streamed chunk.", ("model",))
+model_in_flight = metrics.gauge("funcchain_model_requests_in_flight", "Running model requests.", ("model",))
+tokens = metrics.counter("funcchain_tokens_total", "Prompt and completion tokens.", ("funcchain", "model", "type"))
+cost = metrics.counter("funcchain_cost_usd_total", "Cost in USD.", ("funcchain", "model"))
+
+# parsing
+parse_retries = metrics.counter("funcchain_parse_retries_total", "Parse retries.", ("output_type",))
+parse_errors = metrics.counter("funcchain_parse_errors_total", "Parse errors without retries left.", ("output_type",))
+
+# model selection
+model_selections = metrics.counter("funcchain_model_selections_total", "Model instances created.", ("model",))
+model_selection_duration = metrics.histogram(
+    "funcchain_model_selection_duration_seconds", "Model instance creation latency.", ("provider",)
+)
@@ -1,18 +1,27 @@
+from functools import lru_cache
 from string import Formatter
-from typing import Any, Optional, Type
+from typing import Any, Optional, Type, cast
 
-from jinja2 import Environment, meta
+from jinja2 import Template, meta
+from jinja2.sandbox import SandboxedEnvironment
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.prompt_values import ChatPromptValue, PromptValue
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.prompts.chat import (
     BaseStringMessagePromptTemplate,
     MessagePromptTemplateT,
 )
 from langchain_core.prompts.prompt import PromptTemplate
+from langchain_core.pydantic_v1 import PrivateAttr
 from pydantic import BaseModel
 
 from ..syntax.input_types import Image
+from ..utils.memory import has_images, history_stats
+from .metrics import metrics
+
+_jinja_env = SandboxedEnvironment()
+""" Shared (sandboxed like the langchain formatter) environment to parse and render jinja2 templates. """
 
 
 def create_instruction_prompt(
@@ -21,6 +30,24 @@ def create_instruction_prompt(
     input_kwargs: dict[str, Any],
     format_instructions: Optional[str] = None,
 ) -> "HumanImageMessagePromptTemplate":
+    _filter_fstring_vars(input_kwargs)
+
+    return HumanImageMessagePromptTemplate(
+        prompt=_compile_instruction(instruction, tuple(input_kwargs), format_instructions),
+        images=[image.url for image in images],
+    )
+
+
+@lru_cache(maxsize=512)
+def _compile_instruction(
+    instruction: str,
+    input_vars: tuple[str, ...],
+    format_instructions: Optional[str] = None,
+) -> PromptTemplate:
+    """
+    Instruction prompt template (with the input variables injected that the instruction doesn't use),
+    cached per instruction, input variables and format instructions.
+    """
     template_format = _determine_format(instruction)
 
     if template_format == "jinja2" and "\n{format_instructions}" in instruction:
@@ -28,62 +55,126 @@ def create_instruction_prompt(
 
     required_f_str_vars = _extract_template_vars(instruction, template_format)
 
-    _filter_fstring_vars(input_kwargs)
-
     if template_format == "jinja2":
-        inject_vars = [
-            f"{var.upper()}:\n{{{{{var}}}}}\n" for var, _ in input_kwargs.items() if var not in required_f_str_vars
-        ]
+        inject_vars = [f"{var.upper()}:\n{{{{{var}}}}}\n" for var in input_vars if var not in required_f_str_vars]
     else:
-        inject_vars = [
-            f"{var.upper()}:\n{{{var}}}\n" for var, _ in input_kwargs.items() if var not in required_f_str_vars
-        ]
+        inject_vars = [f"{var.upper()}:\n{{{var}}}\n" for var in input_vars if var not in required_f_str_vars]
 
     added_instruction = "\n".join(inject_vars)
     instruction = added_instruction + instruction
 
-    _images = [image.url for image in images]
-
-    return HumanImageMessagePromptTemplate.from_template(
-        template=instruction,
+    return PromptTemplate.from_template(
+        instruction,
         template_format=template_format,
-        images=_images,
         partial_variables={"format_instructions": format_instructions} if format_instructions else None,
     )
 
 
+metrics.register_cache("prompt_templates", _compile_instruction.cache_info)
+
+
+@lru_cache(maxsize=512)
+def _jinja_template(template: str) -> Template:
+    return _jinja_env.from_string(template)
+
+
+def render_prompt(prompt: PromptTemplate, **kwargs: Any) -> str:
+    """
+    Format the prompt template using the precompiled jinja2 template or str.format for f-strings
+    (the langchain formatters parse the template again on every call).
+    """
+    kwargs = prompt._merge_partial_and_user_variables(**kwargs)
+    if prompt.template_format == "jinja2":
+        return _jinja_template(prompt.template).render(**kwargs)
+    if prompt.template_format == "f-string":
+        return prompt.template.format(**kwargs)
+    return prompt.format(**kwargs)
+
+
 def create_chat_prompt(
     system: str,
     instruction_template: "HumanImageMessagePromptTemplate",
     context: list[BaseMessage],
     memory: BaseChatMessageHistory,  # TODO: remove and do memory placeholder
+    strip_images: bool = False,
 ) -> ChatPromptTemplate:
     """
     Compose a chat prompt from a system message,
-    context and instruction template.
+    chat history, context and instruction template.
+    The history is only referenced and its messages are inserted when formatting,
+    so building the prompt doesn't depend on the length of the conversation.
+    With strip_images the images are removed from the inserted messages (the history is not changed).
     """
-    # remove leading system message in case to not have two
-    if system and memory.messages and isinstance(memory.messages[0], SystemMessage):
-        memory.messages.pop(0)
-
+    messages = memory.messages
     # TODO: fix union type problem
-    if memory.messages and isinstance(memory.messages[-1], HumanMessage):
+    if messages and isinstance(messages[-1], HumanMessage):
         print("specialchatprompt")
-        return ChatPromptTemplate.from_messages(
+        instruction = []
+    else:
+        instruction = [instruction_template]
+    prompt = cast(
+        ChatHistoryPromptTemplate,
+        ChatHistoryPromptTemplate.from_messages(
             [
                 *([SystemMessage(content=system)] if system else []),
-                *memory.messages,
+                MessagesPlaceholder("history", optional=True),
                 *context,
+                *instruction,
             ]
-        )
-    return ChatPromptTemplate.from_messages(
-        [
-            *([SystemMessage(content=system)] if system else []),
-            *memory.messages,
-            *context,
-            instruction_template,
-        ]
+        ),
     )
+    prompt._history = memory
+    # remove leading system message in case to not have two
+    prompt._skip_system = bool(system)
+    prompt._strip_images = strip_images
+    return prompt
+
+
+class ChatHistoryPromptTemplate(ChatPromptTemplate):
+    """
+    Chat prompt inserting the current messages of the chat history at the history placeholder.
+    The history is not serialized and the prompt value is not validated again (messages are not copied).
+    """
+
+    _history: Optional[BaseChatMessageHistory] = PrivateAttr(default=None)
+    _skip_system: bool = PrivateAttr(default=False)
+    _strip_images: bool = PrivateAttr(default=False)
+
+    def _merge_partial_and_user_variables(self, **kwargs: Any) -> dict[str, Any]:
+        kwargs = super()._merge_partial_and_user_variables(**kwargs)
+        if self._history is not None:
+            messages = self._history.messages
+            if self._skip_system and messages and isinstance(messages[0], SystemMessage):
+                messages = messages[1:]
+            # the (incremental) stats tell if there is anything to strip without scanning the history
+            if self._strip_images and history_stats(self._history).images:
+                messages = _clear_images_from_history(messages)
+            kwargs["history"] = messages
+        return kwargs
+
+    def format_prompt(self, **kwargs: Any) -> PromptValue:
+        return ChatPromptValue.construct(messages=self.format_messages(**kwargs))
+
+    async def aformat_prompt(self, **kwargs: Any) -> PromptValue:
+        return ChatPromptValue.construct(messages=await self.aformat_messages(**kwargs))
+
+
+def _clear_images_from_history(history: list[BaseMessage]) -> list[BaseMessage]:
+    """
+    Remove images from the chat history (returns copies of the messages containing images).
+    """
+    return [
+        message.copy(
+            update={
+                "content": [
+                    part for part in message.content if not (isinstance(part, dict) and part.get("type") == "image_url")
+                ]
+            }
+        )
+        if has_images(message)
+        else message
+        for message in history
+    ]
 
 
 def _determine_format(
@@ -119,8 +210,7 @@ def _extract_jinja_vars(template: str) -> list[str]:
     """
     Function to extract variables from a Jinja2 template.
     """
-    env = Environment()
-    parsed_content = env.parse(template)
+    parsed_content = _jinja_env.parse(template)
     return list(meta.find_undeclared_variables(parsed_content))
 
 
@@ -151,7 +241,11 @@ class HumanImageMessagePromptTemplate(BaseStringMessagePromptTemplate):
         Returns:
             Formatted message.
         """
-        text = self.prompt.format(**kwargs)
+        text = (
+            render_prompt(self.prompt, **kwargs)
+            if isinstance(self.prompt, PromptTemplate)
+            else self.prompt.format(**kwargs)
+        )
         return HumanMessage(
             content=[
                 {
@@ -0,0 +1,206 @@
+"""
+Rate Limiting:
+Per provider/model throttling of requests per minute (RPM) and tokens per minute (TPM).
+"""
+
+import asyncio
+import time
+from threading import Lock
+from typing import Optional
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import convert_to_messages, get_buffer_string
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableLambda
+from typing_extensions import TypedDict
+
+from ..model.abilities import get_model_id
+from ..utils.token_counter import estimate_tokens
+
+
+class RateLimit(TypedDict, total=False):
+    rpm: int
+    tpm: int
+
+
+class _Bucket:
+    """
+    Token bucket that allows a negative balance.
+    Callers reserve capacity in arrival order and wait until
+    their reservation is covered, which keeps the queue fair (FIFO).
+    """
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def configure(self, per_minute: int, now: float) -> None:
+        # keeps the used capacity (and debt), so a changed limit does not grant a full bucket
+        # (refilled at the old rate first, so the time since the last update is not lost)
+        used = self.capacity - self.refill(now)
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60
+        self.tokens = self.capacity - used
+
+    def refill(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def reserve(self, amount: float, now: float) -> float:
+        self.refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float, now: float) -> None:
+        self.refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Limits requests and estimated tokens per minute for one model.
+    Shared by all chains (threads and coroutines) that target the same model.
+    """
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = _Bucket(rpm) if rpm else None
+        self._tokens = _Bucket(tpm) if tpm else None
+        self._lock = Lock()
+
+    def configure(self, rpm: Optional[int] = None, tpm: Optional[int] = None) -> None:
+        """
+        Apply changed limits, keeping the pending reservations.
+        """
+        with self._lock:
+            self._requests = self._reconfigure(self._requests, rpm)
+            self._tokens = self._reconfigure(self._tokens, tpm)
+            self.rpm, self.tpm = rpm, tpm
+
+    def _reconfigure(self, bucket: Optional[_Bucket], per_minute: Optional[int]) -> Optional[_Bucket]:
+        if not per_minute:
+            return None
+        if bucket is None:
+            return _Bucket(per_minute)
+        bucket.configure(per_minute, time.monotonic())
+        return bucket
+
+    def reserve(self, tokens: int = 0) -> float:
+        """
+        Reserve one request and the given amount of tokens.
+        Returns the seconds to wait before the request can be sent.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = self._requests.reserve(1, now) if self._requests else 0.0
+            if self._tokens:
+                wait = max(wait, self._tokens.reserve(tokens, now))
+            return wait
+
+    def try_acquire(self, tokens: int = 0) -> bool:
+        """
+        Reserve one request and the tokens only if that needs no waiting.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (self._requests and self._requests.refill(now) < 1) or (
+                self._tokens and self._tokens.refill(now) < tokens
+            ):
+                return False
+            if self._requests:
+                self._requests.tokens -= 1
+            if self._tokens:
+                self._tokens.tokens -= tokens
+            return True
+
+    def refund(self, tokens: int = 0) -> None:
+        """
+        Return a reservation that was not used (e.g. the waiting caller got cancelled).
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._requests:
+                self._requests.refund(1, now)
+            if self._tokens:
+                self._tokens.refund(tokens, now)
+
+    def acquire(self, tokens: int = 0) -> None:
+        if wait := self.reserve(tokens):
+            try:
+                time.sleep(wait)
+            except BaseException:
+                # interrupted while waiting, the request is not sent
+                self.refund(tokens)
+                raise
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        if wait := self.reserve(tokens):
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                # cancelled (or timed out) while waiting, the request is not sent
+                self.refund(tokens)
+                raise
+
+
+_rate_limiters: dict[str, RateLimiter] = {}
+_registry_lock = Lock()
+
+
+def get_rate_limiter(model_id: str, limit: RateLimit) -> RateLimiter:
+    """
+    Get the shared rate limiter for a model,
+    reconfigured when the configured limit changes.
+    """
+    rpm, tpm = limit.get("rpm"), limit.get("tpm")
+    with _registry_lock:
+        if (limiter := _rate_limiters.get(model_id)) is None:
+            limiter = _rate_limiters[model_id] = RateLimiter(rpm=rpm, tpm=tpm)
+        elif limiter.rpm != rpm or limiter.tpm != tpm:
+            limiter.configure(rpm=rpm, tpm=tpm)
+        return limiter
+
+
+def rate_limiter_for(llm: BaseChatModel, rate_limits: dict[str, RateLimit]) -> RateLimiter | None:
+    """
+    Lookup the limit for a model by "provider/model_name" first, then by "provider".
+    """
+    if not rate_limits:
+        return None
+    model_id = get_model_id(llm)
+    limit = rate_limits.get(model_id) or rate_limits.get(model_id.split("/")[0])
+    return get_rate_limiter(model_id, limit) if limit else None
+
+
+def request_tokens(prompt: LanguageModelInput, max_tokens: int) -> int:
+    """
+    Estimated usage of a request: the prompt tokens plus max_tokens.
+    """
+    if isinstance(prompt, PromptValue):
+        text = prompt.to_string()
+    elif isinstance(prompt, str):
+        text = prompt
+    else:
+        text = get_buffer_string(convert_to_messages(prompt))
+    return estimate_tokens(text) + max_tokens
+
+
+def rate_limit_gate(limiter: RateLimiter, max_tokens: int) -> Runnable[PromptValue, PromptValue]:
+    """
+    Passthrough runnable that waits for the rate limiter before the prompt reaches the model.
+    Estimated usage is the prompt token count plus max_tokens.
+    """
+
+    def gate(prompt: PromptValue) -> PromptValue:
+        limiter.acquire(request_tokens(prompt, max_tokens))
+        return prompt
+
+    async def agate(prompt: PromptValue) -> PromptValue:
+        await limiter.aacquire(request_tokens(prompt, max_tokens))
+        return prompt
+
+    return RunnableLambda(gate, afunc=agate, name="RateLimit")
@@ -0,0 +1,148 @@
+"""
+Retry Policy:
+Exponential backoff, jitter and process-wide retry budgets for parse retries.
+"""
+
+import asyncio
+import random
+import time
+from threading import Lock
+from typing import TYPE_CHECKING
+
+from langchain_core.pydantic_v1 import BaseModel
+
+if TYPE_CHECKING:
+    from .settings import SettingsOverride
+
+
+class RetryBudget:
+    """
+    Token bucket shared by all chains in the process with the same budget settings.
+    Every parse retry spends one token and tokens refill over time,
+    so retries get capped when many chains fail at once (e.g. provider brownouts).
+    """
+
+    def __init__(self, capacity: float = 10.0, refill_rate: float = 0.5) -> None:
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+        self._updated = now
+
+    def configure(self, capacity: float, refill_rate: float) -> None:
+        """Update the bucket size and refill rate (tokens per second)."""
+        with self._lock:
+            self._refill()
+            self.capacity = capacity
+            self.refill_rate = refill_rate
+            self._tokens = min(self._tokens, capacity)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Spend tokens if available, never blocks."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    @property
+    def available(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def reset(self) -> None:
+        with self._lock:
+            self._tokens = self.capacity
+            self._updated = time.monotonic()
+
+
+_budgets: dict[tuple[float, float], RetryBudget] = {}
+_budgets_lock = Lock()
+
+
+def shared_budget(capacity: float = 10.0, refill_rate: float = 0.5) -> RetryBudget:
+    """
+    Process-wide retry budget of this configuration.
+    Budgets are keyed by (capacity, refill_rate) on purpose: all chains using the same
+    budget settings (e.g. the defaults) share one budget, while a chain configured
+    with a different budget gets its own, so policies never resize or reset each other.
+    """
+    with _budgets_lock:
+        if (key := (capacity, refill_rate)) not in _budgets:
+            _budgets[key] = RetryBudget(capacity, refill_rate)
+        return _budgets[key]
+
+
+retry_budget = shared_budget()
+""" Budget of the default settings. """
+
+
+class RetryPolicy(BaseModel):
+    """
+    Configures how parsers retry after a failed validation.
+    Build it from the settings using `settings.retry_policy()`.
+    """
+
+    sleep: float = 0.1
+    """ Delay before the next retry in seconds. """
+
+    backoff: float = 2.0
+    """ Multiplier applied to the delay after every retry. """
+
+    max_sleep: float = 10.0
+    """ Upper bound for the delay. """
+
+    jitter: float = 0.5
+    """ Fraction of the delay that is randomized (0 = none, 1 = full jitter). """
+
+    budget: float = 10.0
+    """ Capacity of the shared retry budget. """
+
+    budget_refill: float = 0.5
+    """ Retry tokens added to the shared budget per second. """
+
+    class Config:
+        frozen = True
+
+    def delay(self) -> float:
+        sleep = min(self.sleep, self.max_sleep)
+        return sleep * (1 - self.jitter * random.random())
+
+    def acquire(self) -> bool:
+        """Take a retry token from the shared budget."""
+        return shared_budget(self.budget, self.budget_refill).try_acquire()
+
+    def wait(self) -> None:
+        time.sleep(self.delay())
+
+    async def await_backoff(self) -> None:
+        """Async version of wait, doesn't block the event loop."""
+        await asyncio.sleep(self.delay())
+
+    def next_override(self, retry: int) -> "SettingsOverride":
+        """Settings override for the retry chain, with the backoff applied."""
+        return {
+            "retry_parse": retry,
+            "retry_parse_sleep": min(self.sleep * self.backoff, self.max_sleep),
+            "retry_parse_backoff": self.backoff,
+            "retry_parse_max_sleep": self.max_sleep,
+            "retry_parse_jitter": self.jitter,
+            "retry_budget": self.budget,
+            "retry_budget_refill": self.budget_refill,
+        }
+
+
+def default_retry_policy() -> RetryPolicy:
+    """
+    Retry policy of the global settings, for parsers created without one.
+    """
+    from .settings import settings
+
+    return settings.retry_policy()
@@ -3,7 +3,7 @@ Funcchain Settings:
 Automatically loads environment variables from .env file
 """
 
-from typing import Optional
+from typing import Any, Callable, Optional
 
 from langchain_core.language_models import BaseChatModel
 from pydantic import Field
@@ -11,6 +11,9 @@ from pydantic_settings import BaseSettings
 from typing_extensions import TypedDict
 
 from ..schema.types import UniversalChatModel
+from .ratelimit import RateLimit
+from .retry import RetryPolicy
+from .usage import TokenPrice
 
 
 class FuncchainSettings(BaseSettings):
@@ -22,11 +25,57 @@ class FuncchainSettings(BaseSettings):
     )
 
     console_stream: bool = False
+    # max buffered tokens of stream_chain/astream_chain before the model waits for the consumer
+    stream_buffer: int = 64
 
     system_prompt: str = ""
 
     retry_parse: int = 3
     retry_parse_sleep: float = 0.1
+    retry_parse_backoff: float = 2.0
+    retry_parse_max_sleep: float = 10.0
+    retry_parse_jitter: float = 0.5
+    retry_budget: float = 10.0
+    retry_budget_refill: float = 0.5
+
+    # stop generating once the structured output is complete (streaming)
+    early_stop: bool = True
+    # derive stop sequences from the output type (can cut off strings containing a fenced block)
+    stop_sequences: bool = False
+
+    # RATE LIMITS
+    # keys are "provider/model_name" or "provider", e.g. {"openai/gpt-4o": {"rpm": 500, "tpm": 30000}}
+    rate_limits: dict[str, RateLimit] = {}
+
+    # USAGE ACCOUNTING
+    usage_accounting: bool = True
+    # USD per million tokens, keys like rate_limits, e.g. {"openai/gpt-4o": {"input": 5.0, "output": 15.0}}
+    token_prices: dict[str, TokenPrice] = {}
+
+    # ADAPTIVE CONCURRENCY (async calls only)
+    adaptive_concurrency: bool = False
+    concurrency_limit: int = 8
+    concurrency_max_limit: int = 256
+    concurrency_latency_tolerance: float = 2.0
+
+    # MODEL CASCADE
+    # selector strings (or models) ordered from cheapest to most capable model
+    cascade: list[BaseChatModel | str] = []
+    cascade_check: Optional[Callable[[Any], bool]] = None
+
+    # HEDGING
+    hedging: bool = False
+    hedge_percentile: float = 0.95
+    hedge_delay: float = 2.0
+    hedge_llm: Optional[str] = None
+
+    # CHAT MEMORY
+    # (cheap) model summarizing the turns evicted from a SummarizingChatMessageHistory, default: llm
+    summary_llm: Optional[str] = None
+
+    # FAKE MODEL ("fake/..." offline provider)
+    # e.g. {"ttft": 0.3, "chunk_rate": 50, "error_rate": 0.01, "malformed_rate": 0.05}
+    fake_model_kwargs: dict[str, Any] = {}
 
     # LANGSMITH
     # langchain_project: str = "funcchain"
@@ -92,6 +141,32 @@ class FuncchainSettings(BaseSettings):
             "repeat_penalty": self.repeat_penalty,
         }
 
+    def fake_kwargs(self) -> dict:
+        return dict(self.fake_model_kwargs)
+
+    def concurrency_kwargs(self) -> dict:
+        return {
+            "initial_limit": self.concurrency_limit,
+            "max_limit": self.concurrency_max_limit,
+            "latency_tolerance": self.concurrency_latency_tolerance,
+        }
+
+    def hedge_kwargs(self) -> dict:
+        return {
+            "percentile": self.hedge_percentile,
+            "default_delay": self.hedge_delay,
+        }
+
+    def retry_policy(self) -> RetryPolicy:
+        return RetryPolicy(
+            sleep=self.retry_parse_sleep,
+            backoff=self.retry_parse_backoff,
+            max_sleep=self.retry_parse_max_sleep,
+            jitter=self.retry_parse_jitter,
+            budget=self.retry_budget,
+            budget_refill=self.retry_budget_refill,
+        )
+
     class Config:
         env_file = ".env"
         extra = "ignore"
@@ -108,15 +183,31 @@ class SettingsOverride(TypedDict, total=False):
     max_tokens: int
     streaming: bool
     retry_parse: int
+    retry_parse_sleep: float
+    retry_parse_backoff: float
+    retry_parse_max_sleep: float
+    retry_parse_jitter: float
+    retry_budget: float
+    retry_budget_refill: float
     context_lenght: int
     system_prompt: str
+    early_stop: bool
+    stop_sequences: bool
+    hedging: bool
+    hedge_llm: str
+    cascade: list[BaseChatModel | str]
+    cascade_check: Callable[[Any], bool]
+    fake_model_kwargs: dict[str, Any]
+    summary_llm: str
 
 
 def create_local_settings(override: Optional[SettingsOverride] = None) -> FuncchainSettings:
     if override:
-        if override.get("llm") is None:
-            override["llm"] = settings.llm
-        return settings.model_copy(update=dict(override))
+        # copy to never write into the (possibly shared) override of the caller
+        update = dict(override)
+        if update.get("llm") is None:
+            update["llm"] = settings.llm
+        return settings.model_copy(update=update)
     return settings
 
 
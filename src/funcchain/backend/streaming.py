@@ -1,21 +1,49 @@
+import asyncio
+import inspect
+import time
 from contextlib import asynccontextmanager, contextmanager
-from contextvars import ContextVar
-from typing import Any, AsyncGenerator, Awaitable, Callable, Coroutine, Generator
+from contextvars import ContextVar, copy_context
+from queue import Empty, Queue
+from threading import Event, Thread
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Generator, Iterator
 from uuid import UUID
 
 from langchain_core.callbacks.base import AsyncCallbackHandler
+from langchain_core.language_models import LanguageModelInput
 from langchain_core.messages import BaseMessage
 from langchain_core.outputs import ChatGenerationChunk, GenerationChunk, LLMResult
+from langchain_core.runnables import RunnableBinding, RunnableConfig
+
+from ..model.abilities import model_id_from_params
+from ..utils.msg_tools import msg_arguments_delta
+from .settings import settings
+from .usage import TokenPrice, price_for, result_usage, usage_cost
 
 
 class AsyncStreamHandler(AsyncCallbackHandler):
-    """Async callback handler that can be used to handle callbacks from langchain_core."""
+    """
+    Async callback handler that can be used to handle callbacks from langchain_core.
+    Tokens can be coalesced into larger pieces for sinks where every call is costly (websockets, rich consoles):
+    the buffered tokens of a run are flushed once they reach coalesce_chars characters,
+    when coalesce_interval seconds passed since the last flush (checked on new tokens) and at the end of the run.
+    """
 
-    def __init__(self, fn: Callable[[str], Awaitable[None] | None], default_kwargs: dict) -> None:
+    def __init__(
+        self,
+        fn: Callable[[str], Awaitable[None] | None],
+        default_kwargs: dict,
+        coalesce_chars: int = 0,
+        coalesce_interval: float = 0.0,
+    ) -> None:
         self.fn = fn
         self.default_kwargs = default_kwargs
+        self.coalesce_chars = coalesce_chars
+        self.coalesce_interval = coalesce_interval
         self.cost: float = 0.0
         self.tokens: int = 0
+        # buffered tokens, size and last flush per run
+        self._buffers: dict[UUID | None, tuple[list[str], int, float]] = {}
+        self._runs: dict[UUID, tuple[list[list[BaseMessage]], TokenPrice | None]] = {}
 
     async def on_chat_model_start(
         self,
@@ -28,16 +56,11 @@ class AsyncStreamHandler(AsyncCallbackHandler):
         metadata: dict[str, Any] | None = None,
         **kwargs: Any,
     ) -> Any:
-        # from .utils import count_tokens
-        # for lists in messages:
-        #     for message in lists:
-        #         if message.content:
-        #             if isinstance(message.content, str):
-        #                 self.tokens += count_tokens(message.content)
-        #             elif isinstance(message.content, list):
-        #                 print("token_counting", message.content)
-        #                 # self.tokens += count_tokens(message)
-        pass
+        # remembered to count the usage once the run ended
+        price = (metadata or {}).get("token_price") or price_for(
+            model_id_from_params(kwargs.get("invocation_params") or {}), settings.token_prices
+        )
+        self._runs[run_id] = (messages, price)
 
     async def on_llm_new_token(
         self,
@@ -49,10 +72,34 @@ class AsyncStreamHandler(AsyncCallbackHandler):
         tags: list[str] | None = None,
         **kwargs: Any,
     ) -> None:
-        if isinstance(self.fn, Coroutine):
-            await self.fn(token, **self.default_kwargs)
+        if not token and isinstance(chunk, ChatGenerationChunk):
+            # function calling models stream the call arguments instead of content
+            token = msg_arguments_delta(chunk.message)
+        if not self.coalesce_chars and not self.coalesce_interval:
+            return await self._send(token)
+        if not token:
+            return
+        parts, size, last_flush = self._buffers.get(run_id) or ([], 0, time.monotonic())
+        parts.append(token)
+        size += len(token)
+        if (self.coalesce_chars and size >= self.coalesce_chars) or (
+            self.coalesce_interval and time.monotonic() - last_flush >= self.coalesce_interval
+        ):
+            self._buffers[run_id] = ([], 0, time.monotonic())
+            await self._send("".join(parts))
         else:
-            self.fn(token, **self.default_kwargs)
+            self._buffers[run_id] = (parts, size, last_flush)
+
+    async def _send(self, token: str) -> None:
+        if inspect.isawaitable(result := self.fn(token, **self.default_kwargs)):
+            await result
+
+    async def flush(self, run_id: UUID | None = None) -> None:
+        """
+        Send the coalesced tokens of the run.
+        """
+        if (buffer := self._buffers.pop(run_id, None)) and buffer[0]:
+            await self._send("".join(buffer[0]))
 
     async def on_llm_end(
         self,
@@ -63,17 +110,47 @@ class AsyncStreamHandler(AsyncCallbackHandler):
         tags: list[str] | None = None,
         **kwargs: Any,
     ) -> None:
+        await self.flush(run_id)
+        self._count_usage(response, run_id)
         if self.fn is print:
             print("\n")
 
+    def _count_usage(self, response: LLMResult, run_id: UUID) -> None:
+        """
+        Add the tokens (provider reported or estimated) and cost of the run.
+        """
+        messages, price = self._runs.pop(run_id, ([], None))
+        usage = result_usage(response, messages)
+        self.tokens += usage.total_tokens
+        self.cost += usage_cost(usage, price)
+
+    async def on_llm_error(
+        self,
+        error: BaseException,
+        *,
+        run_id: UUID,
+        parent_run_id: UUID | None = None,
+        tags: list[str] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        await self.flush(run_id)
+        self._runs.pop(run_id, None)
+
 
 stream_handler: ContextVar[AsyncStreamHandler | None] = ContextVar("stream_handler", default=None)
 
 
 @contextmanager
-def stream_to(fn: Callable[[str], None], **kwargs: Any) -> Generator[AsyncStreamHandler, None, None]:
+def stream_to(
+    fn: Callable[[str], None],
+    *,
+    coalesce_chars: int = 0,
+    coalesce_interval: float = 0.0,
+    **kwargs: Any,
+) -> Generator[AsyncStreamHandler, None, None]:
     """
     Stream the llm tokens to a given function.
+    Set coalesce_chars and/or coalesce_interval to receive larger pieces instead of every token.
 
     Example:
         >>> with stream_to(print):
@@ -86,18 +163,25 @@ def stream_to(fn: Callable[[str], None], **kwargs: Any) -> Generator[AsyncStream
     if (fn is builtins.print or fn is rich.print) and kwargs == {}:
         kwargs = {"end": "", "flush": True}
 
-    cb = AsyncStreamHandler(fn, kwargs)
-    stream_handler.set(cb)
-    yield cb
-    stream_handler.set(None)
+    cb = AsyncStreamHandler(fn, kwargs, coalesce_chars, coalesce_interval)
+    token = stream_handler.set(cb)
+    try:
+        yield cb
+    finally:
+        stream_handler.reset(token)
 
 
 @asynccontextmanager
 async def astream_to(
-    fn: Callable[[str], Awaitable[None] | None], **kwargs: Any
+    fn: Callable[[str], Awaitable[None] | None],
+    *,
+    coalesce_chars: int = 0,
+    coalesce_interval: float = 0.0,
+    **kwargs: Any,
 ) -> AsyncGenerator[AsyncStreamHandler, None]:
     """
     Asyncronously stream the llm tokens to a given function.
+    Set coalesce_chars and/or coalesce_interval to receive larger pieces instead of every token.
 
     Example:
         >>> async with astream_to(print):
@@ -105,7 +189,129 @@ async def astream_to(
     """
     if fn is print and kwargs == {}:
         kwargs = {"end": "", "flush": True}
-    cb = AsyncStreamHandler(fn, kwargs)
-    stream_handler.set(cb)
-    yield cb
-    stream_handler.set(None)
+    cb = AsyncStreamHandler(fn, kwargs, coalesce_chars, coalesce_interval)
+    token = stream_handler.set(cb)
+    try:
+        yield cb
+    finally:
+        stream_handler.reset(token)
+
+
+class InvokeStreamBinding(RunnableBinding[LanguageModelInput, BaseMessage]):
+    """
+    Binding of stream=True for invoke calls only, so the chat model streams its tokens to the callbacks.
+    Streaming calls stream anyway and do not get the kwarg, as some models (e.g. ChatLlamaCpp)
+    pass it to their client next to their own stream=True.
+    """
+
+    def stream(
+        self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any | None
+    ) -> Iterator[BaseMessage]:
+        yield from self.bound.stream(input, self._merge_configs(config), **self._stream_kwargs(kwargs))
+
+    async def astream(
+        self, input: LanguageModelInput, config: RunnableConfig | None = None, **kwargs: Any | None
+    ) -> AsyncIterator[BaseMessage]:
+        async for chunk in self.bound.astream(input, self._merge_configs(config), **self._stream_kwargs(kwargs)):
+            yield chunk
+
+    def transform(
+        self, input: Iterator[LanguageModelInput], config: RunnableConfig | None = None, **kwargs: Any
+    ) -> Iterator[BaseMessage]:
+        yield from self.bound.transform(input, self._merge_configs(config), **self._stream_kwargs(kwargs))
+
+    async def atransform(
+        self, input: AsyncIterator[LanguageModelInput], config: RunnableConfig | None = None, **kwargs: Any
+    ) -> AsyncIterator[BaseMessage]:
+        async for chunk in self.bound.atransform(input, self._merge_configs(config), **self._stream_kwargs(kwargs)):
+            yield chunk
+
+    def _stream_kwargs(self, kwargs: dict[str, Any]) -> dict[str, Any]:
+        return {key: value for key, value in {**self.kwargs, **kwargs}.items() if key != "stream"}
+
+
+class _Done:
+    def __init__(self, result: Any = None, error: Exception | None = None) -> None:
+        self.result = result
+        self.error = error
+
+
+class TokenStream:
+    """
+    Bounded buffer between a chain running in a worker thread and the consumer,
+    filled with the tokens sent to the handler or the items passed to put.
+    The model blocks while the buffer is full (backpressure).
+    """
+
+    def __init__(self, maxsize: int = 64) -> None:
+        self._queue: Queue[Any] = Queue(maxsize)
+        self._closed = Event()
+        self.handler = AsyncStreamHandler(self.put, {})
+
+    def put(self, item: Any) -> None:
+        if not self._closed.is_set():
+            self._queue.put(item)
+
+    def iterate(self, invoke: Callable[[], Any]) -> Generator[Any, None, Any]:
+        """
+        Run invoke in the background and yield the streamed items,
+        the generator returns the result of invoke.
+        """
+
+        def worker() -> None:
+            try:
+                self.put(_Done(result=invoke()))
+            except Exception as e:
+                self.put(_Done(error=e))
+
+        Thread(target=copy_context().run, args=(worker,), daemon=True).start()
+        try:
+            while not isinstance(item := self._queue.get(), _Done):
+                yield item
+        finally:
+            # threads can not be cancelled, unblock the worker and discard the rest
+            self._closed.set()
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except Empty:
+                    break
+        if item.error:
+            raise item.error
+        return item.result
+
+
+class AsyncTokenStream:
+    """
+    Bounded buffer between a chain running in a background task and the consumer,
+    filled with the tokens sent to the handler or the items passed to put.
+    The model waits while the buffer is full (backpressure),
+    closing the generator early cancels the generation.
+    """
+
+    def __init__(self, maxsize: int = 64) -> None:
+        self._queue: asyncio.Queue[Any] = asyncio.Queue(maxsize)
+        self.handler = AsyncStreamHandler(self.put, {})
+
+    async def put(self, item: Any) -> None:
+        await self._queue.put(item)
+
+    async def iterate(self, ainvoke: Callable[[], Awaitable[Any]]) -> AsyncGenerator[Any, None]:
+        async def run() -> None:
+            try:
+                result = await ainvoke()
+            except Exception as e:
+                await self.put(_Done(error=e))
+            else:
+                await self.put(_Done(result=result))
+
+        task = asyncio.ensure_future(run())
+        try:
+            while not isinstance(item := await self._queue.get(), _Done):
+                yield item
+        finally:
+            if not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        if item.error:
+            raise item.error
@@ -0,0 +1,355 @@
+"""
+Tracing:
+Latency breakdown of every funcchain call into its stages
+(introspection, compile, dependencies, prompt_format, ttft, generation, parse, retry),
+reported to pluggable hooks.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from types import TracebackType
+from typing import Any, AsyncIterator, Callable, Generator, Iterator, Optional, Union
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import merge_configs
+
+from .metrics import chain_calls, chain_duration, chain_in_flight
+from .wrapper import RunnableWrapper, WrappedCall
+
+
+class Span:
+    """
+    Timing of one stage, start and end are perf_counter seconds.
+    """
+
+    __slots__ = ("stage", "start", "end", "attributes")
+
+    def __init__(self, stage: str, start: float, end: float, attributes: dict[str, Any]) -> None:
+        self.stage = stage
+        self.start = start
+        self.end = end
+        self.attributes = attributes
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def __repr__(self) -> str:
+        return f"Span({self.stage!r}, {self.duration * 1000:.2f}ms, {self.attributes})"
+
+
+class Trace:
+    """
+    Spans of one funcchain call.
+    Active (in the context) while the chain runs, so the stages inside the chain record into it.
+    Only records spans if hooks are registered (recording).
+    """
+
+    def __init__(self, name: str, hooks: list["TraceHook"]) -> None:
+        self.name = name
+        self.recording = bool(hooks)
+        self.spans: list[Span] = []
+        self.start = self._last = time.perf_counter()
+        self.start_ns = time.time_ns()
+        self.end: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self._hooks = hooks
+        self._token: Any = None
+
+    def add(self, stage: str, start: float, end: float, **attributes: Any) -> None:
+        if not self.recording:
+            return
+        span = Span(stage, start, end, attributes)
+        self.spans.append(span)
+        for hook in self._hooks:
+            hook.on_span(self, span)
+
+    def mark(self, stage: str, **attributes: Any) -> None:
+        """
+        Record a span from the previous mark (or the start) until now.
+        """
+        now = time.perf_counter()
+        self.add(stage, self._last, now, **attributes)
+        self._last = now
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def breakdown(self) -> dict[str, float]:
+        """
+        Total seconds per stage (including the whole call as "total").
+        Stages nested in another stage (e.g. the generation and parse of a retry) are not counted again
+        for the outer stage, so the stages add up to at most the total.
+        The ttft is part of the generation and not subtracted from it.
+        """
+        totals: dict[str, float] = {}
+        # spans enclosing the current span, the innermost last
+        enclosing: list[Span] = []
+        for span in sorted(self.spans, key=lambda span: (span.start, -span.end)):
+            totals[span.stage] = totals.get(span.stage, 0.0) + span.duration
+            if span.stage == "ttft":
+                continue
+            while enclosing and enclosing[-1].end <= span.start:
+                enclosing.pop()
+            if enclosing:
+                parent = enclosing[-1].stage
+                totals[parent] -= span.duration
+            enclosing.append(span)
+        totals["total"] = self.duration
+        return totals
+
+    def to_unix_ns(self, perf_time: float) -> int:
+        """
+        Convert a perf_counter time of this trace to unix nanoseconds.
+        """
+        return self.start_ns + int((perf_time - self.start) * 1e9)
+
+    def __enter__(self) -> "Trace":
+        self._token = current_trace.set(self)
+        chain_in_flight.inc(self.name)
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        current_trace.reset(self._token)
+        self.end = time.perf_counter()
+        self.error = exc
+        chain_in_flight.dec(self.name)
+        chain_calls.inc(self.name, "error" if exc else "ok")
+        chain_duration.observe(self.duration, self.name)
+        for hook in self._hooks:
+            hook.on_trace_end(self)
+
+    def __repr__(self) -> str:
+        return f"Trace({self.name!r}, {self.duration * 1000:.2f}ms, {len(self.spans)} spans)"
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+class TraceHook:
+    """
+    Receives the spans of the traced funcchain calls.
+    """
+
+    def on_span(self, trace: Trace, span: Span) -> None:
+        """Called whenever a stage completed."""
+
+    def on_trace_end(self, trace: Trace) -> None:
+        """Called once the funcchain call completed (trace.error is set if it failed)."""
+
+
+class CallbackTraceHook(TraceHook):
+    """
+    Calls a plain function with every finished trace.
+    """
+
+    def __init__(self, fn: Callable[[Trace], None]) -> None:
+        self.fn = fn
+
+    def on_trace_end(self, trace: Trace) -> None:
+        self.fn(trace)
+
+
+class OpenTelemetryTraceHook(TraceHook):
+    """
+    Exports every funcchain call as an OpenTelemetry span with one child span per stage.
+    Requires `opentelemetry-api` (and a configured tracer provider to export anything).
+    """
+
+    def __init__(self, tracer: Any = None) -> None:
+        try:
+            from opentelemetry import trace as otel_trace
+        except ImportError:
+            raise ImportError("Please install opentelemetry-api to use the OpenTelemetryTraceHook.")
+        self._otel = otel_trace
+        self.tracer = tracer or otel_trace.get_tracer("funcchain")
+
+    def on_trace_end(self, trace: Trace) -> None:
+        root = self.tracer.start_span(f"funcchain {trace.name}", start_time=trace.start_ns)
+        root.set_attribute("funcchain.name", trace.name)
+        if trace.error:
+            root.record_exception(trace.error)
+            root.set_status(self._otel.Status(self._otel.StatusCode.ERROR))
+        context = self._otel.set_span_in_context(root)
+        for span in trace.spans:
+            child = self.tracer.start_span(span.stage, context=context, start_time=trace.to_unix_ns(span.start))
+            for key, value in span.attributes.items():
+                child.set_attribute(
+                    f"funcchain.{key}", value if isinstance(value, (str, int, float, bool)) else str(value)
+                )
+            child.end(end_time=trace.to_unix_ns(span.end))
+        root.end(end_time=trace.to_unix_ns(trace.end or time.perf_counter()))
+
+
+_hooks: list[TraceHook] = []
+_hooks_lock = Lock()
+_scoped_hooks: ContextVar[tuple[TraceHook, ...]] = ContextVar("scoped_trace_hooks", default=())
+
+
+def _as_hook(hook: Union[TraceHook, Callable[[Trace], None]]) -> TraceHook:
+    return hook if isinstance(hook, TraceHook) else CallbackTraceHook(hook)
+
+
+def add_trace_hook(hook: Union[TraceHook, Callable[[Trace], None]]) -> TraceHook:
+    """
+    Register a hook (or a function receiving the finished traces) for all funcchain calls.
+    """
+    with _hooks_lock:
+        _hooks.append(hook := _as_hook(hook))
+    return hook
+
+
+def remove_trace_hook(hook: TraceHook) -> None:
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+@contextmanager
+def trace_to(hook: Union[TraceHook, Callable[[Trace], None]]) -> Generator[TraceHook, None, None]:
+    """
+    Report the traces of the funcchain calls inside the context to the hook.
+
+    Example:
+        >>> with trace_to(lambda trace: print(trace.breakdown())):
+        ...     # your chain calls here
+    """
+    token = _scoped_hooks.set((*_scoped_hooks.get(), hook := _as_hook(hook)))
+    try:
+        yield hook
+    finally:
+        _scoped_hooks.reset(token)
+
+
+def start_trace(name: str) -> Trace:
+    """
+    Start the trace of a funcchain call (not recording if no hooks are registered).
+    """
+    return Trace(name, [*_hooks, *_scoped_hooks.get()])
+
+
+def current_chain_name() -> Optional[str]:
+    """
+    Name of the funcchain currently running in this context.
+    """
+    return trace.name if (trace := current_trace.get()) else None
+
+
+def _recording() -> bool:
+    return (trace := current_trace.get()) is not None and trace.recording
+
+
+def record(stage: str, start: float, **attributes: Any) -> None:
+    """
+    Record a span from start until now to the active trace.
+    """
+    if (trace := current_trace.get()) and trace.recording:
+        trace.add(stage, start, time.perf_counter(), **attributes)
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[None]:
+    """
+    Record the duration of the block as span of the active trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, start, **attributes)
+
+
+class TracedRunnable(RunnableWrapper[Any, Any]):
+    """
+    Records the duration of the wrapped runnable as stage of the active trace.
+    For the generation stage the time to the first chunk (or the first token streamed to the callbacks
+    when invoked) is recorded as "ttft", so it is only measured if the call streams anyway.
+    Transforms (parsers) record the time after the last input chunk arrived.
+    """
+
+    def __init__(self, stage: str, bound: Runnable[Any, Any], **attributes: Any) -> None:
+        super().__init__(bound)
+        self.stage = stage
+        self.attributes = attributes
+
+    @contextmanager
+    def call(self, input: Any, config: RunnableConfig | None, stream: bool) -> Iterator[WrappedCall]:
+        if not _recording():
+            yield WrappedCall(config)
+            return
+        with span(self.stage, **self.attributes):
+            call = _TracedCall(config, self)
+            if not stream and self.stage == "generation":
+                call.config = merge_configs(config, {"callbacks": [_FirstTokenHandler(call)]})
+            yield call
+
+    def transform(
+        self, input: Iterator[Any], config: RunnableConfig | None = None, **kwargs: Any | None
+    ) -> Iterator[Any]:
+        if not _recording():
+            yield from self.bound.transform(input, config, **kwargs)
+            return
+        last = [time.perf_counter()]
+
+        def timed() -> Iterator[Any]:
+            for chunk in input:
+                yield chunk
+                last[0] = time.perf_counter()
+
+        yield from self.bound.transform(timed(), config, **kwargs)
+        record(self.stage, last[0], **self.attributes)
+
+    async def atransform(
+        self, input: AsyncIterator[Any], config: RunnableConfig | None = None, **kwargs: Any | None
+    ) -> AsyncIterator[Any]:
+        if not _recording():
+            async for output in self.bound.atransform(input, config, **kwargs):
+                yield output
+            return
+        last = [time.perf_counter()]
+
+        async def timed() -> AsyncIterator[Any]:
+            async for chunk in input:
+                yield chunk
+                last[0] = time.perf_counter()
+
+        async for output in self.bound.atransform(timed(), config, **kwargs):
+            yield output
+        record(self.stage, last[0], **self.attributes)
+
+
+class _TracedCall(WrappedCall):
+    def __init__(self, config: RunnableConfig | None, traced: TracedRunnable) -> None:
+        super().__init__(config)
+        self.traced = traced
+        self.start = time.perf_counter()
+        self.first = True
+
+    def on_chunk(self, chunk: Any) -> bool:
+        if self.first and self.traced.stage == "generation":
+            record("ttft", self.start, **self.traced.attributes)
+        self.first = False
+        return False
+
+
+class _FirstTokenHandler(BaseCallbackHandler):
+    """
+    Records the ttft of an invoked generation from the first token streamed to the callbacks.
+    """
+
+    run_inline = True
+
+    def __init__(self, call: _TracedCall) -> None:
+        self.call = call
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.call.on_chunk(token)
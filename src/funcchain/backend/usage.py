@@ -0,0 +1,332 @@
+"""
+Usage Accounting:
+Tokens, cost, calls and latency per funcchain, per model and for the whole process.
+Provider reported usage is used where available, local token estimates otherwise.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Generator, Iterator, Optional
+
+from langchain_core.language_models import BaseChatModel, LanguageModelInput
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+from langchain_core.prompt_values import PromptValue
+from langchain_core.runnables import Runnable, RunnableConfig
+from typing_extensions import TypedDict
+
+from ..model.abilities import get_model_id
+from ..utils.msg_tools import msg_arguments_delta, msg_to_str
+from ..utils.token_counter import estimate_tokens
+from .metrics import cost, model_duration, model_in_flight, model_requests, model_ttft, tokens
+from .tracing import current_chain_name
+from .wrapper import RunnableWrapper, WrappedCall
+
+
+class TokenPrice(TypedDict):
+    input: float
+    """ USD per million prompt tokens. """
+    output: float
+    """ USD per million completion tokens. """
+
+
+class Usage:
+    """
+    Accumulated usage of model calls.
+    """
+
+    __slots__ = ("calls", "prompt_tokens", "completion_tokens", "cost", "latency", "estimated_calls")
+
+    def __init__(
+        self,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        cost: float = 0.0,
+        latency: float = 0.0,
+        calls: int = 0,
+        estimated_calls: int = 0,
+    ) -> None:
+        self.calls = calls
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cost = cost
+        self.latency = latency
+        self.estimated_calls = estimated_calls
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: "Usage") -> None:
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+        self.latency += other.latency
+        self.estimated_calls += other.estimated_calls
+
+    def to_dict(self) -> dict[str, float]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": self.cost,
+            "latency": self.latency,
+            "estimated_calls": self.estimated_calls,
+        }
+
+    def __repr__(self) -> str:
+        return f"Usage({', '.join(f'{k}={v}' for k, v in self.to_dict().items())})"
+
+
+class UsageRegistry:
+    """
+    Usage aggregated per funcchain name, per model and in total.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._total = Usage()
+        self._chains: dict[str, Usage] = {}
+        self._models: dict[str, Usage] = {}
+
+    def record(self, chain: str, model: str, usage: Usage) -> None:
+        with self._lock:
+            self._total.add(usage)
+            self._chains.setdefault(chain, Usage()).add(usage)
+            self._models.setdefault(model, Usage()).add(usage)
+
+    def total(self) -> dict[str, float]:
+        with self._lock:
+            return self._total.to_dict()
+
+    def by_chain(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {name: usage.to_dict() for name, usage in self._chains.items()}
+
+    def by_model(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {name: usage.to_dict() for name, usage in self._models.items()}
+
+    def top_chains(self, key: str = "total_tokens", n: int = 10) -> list[tuple[str, dict[str, float]]]:
+        """
+        The funcchains using the most of key (e.g. "total_tokens", "cost" or "latency").
+        """
+        return sorted(self.by_chain().items(), key=lambda item: item[1][key], reverse=True)[:n]
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"total": self.total(), "chains": self.by_chain(), "models": self.by_model()}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._total = Usage()
+            self._chains.clear()
+            self._models.clear()
+
+
+usage_registry = UsageRegistry()
+""" Process wide usage of all funcchain calls. """
+
+_scoped_registries: ContextVar[tuple[UsageRegistry, ...]] = ContextVar("scoped_usage_registries", default=())
+
+
+@contextmanager
+def track_usage() -> Generator[UsageRegistry, None, None]:
+    """
+    Measure the usage of the funcchain calls inside the context.
+
+    Example:
+        >>> with track_usage() as usage:
+        ...     # your chain calls here
+        >>> usage.total()["total_tokens"]
+    """
+    registry = UsageRegistry()
+    token = _scoped_registries.set((*_scoped_registries.get(), registry))
+    try:
+        yield registry
+    finally:
+        _scoped_registries.reset(token)
+
+
+def record_usage(model_id: str, usage: Usage) -> None:
+    """
+    Record the usage of a model call for the running funcchain.
+    """
+    chain = current_chain_name() or "<runnable>"
+    usage_registry.record(chain, model_id, usage)
+    for registry in _scoped_registries.get():
+        registry.record(chain, model_id, usage)
+    tokens.inc(chain, model_id, "prompt", amount=usage.prompt_tokens)
+    tokens.inc(chain, model_id, "completion", amount=usage.completion_tokens)
+    if usage.cost:
+        cost.inc(chain, model_id, amount=usage.cost)
+
+
+def reported_usage(message: BaseMessage) -> Optional[tuple[int, int]]:
+    """
+    Prompt and completion tokens reported by the provider with the message (or chunk).
+    """
+    if usage_metadata := getattr(message, "usage_metadata", None):
+        return usage_metadata["input_tokens"], usage_metadata["output_tokens"]
+    metadata = message.response_metadata
+    if token_usage := metadata.get("token_usage"):  # openai, groq, ...
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+    if isinstance(usage := metadata.get("usage"), dict) and "input_tokens" in usage:  # anthropic
+        return usage["input_tokens"], usage.get("output_tokens", 0)
+    if "eval_count" in metadata:  # ollama
+        return metadata.get("prompt_eval_count", 0), metadata["eval_count"]
+    return None
+
+
+def result_usage(response: LLMResult, messages: list[list[BaseMessage]]) -> Usage:
+    """
+    Usage of a finished model run (used by callback handlers).
+    """
+    generation = response.generations[0][0] if response.generations and response.generations[0] else None
+    message = generation.message if isinstance(generation, ChatGeneration) else None
+    if message and (reported := reported_usage(message)):
+        return Usage(*reported, calls=1)
+    completion = message_text(message) if message else (generation.text if generation else "")
+    prompt = "\n".join(prompt_text(m) for m in messages)
+    return Usage(estimate_tokens(prompt), estimate_tokens(completion), calls=1, estimated_calls=1)
+
+
+def message_text(message: BaseMessage) -> str:
+    """
+    Generated text of the message including function call arguments.
+    """
+    return (msg_to_str(message) if message.content else "") + msg_arguments_delta(message)
+
+
+def prompt_text(input: Any) -> str:
+    if isinstance(input, PromptValue):
+        return input.to_string()
+    if isinstance(input, list):
+        return "\n".join((msg_to_str(m) if m.content else "") if isinstance(m, BaseMessage) else str(m) for m in input)
+    return str(input)
+
+
+def price_for(model_id: str, prices: dict[str, TokenPrice]) -> Optional[TokenPrice]:
+    """
+    Lookup the price of a model by "provider/model_name" first, then by "provider".
+    """
+    if not prices:
+        return None
+    return prices.get(model_id) or prices.get(model_id.split("/")[0])
+
+
+def usage_cost(usage: Usage, price: Optional[TokenPrice]) -> float:
+    if not price:
+        return 0.0
+    return (usage.prompt_tokens * price["input"] + usage.completion_tokens * price["output"]) / 1_000_000
+
+
+class MeteredModel(RunnableWrapper[LanguageModelInput, BaseMessage]):
+    """
+    Wraps a (bound) chat model and records the usage of every call,
+    including cancelled calls and streams closed early.
+    """
+
+    def __init__(
+        self,
+        bound: Runnable[LanguageModelInput, BaseMessage],
+        model_id: str,
+        price: Optional[TokenPrice] = None,
+    ) -> None:
+        super().__init__(bound)
+        self.model_id = model_id
+        self.price = price
+
+    def _start(self) -> float:
+        model_in_flight.inc(self.model_id)
+        return time.perf_counter()
+
+    def _finish(self, start: float, status: str) -> float:
+        latency = time.perf_counter() - start
+        model_in_flight.dec(self.model_id)
+        model_requests.inc(self.model_id, status)
+        model_duration.observe(latency, self.model_id)
+        return latency
+
+    def _record(
+        self,
+        input: LanguageModelInput,
+        reported: Optional[tuple[int, int]],
+        messages: list[BaseMessage],
+        start: float,
+        status: str = "ok",
+    ) -> None:
+        if reported:
+            usage = Usage(*reported)
+        else:
+            # only estimated if the provider did not report the usage
+            completion = "".join(message_text(message) for message in messages)
+            usage = Usage(estimate_tokens(prompt_text(input)), estimate_tokens(completion), estimated_calls=1)
+        usage.calls = 1
+        usage.latency = self._finish(start, status)
+        usage.cost = usage_cost(usage, self.price)
+        record_usage(self.model_id, usage)
+
+    @contextmanager
+    def call(
+        self, input: LanguageModelInput, config: RunnableConfig | None, stream: bool
+    ) -> Iterator[WrappedCall[BaseMessage]]:
+        call = _MeteredCall(config, self.model_id, self._start())
+        status = "ok"
+        try:
+            yield call
+        except GeneratorExit:
+            # stream closed early
+            raise
+        except Exception:
+            status = "error"
+            raise
+        except BaseException:
+            status = "cancelled"
+            raise
+        finally:
+            if status == "error" and not call.messages:
+                # failed requests (e.g. rate limited) did not generate anything
+                self._finish(call.start, status)
+            else:
+                self._record(input, call.reported, call.messages, call.start, status)
+
+
+class _MeteredCall(WrappedCall[BaseMessage]):
+    def __init__(self, config: RunnableConfig | None, model_id: str, start: float) -> None:
+        super().__init__(config)
+        self.model_id = model_id
+        self.start = start
+        self.messages: list[BaseMessage] = []
+        self.reported: Optional[tuple[int, int]] = None
+
+    def on_chunk(self, chunk: BaseMessage) -> bool:
+        if not self.messages:
+            model_ttft.observe(time.perf_counter() - self.start, self.model_id)
+        self.messages.append(chunk)
+        self.reported = _add_reported(self.reported, chunk)
+        return False
+
+    def on_output(self, output: BaseMessage) -> None:
+        self.messages = [output]
+        self.reported = reported_usage(output)
+
+
+def _add_reported(reported: Optional[tuple[int, int]], chunk: BaseMessage) -> Optional[tuple[int, int]]:
+    if not (usage := reported_usage(chunk)):
+        return reported
+    if not reported:
+        return usage
+    return reported[0] + usage[0], reported[1] + usage[1]
+
+
+def metered(
+    bound: Runnable[LanguageModelInput, BaseMessage],
+    llm: BaseChatModel,
+    prices: dict[str, TokenPrice],
+) -> MeteredModel:
+    model_id = get_model_id(llm)
+    return MeteredModel(bound, model_id, price_for(model_id, prices))
@@ -0,0 +1,122 @@
+"""
+Runnable Wrappers:
+Base of the runnables wrapping a (bound) model or parser (tracing, early stop, hedging,
+concurrency limits, usage accounting and cassettes) with a single hook around every call.
+"""
+
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Generic, Iterator, Optional, TypeVar
+
+from langchain_core.messages import BaseMessageChunk, message_chunk_to_message
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.utils import Input, Output
+
+from ..utils.msg_tools import join_message_chunks
+
+T = TypeVar("T")
+
+
+class WrappedCall(Generic[T]):
+    """
+    One call of a wrapped runnable, passed to the bound runnable with the given config.
+    Subclasses observe the output (or the streamed chunks) of the call.
+    """
+
+    def __init__(self, config: Optional[RunnableConfig] = None) -> None:
+        self.config = config
+
+    def on_chunk(self, chunk: T) -> bool:
+        """
+        Observe a streamed chunk (before it is yielded), returns True to close the stream after it.
+        """
+        return False
+
+    def on_output(self, output: T) -> None:
+        """
+        Observe the result of an invoke call.
+        """
+
+
+class RunnableWrapper(Runnable[Input, Output]):
+    """
+    Passes invoke, ainvoke, stream and astream through to the bound runnable,
+    every call runs inside the call hook (acall for the async methods).
+    If stream_invoke is set, invoke calls are streamed internally and the chunks joined.
+    """
+
+    def __init__(self, bound: Runnable[Input, Output], stream_invoke: bool = False) -> None:
+        self.bound = bound
+        self.stream_invoke = stream_invoke
+
+    @contextmanager
+    def call(self, input: Input, config: Optional[RunnableConfig], stream: bool) -> Iterator[WrappedCall[Output]]:
+        """
+        Hook around every call: code before and after the yield runs before and after the call
+        (also when it raises or the stream gets closed early).
+        """
+        yield WrappedCall(config)
+
+    @asynccontextmanager
+    async def acall(
+        self, input: Input, config: Optional[RunnableConfig], stream: bool
+    ) -> AsyncIterator[WrappedCall[Output]]:
+        """
+        Hook around every async call, defaults to the sync hook.
+        """
+        with self.call(input, config, stream) as call:
+            yield call
+
+    def _streams_invoke(self) -> bool:
+        return self.stream_invoke
+
+    def invoke(self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Output:
+        if self._streams_invoke():
+            return _join(list(self.stream(input, config, **kwargs)))
+        with self.call(input, config, stream=False) as call:
+            output = self.bound.invoke(input, call.config, **kwargs)
+            call.on_output(output)
+        return output
+
+    async def ainvoke(self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Output:
+        if self._streams_invoke():
+            return _join([chunk async for chunk in self.astream(input, config, **kwargs)])
+        async with self.acall(input, config, stream=False) as call:
+            output = await self.bound.ainvoke(input, call.config, **kwargs)
+            call.on_output(output)
+        return output
+
+    def stream(self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any | None) -> Iterator[Output]:
+        with self.call(input, config, stream=True) as call:
+            iterator = self.bound.stream(input, call.config, **kwargs)
+            try:
+                for chunk in iterator:
+                    stop = call.on_chunk(chunk)
+                    yield chunk
+                    if stop:
+                        break
+            finally:
+                if close := getattr(iterator, "close", None):
+                    close()
+
+    async def astream(
+        self, input: Input, config: Optional[RunnableConfig] = None, **kwargs: Any | None
+    ) -> AsyncIterator[Output]:
+        async with self.acall(input, config, stream=True) as call:
+            iterator = self.bound.astream(input, call.config, **kwargs)
+            try:
+                async for chunk in iterator:
+                    stop = call.on_chunk(chunk)
+                    yield chunk
+                    if stop:
+                        break
+            finally:
+                if aclose := getattr(iterator, "aclose", None):
+                    await aclose()
+
+
+def _join(chunks: list[Any]) -> Any:
+    if not chunks:
+        raise ValueError("The model did not generate any output.")
+    if all(isinstance(chunk, BaseMessageChunk) for chunk in chunks):
+        return message_chunk_to_message(join_message_chunks(chunks))
+    return chunks[-1]
@@ -1,3 +1,5 @@
+from typing import Any
+
 from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import HumanMessage, SystemMessage
 
@@ -36,11 +38,63 @@ verified_ollama_vision_models = [
 ]  # TODO: llamacpp
 
 
+_provider_names = {
+    "openai-chat": "openai",
+    "azure-openai-chat": "azure",
+    "anthropic-chat": "anthropic",
+    "chat-google-generative-ai": "google",
+    "groq-chat": "groq",
+    "ollama-chat": "ollama",
+    "llamacpp-chat": "llamacpp",
+    "fake-chat": "fake",
+}
+
+
+def get_model_id(llm: BaseChatModel) -> str:
+    """
+    Identify a chat model instance using the selector schema: "provider/model_name".
+    """
+    try:
+        llm_type = llm._llm_type
+    except Exception:
+        llm_type = type(llm).__name__.lower()
+    provider = _provider_names.get(llm_type, llm_type)
+    model_name = getattr(llm, "model_name", None) or getattr(llm, "model", None) or getattr(llm, "model_path", "")
+    return f"{provider}/{model_name}" if model_name else provider
+
+
+def model_id_from_params(invocation_params: dict[str, Any]) -> str:
+    """
+    Model id ("provider/model_name") from the invocation params passed to callbacks.
+    """
+    llm_type = invocation_params.get("_type", "")
+    provider = _provider_names.get(llm_type, llm_type)
+    model_name = invocation_params.get("model_name") or invocation_params.get("model")
+    return f"{provider}/{model_name}" if model_name else provider
+
+
+def supports_stop_sequences(llm: BaseChatModel) -> bool:
+    """
+    Providers accepting the stop parameter.
+    """
+    try:
+        return llm._llm_type in _provider_names
+    except Exception:
+        return False
+
+
 def gather_llm_type(llm: BaseChatModel, func_check: bool = True) -> str:
     from langchain_openai import ChatOpenAI
 
     if not isinstance(llm, BaseChatModel):
         return "base_model"
+    from ..backend.cassette import ReplayChatModel
+    from .fake import FakeChatModel
+
+    if isinstance(llm, FakeChatModel):
+        return "function_model" if llm.function_calling else "chat_model"
+    if isinstance(llm, ReplayChatModel):
+        return llm.kind
     if isinstance(llm, ChatOpenAI):
         if llm.model_name in verified_openai_vision_models:
             return "vision_model"
@@ -1,9 +1,13 @@
+import time
 from pathlib import Path
 from typing import Any
 
 from langchain_core.language_models import BaseChatModel
 
+from ..backend.cassette import active_cassette
+from ..backend.metrics import model_selection_duration, model_selections
 from ..backend.settings import FuncchainSettings
+from .abilities import get_model_id
 from .patches.llamacpp import ChatLlamaCpp
 
 
@@ -91,7 +95,7 @@ def univeral_model_selector(
     - "ollama/deepseek-llm-7b-chat"
 
     Supported:
-        [ openai, anthropic, google, ollama ]
+        [ openai, anthropic, google, ollama, fake ]
 
     Raises:
     - ModelNotFoundError, when the model is not found.
@@ -99,6 +103,22 @@ def univeral_model_selector(
     if not isinstance(settings.llm, str) and settings.llm is not None:
         return settings.llm
 
+    # replayed models don't need the provider
+    if (cassette := active_cassette()) and cassette.replaying and (stand_in := cassette.stand_in(settings.llm or "")):
+        return stand_in
+
+    start = time.perf_counter()
+    llm = _select_model(settings, **model_kwargs)
+    model_id = get_model_id(llm)
+    model_selection_duration.observe(time.perf_counter() - start, model_id.split("/")[0])
+    model_selections.inc(model_id)
+    return llm
+
+
+def _select_model(
+    settings: FuncchainSettings,
+    **model_kwargs: Any,
+) -> BaseChatModel:
     model_name = settings.llm if isinstance(settings.llm, str) else ""
     model_kwargs.update(settings.model_kwargs())
 
@@ -147,6 +167,13 @@ def univeral_model_selector(
                     model_kwargs.update(settings.ollama_kwargs())
                     return ChatOllama(model=model, **model_kwargs)
 
+                case "fake":
+                    from .fake import FakeChatModel, selector_rng
+
+                    model_kwargs.update(settings.fake_kwargs())
+                    model_kwargs.setdefault("function_calling", "function" in name)
+                    return FakeChatModel(rng=selector_rng(f"fake/{name}", model_kwargs.get("seed")), **model_kwargs)
+
                 case "llamacpp" | "thebloke" | "gguf":
                     from .patches.llamacpp import ChatLlamaCpp
 
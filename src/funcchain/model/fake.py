@@ -0,0 +1,315 @@
+"""
+Fake Chat Model:
+Offline "fake/..." provider generating schema valid outputs for the requested output type,
+with configurable latency, time to first token, chunk rate, injected errors and function calls.
+Used to test and load test funcchain services without a live provider.
+"""
+
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from datetime import datetime
+from threading import Lock
+from typing import Any, AsyncIterator, Iterator, Literal, Optional
+
+import yaml  # type: ignore
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+
+from ..utils.msg_tools import msg_to_str
+from ..utils.token_counter import estimate_tokens
+
+_WORDS = (
+    "the quick brown fox jumps over a lazy dog while funcchain parses structured output "
+    "from large language models in pure python with pydantic types streaming and retries"
+).split()
+
+_SCHEMA_PATTERN = re.compile(r"```schema\n(.*?)\n```", re.DOTALL)
+
+
+_selector_rngs: dict[tuple[str, Optional[int]], random.Random] = {}
+_selector_rngs_lock = Lock()
+
+
+def selector_rng(selector: str, seed: Optional[int] = None) -> random.Random:
+    """
+    Random generator shared by the models of a "fake/..." selector (and seed).
+    A model is created per call, so every call continues the sequence instead of starting it over.
+    """
+    with _selector_rngs_lock:
+        if (rng := _selector_rngs.get((selector, seed))) is None:
+            rng = _selector_rngs[(selector, seed)] = random.Random(seed)
+        return rng
+
+
+class FakeRateLimitError(Exception):
+    """
+    Injected provider overload (HTTP 429).
+    """
+
+    status_code = 429
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Generates random but schema valid outputs:
+    JSON matching the schema of the format instructions, function calls matching the bound functions
+    (if function_calling) or plain text otherwise.
+    """
+
+    model_name: str = "fake"
+    function_calling: bool = False
+    """ Behave like a function calling model (funcchain binds the output type as function). """
+
+    ttft: float = 0.0
+    """ Mean seconds until the first chunk. """
+    ttft_distribution: Literal["constant", "uniform", "exponential", "lognormal"] = "constant"
+    ttft_spread: float = 0.5
+    """ Relative width of the uniform or sigma of the lognormal distribution. """
+    chunk_rate: float = 0.0
+    """ Chunks per second after the first one (0 = no delay). """
+    chunk_size: int = 4
+    """ Characters per streamed chunk. """
+
+    error_rate: float = 0.0
+    """ Probability of a request failing with a FakeRateLimitError (429). """
+    malformed_rate: float = 0.0
+    """ Probability of returning malformed JSON (cut off inside the object). """
+
+    text_words: int = 24
+    """ Words generated for plain text outputs. """
+    seed: Optional[int] = None
+
+    # accepted for compatibility with the model kwargs of the settings
+    temperature: float = 0.1
+    max_tokens: int = 2048
+    streaming: bool = False
+
+    _rng: random.Random = PrivateAttr(default_factory=random.Random)
+
+    def __init__(self, rng: Optional[random.Random] = None, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._rng = rng or random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def _respond(self, messages: list[BaseMessage], stop: Optional[list[str]], **kwargs: Any) -> AIMessage:
+        if self._rng.random() < self.error_rate:
+            raise FakeRateLimitError("Rate limit reached (fake).")
+        malformed = self._rng.random() < self.malformed_rate
+        if functions := kwargs.get("functions"):
+            # function_call is {"name": ...} or "auto"
+            name = function_call.get("name") if isinstance(function_call := kwargs.get("function_call"), dict) else None
+            function = next((f for f in functions if f["name"] == name), None) or self._rng.choice(functions)
+            arguments = self._json(function["parameters"], malformed)
+            return AIMessage(
+                content="",
+                additional_kwargs={"function_call": {"name": function["name"], "arguments": arguments}},
+            )
+        if schema := self._schema(messages):
+            text = self._json(schema, malformed)
+        else:
+            text = " ".join(self._rng.choice(_WORDS) for _ in range(min(self.text_words, self.max_tokens)))
+        for stop_sequence in stop or []:
+            text = text.split(stop_sequence)[0]
+        return AIMessage(content=text)
+
+    def _schema(self, messages: list[BaseMessage]) -> Optional[dict[str, Any]]:
+        """
+        Schema of the format instructions, if any.
+        """
+        for message in reversed(messages):
+            if matches := _SCHEMA_PATTERN.findall(msg_to_str(message)):
+                schema = yaml.safe_load(matches[-1])
+                return schema if isinstance(schema, dict) else None
+        return None
+
+    def _json(self, schema: dict[str, Any], malformed: bool = False) -> str:
+        if "properties" in schema:
+            schema = {"type": "object", **schema}
+        text = json.dumps(fake_instance(schema, self._rng))
+        if malformed:
+            # cut off inside the object, but still closed
+            return text[: self._rng.randrange(1, max(len(text) - 1, 2))] + "}"
+        return text
+
+    def _chunks(self, message: AIMessage) -> list[AIMessageChunk]:
+        size = max(self.chunk_size, 1)
+        if function_call := message.additional_kwargs.get("function_call"):
+            arguments = function_call["arguments"]
+            return [
+                AIMessageChunk(content="", additional_kwargs={"function_call": {"name": function_call["name"]}}),
+                *(
+                    AIMessageChunk(
+                        content="", additional_kwargs={"function_call": {"arguments": arguments[i : i + size]}}
+                    )
+                    for i in range(0, len(arguments), size)
+                ),
+            ]
+        text = msg_to_str(message)
+        return [AIMessageChunk(content=text[i : i + size]) for i in range(0, len(text), size)] or [
+            AIMessageChunk(content="")
+        ]
+
+    def _ttft(self) -> float:
+        mean, spread = self.ttft, self.ttft_spread
+        if mean <= 0:
+            return 0.0
+        match self.ttft_distribution:
+            case "uniform":
+                return self._rng.uniform(mean * (1 - spread), mean * (1 + spread))
+            case "exponential":
+                return self._rng.expovariate(1 / mean)
+            case "lognormal":
+                return self._rng.lognormvariate(math.log(mean) - spread**2 / 2, spread)
+        return mean
+
+    def _chunk_delay(self) -> float:
+        return 1 / self.chunk_rate if self.chunk_rate > 0 else 0.0
+
+    def _usage(self, messages: list[BaseMessage], message: AIMessage) -> UsageMetadata:
+        prompt = estimate_tokens("\n".join(msg_to_str(m) for m in messages if m.content))
+        function_call = message.additional_kwargs.get("function_call")
+        completion = estimate_tokens(function_call["arguments"] if function_call else msg_to_str(message))
+        return {"input_tokens": prompt, "output_tokens": completion, "total_tokens": prompt + completion}
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._respond(messages, stop, **kwargs)
+        time.sleep(self._ttft() + (len(self._chunks(message)) - 1) * self._chunk_delay())
+        message.usage_metadata = self._usage(messages, message)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._respond(messages, stop, **kwargs)
+        await asyncio.sleep(self._ttft() + (len(self._chunks(message)) - 1) * self._chunk_delay())
+        message.usage_metadata = self._usage(messages, message)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        message = self._respond(messages, stop, **kwargs)
+        delay = self._ttft()
+        for chunk in self._chunks(message):
+            time.sleep(delay)
+            delay = self._chunk_delay()
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager:
+                run_manager.on_llm_new_token(msg_to_str(chunk), chunk=generation)
+            yield generation
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, message)))
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._respond(messages, stop, **kwargs)
+        delay = self._ttft()
+        for chunk in self._chunks(message):
+            await asyncio.sleep(delay)
+            delay = self._chunk_delay()
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager:
+                await run_manager.on_llm_new_token(msg_to_str(chunk), chunk=generation)
+            yield generation
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, message)))
+
+
+def fake_instance(schema: dict[str, Any], rng: random.Random, defs: Optional[dict] = None, depth: int = 0) -> Any:
+    """
+    Random JSON value valid against the (pydantic generated) JSON schema.
+    """
+    defs = schema.get("$defs", {}) if defs is None else defs
+    if ref := schema.get("$ref"):
+        return fake_instance(defs[ref.split("/")[-1]], rng, defs, depth + 1)
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if options := schema.get("anyOf") or schema.get("oneOf"):
+        not_null = [option for option in options if option.get("type") != "null"]
+        if not not_null or (depth > 4 and len(not_null) < len(options)):
+            return None
+        return fake_instance(rng.choice(not_null), rng, defs, depth + 1)
+    if all_of := schema.get("allOf"):
+        return fake_instance(all_of[0], rng, defs, depth)
+
+    schema_type = schema.get("type", "object" if "properties" in schema else "string")
+    if isinstance(schema_type, list):
+        schema_type = next((t for t in schema_type if t != "null"), "null")
+
+    match schema_type:
+        case "object":
+            if properties := schema.get("properties"):
+                return {name: fake_instance(prop, rng, defs, depth + 1) for name, prop in properties.items()}
+            if isinstance(values := schema.get("additionalProperties"), dict) and depth < 5:
+                return {rng.choice(_WORDS): fake_instance(values, rng, defs, depth + 1)}
+            return {}
+        case "array":
+            if prefix_items := schema.get("prefixItems"):
+                return [fake_instance(item, rng, defs, depth + 1) for item in prefix_items]
+            minimum = schema.get("minItems", 0)
+            maximum = schema.get("maxItems", max(minimum, 3))
+            length = rng.randint(minimum, maximum) if depth < 5 else minimum
+            return [fake_instance(schema.get("items", {}), rng, defs, depth + 1) for _ in range(length)]
+        case "integer":
+            low = schema.get("minimum", schema.get("exclusiveMinimum", -1) + 1)
+            high = schema.get("maximum", schema.get("exclusiveMaximum", max(low, 0) + 101) - 1)
+            return rng.randint(int(low), int(high))
+        case "number":
+            low = schema.get("minimum", schema.get("exclusiveMinimum", 0.0))
+            high = schema.get("maximum", schema.get("exclusiveMaximum", max(low, 0.0) + 1.0))
+            return rng.uniform(low, high)
+        case "boolean":
+            return rng.random() < 0.5
+        case "null":
+            return None
+    return _fake_string(schema, rng)
+
+
+def _fake_string(schema: dict[str, Any], rng: random.Random) -> str:
+    match schema.get("format"):
+        case "date-time":
+            return datetime.now().isoformat()
+        case "date":
+            return datetime.now().date().isoformat()
+        case "email":
+            return f"{rng.choice(_WORDS)}@example.com"
+        case "uri":
+            return f"https://example.com/{rng.choice(_WORDS)}"
+    text = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 4)))
+    min_length, max_length = schema.get("minLength", 0), schema.get("maxLength")
+    text = text.ljust(min_length, "x")
+    return text[:max_length] if max_length is not None else text
@@ -22,6 +22,15 @@ from langchain_core.utils.utils import build_extra_kwargs
 logger = logging.getLogger(__name__)
 
 
+def _join_logprobs(logprobs: List[Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+    """
+    Concatenate the logprobs lists of all chunks.
+    """
+    if not (parts := [part for part in logprobs if part]):
+        return None
+    return {key: [value for part in parts for value in part.get(key) or []] for key in parts[0]}
+
+
 try:
 
     class _LlamaCppCommon(BaseLanguageModel):
@@ -290,21 +299,20 @@ try:
             verbose: bool = False,
             **kwargs: Any,
         ) -> ChatGenerationChunk:
-            final_chunk: Optional[ChatGenerationChunk] = None
-            for chunk in self._stream(messages, stop, **kwargs):
-                if final_chunk is None:
-                    final_chunk = chunk
-                else:
-                    final_chunk += chunk
-                if run_manager:
-                    run_manager.on_llm_new_token(
-                        chunk.text,
-                        verbose=verbose,
-                    )
-            if final_chunk is None:
+            # collect the parts and join them once (adding up the chunks is quadratic),
+            # the callbacks are called by _stream (once per chunk)
+            texts: List[str] = []
+            logprobs: List[Optional[Dict[str, Any]]] = []
+            for chunk in self._stream(messages, stop, run_manager=run_manager, **kwargs):
+                texts.append(chunk.text)
+                logprobs.append((chunk.generation_info or {}).get("logprobs"))
+            if not texts:
                 raise ValueError("No data received from llamacpp stream.")
 
-            return final_chunk
+            return ChatGenerationChunk(
+                message=AIMessageChunk(content="".join(texts)),
+                generation_info={"logprobs": _join_logprobs(logprobs)},
+            )
 
         def _generate(
             self,
@@ -356,7 +364,9 @@ try:
                 )
                 yield chunk
                 if run_manager:
-                    run_manager.on_llm_new_token(token=chunk.text, verbose=self.verbose, log_probs=logprobs)
+                    run_manager.on_llm_new_token(
+                        token=chunk.text, chunk=chunk, verbose=self.verbose, log_probs=logprobs
+                    )
 except ImportError:
 
     class ChatLlamaCpp:  # type: ignore
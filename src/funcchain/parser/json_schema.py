@@ -1,17 +1,27 @@
 import json
+import logging
 import re
-from typing import Type, TypeVar
+from typing import Any, AsyncIterator, Iterator, Optional, Type, TypeVar
 
 import yaml  # type: ignore
 from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import BaseMessage
 from langchain_core.output_parsers import BaseOutputParser
-from langchain_core.runnables import Runnable
+from langchain_core.pydantic_v1 import Field
+from langchain_core.runnables import Runnable, RunnableConfig
 from pydantic import BaseModel, ValidationError
 
+from ..backend.metrics import parse_errors, parse_retries
+from ..backend.retry import RetryPolicy, default_retry_policy
+from ..backend.tracing import span
 from ..schema.types import UniversalChatModel
+from ..utils.msg_tools import msg_to_str
+from .partial import PartialModelStream, PartialStream
 
 M = TypeVar("M", bound=BaseModel)
 
+logger = logging.getLogger(__name__)
+
 
 class RetryJsonPydanticParser(BaseOutputParser[M]):
     """Parse an output using a pydantic model."""
@@ -21,34 +31,98 @@ class RetryJsonPydanticParser(BaseOutputParser[M]):
 
     retry: int
     retry_llm: UniversalChatModel = None
+    retry_policy: RetryPolicy = Field(default_factory=default_retry_policy)
 
     def parse(self, text: str) -> M:
         try:
-            matches = re.findall(r"\{.*\}", text.strip(), re.MULTILINE | re.IGNORECASE | re.DOTALL)
-            if len(matches) > 1:
-                for match in matches:
-                    try:
-                        json_object = json.loads(match, strict=False)
-                        return self.pydantic_object.model_validate(json_object)
-                    except (json.JSONDecodeError, ValidationError):
-                        continue
-            elif len(matches) == 1:
-                json_object = json.loads(matches[0], strict=False)
-                return self.pydantic_object.model_validate(json_object)
-            # no matches
-            raise OutputParserException(
-                f"No JSON {self.pydantic_object.__name__} found in completion {text}.",
-                llm_output=text,
-            )
+            return self._parse(text)
+        except (json.JSONDecodeError, ValidationError) as e:
+            if _retry_allowed(self.retry, self.retry_policy, self._type_name):
+                with span("retry", output_type=self._type_name, retries_left=self.retry):
+                    self.retry_policy.wait()
+                    return self.retry_chain.invoke(
+                        input={"output": text, "error": str(e)},
+                        config={"run_name": "RetryPydanticOutputParser"},
+                    )
+            raise _failed(e, self._type_name, text)
+
+    async def aparse(self, text: str) -> M:
+        try:
+            return self._parse(text)
         except (json.JSONDecodeError, ValidationError) as e:
-            if self.retry > 0:
-                print(f"Retrying parsing {self.pydantic_object.__name__}...")
-                return self.retry_chain.invoke(
-                    input={"output": text, "error": str(e)},
-                    config={"run_name": "RetryPydanticOutputParser"},
-                )
-            # no retries left
-            raise OutputParserException(str(e), llm_output=text)
+            if _retry_allowed(self.retry, self.retry_policy, self._type_name):
+                with span("retry", output_type=self._type_name, retries_left=self.retry):
+                    await self.retry_policy.await_backoff()
+                    return await self.retry_chain.ainvoke(
+                        input={"output": text, "error": str(e)},
+                        config={"run_name": "RetryPydanticOutputParser"},
+                    )
+            raise _failed(e, self._type_name, text)
+
+    def _parse(self, text: str) -> M:
+        matches = re.findall(r"\{.*\}", text.strip(), re.MULTILINE | re.IGNORECASE | re.DOTALL)
+        if len(matches) > 1:
+            for match in matches:
+                try:
+                    json_object = json.loads(match, strict=False)
+                    return self.pydantic_object.model_validate(json_object)
+                except (json.JSONDecodeError, ValidationError):
+                    continue
+        elif len(matches) == 1:
+            json_object = json.loads(matches[0], strict=False)
+            return self.pydantic_object.model_validate(json_object)
+        # no matches
+        raise OutputParserException(
+            f"No JSON {self.pydantic_object.__name__} found in completion {text}.",
+            llm_output=text,
+        )
+
+    @property
+    def _type_name(self) -> str:
+        return self.pydantic_object.__name__
+
+    def transform(
+        self, input: Iterator[str | BaseMessage], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[M]:
+        """
+        Yield partially filled models while streaming, the last one is the parsed result.
+        """
+        yield from self._transform_stream_with_config(input, self._transform, config, run_type="parser")
+
+    async def atransform(
+        self, input: AsyncIterator[str | BaseMessage], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[M]:
+        async for output in self._atransform_stream_with_config(input, self._atransform, config, run_type="parser"):
+            yield output
+
+    def _transform(self, input: Iterator[str | BaseMessage]) -> Iterator[M]:
+        stream = self._partial_stream()
+        chunks: list[str] = []
+        for chunk in input:
+            chunks.append(delta := chunk if isinstance(chunk, str) else msg_to_str(chunk))
+            if stream and (partial := stream.feed(delta)) is not None:
+                yield partial
+        result = self.parse("".join(chunks))
+        if stream is None:
+            yield result
+        elif (output := stream.final(result)) is not None:
+            yield output
+
+    async def _atransform(self, input: AsyncIterator[str | BaseMessage]) -> AsyncIterator[M]:
+        stream = self._partial_stream()
+        chunks: list[str] = []
+        async for chunk in input:
+            chunks.append(delta := chunk if isinstance(chunk, str) else msg_to_str(chunk))
+            if stream and (partial := stream.feed(delta)) is not None:
+                yield partial
+        result = await self.aparse("".join(chunks))
+        if stream is None:
+            yield result
+        elif (output := stream.final(result)) is not None:
+            yield output
+
+    def _partial_stream(self) -> PartialStream | None:
+        return PartialModelStream(self.pydantic_object)
 
     def get_format_instructions(self) -> str:
         schema = self.pydantic_object.model_json_schema()
@@ -81,14 +155,102 @@ class RetryJsonPydanticParser(BaseOutputParser[M]):
             input_args=["output", "error"],
             output_types=[self.pydantic_object],
             llm=self.retry_llm,
-            settings_override={"retry_parse": self.retry - 1},
+            settings_override=self.retry_policy.next_override(retry=self.retry - 1),
         )
 
 
 class RetryJsonPydanticUnionParser(BaseOutputParser[M]):
-    """Parse an output using a pydantic model."""
+    """Parse an output into the first of the pydantic models it validates as."""
 
     output_types: list[Type[M]]
+    """The pydantic models to choose from."""
+
+    retry: int = 0
+    retry_llm: UniversalChatModel = None
+    retry_policy: RetryPolicy = Field(default_factory=default_retry_policy)
 
     def parse(self, text: str) -> M:
-        raise NotImplementedError
+        try:
+            return self._parse(text)
+        except (json.JSONDecodeError, ValidationError, OutputParserException) as e:
+            if _retry_allowed(self.retry, self.retry_policy, self._type_name):
+                with span("retry", output_type=self._type_name, retries_left=self.retry):
+                    self.retry_policy.wait()
+                    return self.retry_chain.invoke(
+                        input={"output": text, "error": str(e)},
+                        config={"run_name": "RetryPydanticUnionOutputParser"},
+                    )
+            raise _failed(e, self._type_name, text)
+
+    async def aparse(self, text: str) -> M:
+        try:
+            return self._parse(text)
+        except (json.JSONDecodeError, ValidationError, OutputParserException) as e:
+            if _retry_allowed(self.retry, self.retry_policy, self._type_name):
+                with span("retry", output_type=self._type_name, retries_left=self.retry):
+                    await self.retry_policy.await_backoff()
+                    return await self.retry_chain.ainvoke(
+                        input={"output": text, "error": str(e)},
+                        config={"run_name": "RetryPydanticUnionOutputParser"},
+                    )
+            raise _failed(e, self._type_name, text)
+
+    def _parse(self, text: str) -> M:
+        matches = re.findall(r"\{.*\}", text.strip(), re.MULTILINE | re.IGNORECASE | re.DOTALL)
+        if not matches:
+            raise OutputParserException(f"No JSON {self._type_name} found in completion {text}.", llm_output=text)
+        errors: list[str] = []
+        for match in matches:
+            json_object = json.loads(match, strict=False)
+            for output_type in self.output_types:
+                try:
+                    return output_type.model_validate(json_object)
+                except ValidationError as e:
+                    errors.append(f"{output_type.__name__}: {e}")
+        raise OutputParserException("\n".join(errors), llm_output=text)
+
+    @property
+    def _type_name(self) -> str:
+        return " | ".join(output_type.__name__ for output_type in self.output_types)
+
+    def get_format_instructions(self) -> str:
+        schemas = []
+        for output_type in self.output_types:
+            schema = output_type.model_json_schema()
+            schema.pop("type", None)
+            schemas.append(f"```schema\n{yaml.dump(schema)}```")
+        return (
+            "Please respond with a json result matching one of the following schemas:\n\n"
+            + "\n\n".join(schemas)
+            + "\nDo not repeat the schema. Only respond with the resulting json object."
+        )
+
+    @property
+    def _type(self) -> str:
+        return "pydantic_union"
+
+    @property
+    def retry_chain(self) -> Runnable:
+        from ..syntax.executable import compile_runnable
+
+        return compile_runnable(
+            instruction="Retry parsing the output by fixing the error.",
+            input_args=["output", "error"],
+            output_types=self.output_types,
+            llm=self.retry_llm,
+            settings_override=self.retry_policy.next_override(retry=self.retry - 1),
+        )
+
+
+def _retry_allowed(retry: int, policy: RetryPolicy, type_name: str) -> bool:
+    if retry > 0 and policy.acquire():
+        logger.info("Retrying parsing %s...", type_name)
+        parse_retries.inc(type_name)
+        return True
+    return False
+
+
+def _failed(error: Exception, type_name: str, text: str) -> OutputParserException:
+    # no retries left
+    parse_errors.inc(type_name)
+    return OutputParserException(str(error), llm_output=text)
@@ -1,56 +1,130 @@
 import copy
-from typing import Generic, Type, TypeVar
+import logging
+from typing import Any, AsyncIterator, Generic, Iterator, Optional, Type, TypeVar
 
 from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import BaseMessage, BaseMessageChunk
 from langchain_core.output_parsers import BaseGenerationOutputParser
 from langchain_core.outputs import ChatGeneration, Generation
-from langchain_core.runnables import Runnable
+from langchain_core.pydantic_v1 import Field
+from langchain_core.runnables import Runnable, RunnableConfig
 from pydantic import BaseModel, ValidationError
 
+from ..backend.metrics import parse_errors, parse_retries
+from ..backend.retry import RetryPolicy, default_retry_policy
+from ..backend.tracing import span
 from ..schema.types import UniversalChatModel
 from ..syntax.output_types import CodeBlock as CodeBlock
-from ..utils.msg_tools import msg_to_str
+from ..utils.msg_tools import join_message_chunks, msg_arguments_delta, msg_to_str
+from .partial import PartialModelStream, PartialStream, primitive_stream
 
 M = TypeVar("M", bound=BaseModel)
 
+logger = logging.getLogger(__name__)
+
 
 class RetryOpenAIFunctionPydanticParser(BaseGenerationOutputParser[M]):
     pydantic_schema: Type[M]
     args_only: bool = False
     retry: int
     retry_llm: UniversalChatModel = None
+    retry_policy: RetryPolicy = Field(default_factory=default_retry_policy)
 
     def parse_result(self, result: list[Generation], *, partial: bool = False) -> M:
         try:
-            generation = result[0]
-            if not isinstance(generation, ChatGeneration):
-                raise OutputParserException(
-                    "This output parser can only be used with a chat generation.",
-                )
-            message = generation.message
-            try:
-                func_call = copy.deepcopy(message.additional_kwargs["function_call"])
-            except KeyError as exc:
-                raise OutputParserException(
-                    f"Could not parse function call: {exc}",
-                    llm_output=msg_to_str(message),
-                )
-
-            if self.args_only:
-                pydantic_args = self.pydantic_schema.model_validate_json(func_call)
-            else:
-                pydantic_args = self.pydantic_schema.model_validate_json(func_call["arguments"])
-
-            return pydantic_args
+            return self._parse_result(result)
+        except ValidationError as e:
+            if _retry_allowed(self.retry, self.retry_policy, self.pydantic_schema.__name__):
+                with span("retry", output_type=self.pydantic_schema.__name__, retries_left=self.retry):
+                    self.retry_policy.wait()
+                    return self.retry_chain.invoke(
+                        input={"output": result, "error": str(e)},
+                        config={"run_name": "RetryOpenAIFunctionPydanticParser"},
+                    )
+            raise _failed(e, self.pydantic_schema.__name__, result)
+
+    async def aparse_result(self, result: list[Generation], *, partial: bool = False) -> M:
+        try:
+            return self._parse_result(result)
         except ValidationError as e:
-            if self.retry > 0:
-                print(f"Retrying parsing {self.pydantic_schema.__name__}...")
-                return self.retry_chain.invoke(
-                    input={"output": result, "error": str(e)},
-                    config={"run_name": "RetryOpenAIFunctionPydanticParser"},
-                )
-            # no retries left
-            raise OutputParserException(str(e), llm_output=msg_to_str(message))
+            if _retry_allowed(self.retry, self.retry_policy, self.pydantic_schema.__name__):
+                with span("retry", output_type=self.pydantic_schema.__name__, retries_left=self.retry):
+                    await self.retry_policy.await_backoff()
+                    return await self.retry_chain.ainvoke(
+                        input={"output": result, "error": str(e)},
+                        config={"run_name": "RetryOpenAIFunctionPydanticParser"},
+                    )
+            raise _failed(e, self.pydantic_schema.__name__, result)
+
+    def _parse_result(self, result: list[Generation]) -> M:
+        generation = result[0]
+        if not isinstance(generation, ChatGeneration):
+            raise OutputParserException(
+                "This output parser can only be used with a chat generation.",
+            )
+        message = generation.message
+        try:
+            func_call = copy.deepcopy(message.additional_kwargs["function_call"])
+        except KeyError as exc:
+            raise OutputParserException(
+                f"Could not parse function call: {exc}",
+                llm_output=msg_to_str(message),
+            )
+
+        if self.args_only:
+            pydantic_args = self.pydantic_schema.model_validate_json(func_call)
+        else:
+            pydantic_args = self.pydantic_schema.model_validate_json(func_call["arguments"])
+
+        return pydantic_args
+
+    def transform(
+        self, input: Iterator[str | BaseMessage], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[M]:
+        """
+        Yield partially filled models from the function call argument deltas,
+        the last one is the parsed result.
+        """
+        yield from self._transform_stream_with_config(input, self._transform, config, run_type="parser")
+
+    async def atransform(
+        self, input: AsyncIterator[str | BaseMessage], config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[M]:
+        async for output in self._atransform_stream_with_config(input, self._atransform, config, run_type="parser"):
+            yield output
+
+    def _transform(self, input: Iterator[str | BaseMessage]) -> Iterator[M]:
+        stream = self._partial_stream()
+        chunks: list[BaseMessageChunk] = []
+        for chunk in input:
+            assert isinstance(chunk, BaseMessageChunk)
+            chunks.append(chunk)
+            if stream and (partial := stream.feed(msg_arguments_delta(chunk))) is not None:
+                yield partial
+        message = join_message_chunks(chunks)
+        result = self.parse_result([ChatGeneration(message=message)])
+        if stream is None:
+            yield result
+        elif (output := stream.final(result)) is not None:
+            yield output
+
+    async def _atransform(self, input: AsyncIterator[str | BaseMessage]) -> AsyncIterator[M]:
+        stream = self._partial_stream()
+        chunks: list[BaseMessageChunk] = []
+        async for chunk in input:
+            assert isinstance(chunk, BaseMessageChunk)
+            chunks.append(chunk)
+            if stream and (partial := stream.feed(msg_arguments_delta(chunk))) is not None:
+                yield partial
+        message = join_message_chunks(chunks)
+        result = await self.aparse_result([ChatGeneration(message=message)])
+        if stream is None:
+            yield result
+        elif (output := stream.final(result)) is not None:
+            yield output
+
+    def _partial_stream(self) -> PartialStream | None:
+        return PartialModelStream(self.pydantic_schema)
 
     @property
     def retry_chain(self) -> Runnable:
@@ -61,7 +135,7 @@ class RetryOpenAIFunctionPydanticParser(BaseGenerationOutputParser[M]):
             input_args=["output", "error"],
             output_types=[self.pydantic_schema],
             llm=self.retry_llm,
-            settings_override={"retry_parse": self.retry - 1},
+            settings_override=self.retry_policy.next_override(retry=self.retry - 1),
         )
 
 
@@ -70,45 +144,64 @@ class RetryOpenAIFunctionPydanticUnionParser(BaseGenerationOutputParser[M]):
     args_only: bool = False
     retry: int
     retry_llm: UniversalChatModel = None
+    retry_policy: RetryPolicy = Field(default_factory=default_retry_policy)
 
     def parse_result(self, result: list[Generation], *, partial: bool = False) -> M:
+        type_name = " | ".join(t.__name__ for t in self.output_types)
         try:
-            function_call = self._pre_parse_function_call(result)
+            return self._parse_result(result)
+        except (ValidationError, OutputParserException) as e:
+            if _retry_allowed(self.retry, self.retry_policy, type_name):
+                with span("retry", output_type=type_name, retries_left=self.retry):
+                    self.retry_policy.wait()
+                    return self.retry_chain.invoke(
+                        input={"output": result, "error": str(e)},
+                        config={"run_name": "RetryOpenAIFunctionPydanticUnionParser"},
+                    )
+            raise _failed(e, type_name, result)
 
-            output_type_names = [t.__name__.lower() for t in self.output_types]
+    async def aparse_result(self, result: list[Generation], *, partial: bool = False) -> M:
+        type_name = " | ".join(t.__name__ for t in self.output_types)
+        try:
+            return self._parse_result(result)
+        except (ValidationError, OutputParserException) as e:
+            if _retry_allowed(self.retry, self.retry_policy, type_name):
+                with span("retry", output_type=type_name, retries_left=self.retry):
+                    await self.retry_policy.await_backoff()
+                    return await self.retry_chain.ainvoke(
+                        input={"output": result, "error": str(e)},
+                        config={"run_name": "RetryOpenAIFunctionPydanticUnionParser"},
+                    )
+            raise _failed(e, type_name, result)
 
-            if function_call["name"] not in output_type_names:
-                raise OutputParserException("Invalid function call")
+    def _parse_result(self, result: list[Generation]) -> M:
+        function_call = self._pre_parse_function_call(result)
 
-            output_type = self._get_output_type(function_call["name"])
+        output_type_names = [t.__name__.lower() for t in self.output_types]
 
-            generation = result[0]
-            if not isinstance(generation, ChatGeneration):
-                raise OutputParserException("This output parser can only be used with a chat generation.")
-            message = generation.message
-            try:
-                func_call = copy.deepcopy(message.additional_kwargs["function_call"])
-            except KeyError as exc:
-                raise OutputParserException(
-                    f"Could not parse function call: {exc}",
-                    llm_output=msg_to_str(message),
-                )
+        if function_call["name"] not in output_type_names:
+            raise OutputParserException("Invalid function call")
 
-            if self.args_only:
-                pydantic_args = output_type.model_validate_json(func_call["arguments"])
-            else:
-                pydantic_args = output_type.model_validate_json(func_call["arguments"])
+        output_type = self._get_output_type(function_call["name"])
 
-            return pydantic_args
-        except (ValidationError, OutputParserException) as e:
-            if self.retry > 0:
-                print(f"Retrying parsing {output_type.__name__}...")
-                return self.retry_chain.invoke(
-                    input={"output": result, "error": str(e)},
-                    config={"run_name": "RetryOpenAIFunctionPydanticUnionParser"},
-                )
-            # no retries left
-            raise OutputParserException(str(e), llm_output=msg_to_str(message))
+        generation = result[0]
+        if not isinstance(generation, ChatGeneration):
+            raise OutputParserException("This output parser can only be used with a chat generation.")
+        message = generation.message
+        try:
+            func_call = copy.deepcopy(message.additional_kwargs["function_call"])
+        except KeyError as exc:
+            raise OutputParserException(
+                f"Could not parse function call: {exc}",
+                llm_output=msg_to_str(message),
+            )
+
+        if self.args_only:
+            pydantic_args = output_type.model_validate_json(func_call["arguments"])
+        else:
+            pydantic_args = output_type.model_validate_json(func_call["arguments"])
+
+        return pydantic_args
 
     def _pre_parse_function_call(self, result: list[Generation]) -> dict:
         generation = result[0]
@@ -140,7 +233,7 @@ class RetryOpenAIFunctionPydanticUnionParser(BaseGenerationOutputParser[M]):
             input_args=["output", "error"],
             output_types=self.output_types,
             llm=self.retry_llm,
-            settings_override={"retry_parse": self.retry - 1},
+            settings_override=self.retry_policy.next_override(retry=self.retry - 1),
         )
 
 
@@ -152,3 +245,25 @@ class RetryOpenAIFunctionPrimitiveTypeParser(RetryOpenAIFunctionPydanticParser,
 
     def parse_result(self, result: list[Generation], *, partial: bool = False) -> M:
         return super().parse_result(result, partial=partial).value
+
+    async def aparse_result(self, result: list[Generation], *, partial: bool = False) -> M:
+        return (await super().aparse_result(result, partial=partial)).value
+
+    def _partial_stream(self) -> PartialStream | None:
+        return primitive_stream(self.pydantic_schema)
+
+
+def _retry_allowed(retry: int, policy: RetryPolicy, type_name: str) -> bool:
+    if retry > 0 and policy.acquire():
+        logger.info("Retrying parsing %s...", type_name)
+        parse_retries.inc(type_name)
+        return True
+    return False
+
+
+def _failed(error: Exception, type_name: str, result: list[Generation]) -> OutputParserException:
+    # no retries left
+    parse_errors.inc(type_name)
+    generation = result[0]
+    llm_output = msg_to_str(generation.message) if isinstance(generation, ChatGeneration) else generation.text
+    return OutputParserException(str(error), llm_output=llm_output)
@@ -0,0 +1,371 @@
+"""
+Partial Parsing:
+Incrementally parse streamed JSON and build partially filled pydantic models.
+"""
+
+import json
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Generic, Type, TypeVar, get_args, get_origin
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from ..backend.metrics import metrics
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class PartialJsonScanner:
+    """
+    Scans streamed JSON text chunk by chunk (every character only once)
+    and parses the fields of the outer object whenever another field
+    or another item of a list field is complete.
+    Only the newly completed text is parsed, so the whole stream is parsed in linear time.
+    Text before the first "{" (e.g. a code fence) is ignored.
+    Without track_fields only the end of the outer object is detected.
+    """
+
+    def __init__(self, track_fields: bool = True) -> None:
+        self.track_fields = track_fields
+        self.completed: dict[str, Any] = {}
+        """ Completed fields of the outer object. """
+        self.items_key: str | None = None
+        """ Key of the list field currently streamed. """
+        self.items: list[Any] = []
+        """ Completed items of the list field currently streamed. """
+        self.done = False
+        self._chunks: list[str] = []
+        self._length = 0
+        self._pending: list[str] = []
+        """ Text since _offset, everything before is parsed. """
+        self._offset = 0
+        self._start: int | None = None
+        self._field_start = 0
+        self._item_start = 0
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self._item_open = False
+        self._stop = 0
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Add the next chunk, returns True if another field or list item was completed.
+        """
+        offset = self._length
+        self._chunks.append(chunk)
+        if self.track_fields:
+            self._pending.append(chunk)
+        self._length += len(chunk)
+        completed = False
+        for i, char in enumerate(chunk, offset):
+            if self.done:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._in_list():
+                        completed |= self._complete_item(i + 1)
+            elif self._start is None:
+                if char == "{":
+                    self._start = i
+                    self._field_start = i + 1
+                    self._stack.append(char)
+            elif char == '"' or char in "{[":
+                if self._in_list():
+                    self._open_item(i)
+                if char == '"':
+                    self._in_string = True
+                else:
+                    if char == "[" and len(self._stack) == 1:
+                        self._start_list(i)
+                    self._stack.append(char)
+            elif char in "}]":
+                if self._in_list() and self._item_open:
+                    # last item without closing character, e.g. [1, 2]
+                    completed |= self._complete_item(i)
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+                    self._stop = i + 1
+                elif self._in_list():
+                    completed |= self._complete_item(i + 1)
+            elif char == ",":
+                if len(self._stack) == 1:
+                    completed |= self._complete_field(i)
+                elif self._in_list() and self._item_open:
+                    completed |= self._complete_item(i)
+            elif not char.isspace() and self._in_list():
+                self._open_item(i)
+        return completed
+
+    def _in_list(self) -> bool:
+        """Inside the items of a list field of the outer object."""
+        return len(self._stack) == 2 and self._stack[1] == "["
+
+    def _take(self, start: int, end: int) -> str:
+        """
+        Text between the positions, the text before end is dropped.
+        """
+        text = "".join(self._pending)
+        self._pending = [text[end - self._offset :]]
+        taken, self._offset = text[start - self._offset : end - self._offset], end
+        return taken
+
+    def _start_list(self, i: int) -> None:
+        if not self.track_fields:
+            return
+        try:
+            self.items_key = json.loads(self._take(self._field_start, i).strip().rstrip(":"))
+        except json.JSONDecodeError:
+            self.items_key = None
+        self.items = []
+
+    def _open_item(self, i: int) -> None:
+        if not self._item_open:
+            self._item_open = True
+            self._item_start = i
+
+    def _complete_item(self, end: int) -> bool:
+        self._item_open = False
+        if self.items_key is None:
+            return False
+        try:
+            self.items.append(json.loads(self._take(self._item_start, end), strict=False))
+            return True
+        except json.JSONDecodeError:
+            # reported again once the complete output is parsed
+            self.items_key = None
+            return False
+
+    def _complete_field(self, end: int) -> bool:
+        if not self.track_fields:
+            return False
+        start, self._field_start = self._field_start, end + 1
+        if self.items_key is not None:
+            self.completed[self.items_key] = self.items
+            self.items_key, self.items = None, []
+            self._take(end, end)
+            return True
+        if start < self._offset:
+            # the text of a list field with an invalid item is already dropped
+            self._take(end, end)
+            return False
+        try:
+            self.completed.update(json.loads("{" + self._take(start, end) + "}", strict=False))
+            return True
+        except json.JSONDecodeError:
+            return False
+
+    def object_text(self) -> str | None:
+        """
+        The complete outer object once done.
+        """
+        if not self.done or self._start is None:
+            return None
+        return "".join(self._chunks)[self._start : self._stop]
+
+    def fields(self) -> dict[str, Any] | None:
+        """
+        The completed fields (and completed items of the current list field) of the outer object so far.
+        """
+        if not self.completed and self.items_key is None:
+            return None
+        if self.items_key is None:
+            return dict(self.completed)
+        return {**self.completed, self.items_key: list(self.items)}
+
+
+@lru_cache(maxsize=256)
+def _field_adapters(model: Type[BaseModel]) -> dict[str, tuple[str, TypeAdapter]]:
+    return {
+        field.alias or name: (name, TypeAdapter(field.rebuild_annotation()))
+        for name, field in model.model_fields.items()
+    }
+
+
+metrics.register_cache("partial_field_adapters", _field_adapters.cache_info)
+
+
+@lru_cache(maxsize=256)
+def _item_adapter(model: Type[BaseModel], key: str) -> TypeAdapter | None:
+    """
+    Adapter of the items of a list field, None for other fields.
+    """
+    name = _field_adapters(model)[key][0]
+    annotation = model.model_fields[name].rebuild_annotation()
+    if annotation is list:
+        return TypeAdapter(Any)
+    if get_origin(annotation) is list:
+        return TypeAdapter(get_args(annotation)[0])
+    return None
+
+
+def partial_model(model: Type[M], fields: dict[str, Any]) -> M:
+    """
+    Instance of the model with only the given (valid) fields set,
+    all other fields are None and missing in model_fields_set.
+    """
+    values: dict[str, Any] = {}
+    for key, value in fields.items():
+        if key not in (adapters := _field_adapters(model)):
+            continue
+        name, adapter = adapters[key]
+        try:
+            values[name] = adapter.validate_python(value)
+        except ValidationError:
+            continue
+    return model.model_construct(
+        _fields_set=set(values),
+        **{name: values.get(name) for name in model.model_fields},
+    )
+
+
+class PartialStream:
+    """
+    Turns streamed JSON deltas into output chunks of a parser.
+    """
+
+    def __init__(self) -> None:
+        self.scanner = PartialJsonScanner()
+
+    def feed(self, delta: str) -> Any | None:
+        raise NotImplementedError
+
+    def final(self, result: Any) -> Any | None:
+        """
+        The last output chunk given the parsed complete result.
+        """
+        return result
+
+
+class PartialModelStream(PartialStream, Generic[M]):
+    """
+    Turns streamed JSON deltas into progressively filled model instances.
+    Every field (and list item) is validated once, when it is complete.
+    """
+
+    def __init__(self, model: Type[M]) -> None:
+        super().__init__()
+        self.model = model
+        self._adapters = _field_adapters(model)
+        self._values: dict[str, Any] = {}
+        self._validated = 0
+        """ Number of completed fields already validated. """
+        self._items: list[Any] = []
+        self._items_valid = True
+
+    def feed(self, delta: str) -> M | None:
+        """
+        Returns a new partial instance whenever another field (or list item) is complete.
+        """
+        if not self.scanner.feed(delta):
+            return None
+        scanner = self.scanner
+        if len(scanner.completed) > self._validated:
+            for key, value in islice(scanner.completed.items(), self._validated, None):
+                self._validate(key, value)
+            self._validated = len(scanner.completed)
+            self._items, self._items_valid = [], True
+        values = self._values
+        if (items_key := scanner.items_key) is not None and items_key in self._adapters and self._items_valid:
+            field_name = self._adapters[items_key][0]
+            if self._validate_items(items_key, scanner.items):
+                values = {**values, field_name: list(self._items)}
+        return self.model.model_construct(
+            _fields_set=set(values),
+            **{name: values.get(name) for name in self.model.model_fields},
+        )
+
+    def _validate(self, key: str, value: Any) -> None:
+        if key not in self._adapters:
+            return
+        name, adapter = self._adapters[key]
+        try:
+            self._values[name] = adapter.validate_python(value)
+        except ValidationError:
+            self._values.pop(name, None)
+
+    def _validate_items(self, key: str, items: list[Any]) -> bool:
+        """
+        Validate the new items of the streamed list field.
+        """
+        if (item_adapter := _item_adapter(self.model, key)) is None:
+            return False
+        try:
+            self._items.extend(item_adapter.validate_python(item) for item in items[len(self._items) :])
+        except ValidationError:
+            self._items_valid = False
+        return self._items_valid
+
+
+class ItemsReset(list):
+    """
+    Last chunk of a list stream whose output was retried after items were already yielded:
+    the complete result of the retry, replacing all the items yielded before.
+    """
+
+
+class ListItemStream(PartialStream):
+    """
+    Turns streamed JSON deltas of a wrapped list ({"value": [...]})
+    into chunks of the newly completed and validated items.
+    """
+
+    def __init__(self, item_type: Any, key: str = "value") -> None:
+        super().__init__()
+        self.key = key
+        self._adapter: TypeAdapter = TypeAdapter(item_type)
+        self._items: list[Any] = []
+        """ Items yielded so far. """
+        self._invalid = False
+
+    def feed(self, delta: str) -> list | None:
+        """
+        Returns the new items whenever another item is complete.
+        """
+        if not self.scanner.feed(delta) or self._invalid:
+            return None
+        scanner = self.scanner
+        items = scanner.items if scanner.items_key == self.key else scanner.completed.get(self.key)
+        if not isinstance(items, list):
+            return None
+        if len(items) <= len(self._items):
+            return None
+        try:
+            new_items = [self._adapter.validate_python(item) for item in items[len(self._items) :]]
+        except ValidationError:
+            # the remaining items are yielded after parsing (and retrying) the complete output
+            self._invalid = True
+            return None
+        self._items.extend(new_items)
+        return new_items
+
+    def final(self, result: Any) -> list | None:
+        """
+        The items of the parsed result that were not yielded yet.
+        If the result doesn't start with the yielded items (it was retried), the whole result as ItemsReset.
+        """
+        count = len(self._items)
+        if result[:count] != self._items:
+            return ItemsReset(result)
+        if remaining := result[count:]:
+            return remaining
+        return None if count else []
+
+
+def primitive_stream(wrapper: Type[BaseModel]) -> ListItemStream | None:
+    """
+    Item stream for list types wrapped by the primitive type parsers,
+    other primitive values are only usable once complete.
+    """
+    value_type = wrapper.model_fields["value"].annotation
+    if value_type is list:
+        return ListItemStream(Any)
+    if get_origin(value_type) is list:
+        return ListItemStream(get_args(value_type)[0])
+    return None
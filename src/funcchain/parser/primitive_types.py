@@ -6,8 +6,10 @@ from typing import Generic, TypeVar
 
 from pydantic import BaseModel, create_model
 
+from ..backend.retry import RetryPolicy, default_retry_policy
 from ..schema.types import UniversalChatModel
 from .json_schema import RetryJsonPydanticParser
+from .partial import PartialStream, primitive_stream
 
 M = TypeVar("M", bound=BaseModel)
 
@@ -23,16 +25,24 @@ class RetryJsonPrimitiveTypeParser(RetryJsonPydanticParser, Generic[M]):
         primitive_type: type,
         retry: int = 1,
         retry_llm: UniversalChatModel = None,
+        retry_policy: RetryPolicy | None = None,
     ) -> None:
         super().__init__(
             pydantic_object=create_model("Extract", value=(primitive_type, ...)),
             retry=retry,
             retry_llm=retry_llm,
+            retry_policy=retry_policy or default_retry_policy(),
         )
 
     def parse(self, text: str) -> M:
         return super().parse(text).value
 
+    async def aparse(self, text: str) -> M:
+        return (await super().aparse(text)).value
+
+    def _partial_stream(self) -> PartialStream | None:
+        return primitive_stream(self.pydantic_object)
+
     def get_format_instructions(self) -> str:
         """TODO: override with optimized version"""
         return super().get_format_instructions()
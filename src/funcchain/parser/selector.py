@@ -4,6 +4,7 @@ from typing import Literal, get_origin
 from langchain_core.output_parsers import BaseGenerationOutputParser, BaseOutputParser, StrOutputParser
 from pydantic import BaseModel
 
+from ..backend.retry import RetryPolicy, default_retry_policy
 from ..parser.json_schema import RetryJsonPydanticParser, RetryJsonPydanticUnionParser
 from ..parser.primitive_types import RetryJsonPrimitiveTypeParser
 from ..schema.types import UniversalChatModel
@@ -14,12 +15,21 @@ def parser_for(
     output_types: list[type],
     retry: int,
     llm: UniversalChatModel = None,
+    retry_policy: RetryPolicy | None = None,
 ) -> BaseOutputParser | BaseGenerationOutputParser:
     """
     Get the parser from the type annotation of the parent caller function.
+    Without a retry policy the policy of the global settings is used.
     """
+    retry_policy = retry_policy or default_retry_policy()
+
     if len(output_types) > 1:
-        return RetryJsonPydanticUnionParser(output_types=output_types)
+        return RetryJsonPydanticUnionParser(
+            output_types=output_types,
+            retry=retry,
+            retry_llm=llm,
+            retry_policy=retry_policy,
+        )
 
     output_type = output_types[0]
 
@@ -40,13 +50,23 @@ def parser_for(
         or (t is Literal)
         or (t is Enum)
     ):
-        return RetryJsonPrimitiveTypeParser(primitive_type=output_type, retry=retry, retry_llm=llm)
+        return RetryJsonPrimitiveTypeParser(
+            primitive_type=output_type,
+            retry=retry,
+            retry_llm=llm,
+            retry_policy=retry_policy,
+        )
 
     if issubclass(output_type, ParserBaseModel):
         return output_type.output_parser()  # type: ignore
 
     if issubclass(output_type, BaseModel):
-        return RetryJsonPydanticParser(pydantic_object=output_type, retry=retry, retry_llm=llm)
+        return RetryJsonPydanticParser(
+            pydantic_object=output_type,
+            retry=retry,
+            retry_llm=llm,
+            retry_policy=retry_policy,
+        )
 
     else:
         raise SyntaxError(f"Output Type is not supported: {output_type}")
@@ -1,5 +1,6 @@
-from typing import Any
+from typing import Any, Optional
 
+from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import BaseMessage
 from langchain_core.pydantic_v1 import BaseModel, Field
 
@@ -24,6 +25,9 @@ class Signature(BaseModel):
     history: list[BaseMessage] = Field(default_factory=list)
     """ Additional messages that are inserted before the instruction. """
 
+    memory: Optional[BaseChatMessageHistory] = None
+    """ Chat history inserted before the history messages (referenced, read when formatting the prompt). """
+
     # update_history: bool = Field(default=True)
 
     # todo: should this be defined at compile time? maybe runtime is better
@@ -3,7 +3,7 @@ from typing import Any, AsyncIterator, Callable, Iterator, Optional
 
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages import AIMessage, BaseMessage, BaseMessageChunk, HumanMessage
 from langchain_core.runnables import (
     RouterRunnable,
     Runnable,
@@ -12,6 +12,7 @@ from langchain_core.runnables import (
     RunnablePassthrough,
     RunnableSerializable,
 )
+from langchain_core.runnables.config import merge_configs
 from typing_extensions import TypedDict
 
 from ...utils.msg_tools import msg_to_str
@@ -29,6 +30,8 @@ Routes = dict[str, Route]
 class RouterChat(Runnable[HumanMessage, AIMessage]):
     """
     A router component that can be used to route user requests to different handlers.
+    The route selector and the default handler see the history,
+    other handlers find it in the config (config["configurable"]["history"]).
     """
 
     def __init__(
@@ -47,7 +50,6 @@ class RouterChat(Runnable[HumanMessage, AIMessage]):
 
     @property
     def runnable(self) -> RunnableSerializable[HumanMessage, AIMessage]:
-        # TODO: update history somewhere
         return {
             "input": RunnablePassthrough(),
             "key": {
@@ -80,7 +82,7 @@ class RouterChat(Runnable[HumanMessage, AIMessage]):
             instruction="Given the user request select the appropriate route.",
             input_args=["user_request", "routes"],  # todo: optional images
             output_types=[RouterModel],
-            context=self.history.messages if self.history else [],
+            memory=self.history,
             llm=self.llm,
         )
 
@@ -93,6 +95,7 @@ class RouterChat(Runnable[HumanMessage, AIMessage]):
                         instruction="{user_request}",
                         input_args=["user_request"],
                         output_types=[str],
+                        memory=self.history,
                         llm=self.llm,
                     )
                     | RunnableLambda(lambda x: AIMessage(content=x))
@@ -108,11 +111,29 @@ class RouterChat(Runnable[HumanMessage, AIMessage]):
     def _routes_repr(self) -> str:
         return "\n".join([f"{route_name}: {route['description']}" for route_name, route in self.routes.items()])
 
+    def _add_to_history(self, request: HumanMessage, response: Any) -> None:
+        """
+        Add the request and response to the chat history (e.g. a SlidingWindowChatMessageHistory).
+        """
+        if self.history is not None and response is not None:
+            if not isinstance(response, BaseMessage):
+                response = AIMessage(content=str(response))
+            self.history.add_messages([request, response])
+
+    def _with_history(self, config: RunnableConfig | None) -> RunnableConfig | None:
+        if self.history is None:
+            return config
+        return merge_configs(config, {"configurable": {"history": self.history}})
+
     def invoke(self, input: HumanMessage, config: RunnableConfig | None = None) -> AIMessage:
-        return self.runnable.invoke(input, config=config)
+        response = self.runnable.invoke(input, config=self._with_history(config))
+        self._add_to_history(input, response)
+        return response
 
     async def ainvoke(self, input: HumanMessage, config: RunnableConfig | None = None, **kwargs: Any) -> AIMessage:
-        return await self.runnable.ainvoke(input, config, **kwargs)
+        response = await self.runnable.ainvoke(input, self._with_history(config), **kwargs)
+        self._add_to_history(input, response)
+        return response
 
     def stream(
         self,
@@ -120,7 +141,11 @@ class RouterChat(Runnable[HumanMessage, AIMessage]):
         config: RunnableConfig | None = None,
         **kwargs: Any | None,
     ) -> Iterator[AIMessage]:
-        yield from self.runnable.stream(input, config, **kwargs)
+        response = None
+        for msg in self.runnable.stream(input, self._with_history(config), **kwargs):
+            response = _aggregate(response, msg)
+            yield msg
+        self._add_to_history(input, response)
 
     async def astream(
         self,
@@ -128,5 +153,14 @@ class RouterChat(Runnable[HumanMessage, AIMessage]):
         config: RunnableConfig | None = None,
         **kwargs: Any | None,
     ) -> AsyncIterator[AIMessage]:
-        async for msg in self.runnable.astream(input, config, **kwargs):
+        response = None
+        async for msg in self.runnable.astream(input, self._with_history(config), **kwargs):
+            response = _aggregate(response, msg)
             yield msg
+        self._add_to_history(input, response)
+
+
+def _aggregate(response: Any, msg: Any) -> Any:
+    if isinstance(response, BaseMessageChunk) and isinstance(msg, BaseMessageChunk):
+        return response + msg
+    return msg
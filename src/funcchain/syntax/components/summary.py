@@ -0,0 +1,22 @@
+from ...backend.settings import SettingsOverride, settings
+from ..executable import achain, chain
+
+
+def _summary_settings() -> SettingsOverride:
+    return {"llm": settings.summary_llm} if settings.summary_llm else {}
+
+
+def summarize_conversation(summary: str, conversation: str) -> str:
+    """
+    Update the summary of the earlier conversation with the new messages.
+    Keep names, facts, decisions and open questions. Answer only with the new summary, keep it brief.
+    """
+    return chain(settings_override=_summary_settings())
+
+
+async def asummarize_conversation(summary: str, conversation: str) -> str:
+    """
+    Update the summary of the earlier conversation with the new messages.
+    Keep names, facts, decisions and open questions. Answer only with the new summary, keep it brief.
+    """
+    return await achain(settings_override=_summary_settings())
@@ -1,22 +1,26 @@
-from typing import Any, TypeVar
+from collections.abc import AsyncGenerator, AsyncIterator, Generator, Iterator
+from typing import Any, TypeVar, get_args, get_origin
 
 from langchain_core.callbacks.base import Callbacks
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import BaseMessage, SystemMessage
-from langchain_core.runnables import Runnable
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from pydantic_core import to_json
 
 from ..backend.compiler import compile_chain
 from ..backend.meta_inspect import (
     args_from_parent,
     from_docstring,
+    get_func_obj,
     get_output_types,
     get_parent_frame,
-    kwargs_from_parent,
 )
+from ..backend.prompt import create_instruction_prompt
 from ..backend.settings import SettingsOverride, create_local_settings
+from ..backend.streaming import AsyncStreamHandler, AsyncTokenStream, TokenStream, stream_handler
+from ..backend.tracing import start_trace
 from ..schema.signature import Signature
 from ..schema.types import UniversalChatModel
-from ..utils.memory import ChatMessageHistory
 from .input_types import Image
 
 
@@ -33,47 +37,48 @@ def chain(
     """
     Generate response of llm for provided instructions.
     """
-    if llm:
-        settings_override["llm"] = llm
-    settings = create_local_settings(settings_override)
+    trace = start_trace(get_parent_frame(2).function)
     callbacks: Callbacks = None
-    output_types = get_output_types()
-    input_args: list[tuple[str, type]] = args_from_parent()
+    sig, temp_images = _prepare_signature(system, instruction, context, memory, settings_override, llm, input_kwargs)
+    trace.mark("introspection")
+    chain: Runnable[dict[str, Any], Any] = compile_chain(sig, temp_images)
+    trace.mark("compile")
+    with trace:
+        result = chain.invoke(input_kwargs, {"run_name": get_parent_frame(2).function, "callbacks": callbacks})
 
-    memory = memory or ChatMessageHistory()
-    input_kwargs.update(kwargs_from_parent())
+    _add_turn(sig, input_kwargs, result)
 
-    # todo maybe this should be done in the prompt processor?
-    system = system or settings.system_prompt
-    if system:
-        context = [SystemMessage(content=system)] + context
-    instruction = instruction or from_docstring()
+    return result
 
-    # temp image handling
-    temp_images: list[Image] = []
-    for k, v in input_kwargs.copy().items():
-        if isinstance(v, Image):
-            temp_images.append(v)
-            input_kwargs.pop(k)
 
-    sig: Signature = Signature(
-        instruction=instruction,
-        input_args=input_args,
-        output_types=output_types,
-        history=context,
-        settings=settings,
-    )
+async def achain(
+    *,
+    system: str | None = None,
+    instruction: str | None = None,
+    context: list[BaseMessage] = [],
+    memory: BaseChatMessageHistory | None = None,
+    settings_override: SettingsOverride = {},
+    llm: UniversalChatModel | None = None,
+    **input_kwargs: Any,
+) -> Any:
+    """
+    Asyncronously generate response of llm for provided instructions.
+    """
+    trace = start_trace(get_parent_frame(2).function)
+    callbacks: Callbacks = None
+    sig, temp_images = _prepare_signature(system, instruction, context, memory, settings_override, llm, input_kwargs)
+    trace.mark("introspection")
     chain: Runnable[dict[str, Any], Any] = compile_chain(sig, temp_images)
-    result = chain.invoke(input_kwargs, {"run_name": get_parent_frame(2).function, "callbacks": callbacks})
+    trace.mark("compile")
+    with trace:
+        result = await chain.ainvoke(input_kwargs, {"run_name": get_parent_frame(2).function, "callbacks": callbacks})
 
-    if memory and isinstance(result, str):
-        # TODO: function calls?
-        memory.add_ai_message(result)
+    _add_turn(sig, input_kwargs, result)
 
     return result
 
 
-async def achain(
+def stream_chain(
     *,
     system: str | None = None,
     instruction: str | None = None,
@@ -82,29 +87,116 @@ async def achain(
     settings_override: SettingsOverride = {},
     llm: UniversalChatModel | None = None,
     **input_kwargs: Any,
-) -> Any:
+) -> Iterator[Any]:
     """
-    Asyncronously generate response of llm for provided instructions.
+    Generate response of llm for provided instructions and yield the tokens while generating.
+    For pydantic outputs partially filled models are yielded, the last one is the complete result.
+    """
+    trace = start_trace(get_parent_frame(2).function)
+    callbacks: Callbacks = None
+    sig, temp_images = _prepare_signature(
+        system, instruction, context, memory, settings_override, llm, input_kwargs, stream=True
+    )
+    trace.mark("introspection")
+    stream = TokenStream(sig.settings.stream_buffer)
+    partial_objects = sig.output_types != [str]
+    chain: Runnable[dict[str, Any], Any] = (
+        compile_chain(sig, temp_images) if partial_objects else _compile_streaming(sig, temp_images, stream.handler)
+    )
+    trace.mark("compile")
+    run_name = get_parent_frame(2).function
+
+    def invoke() -> Any:
+        config: RunnableConfig = {"run_name": run_name, "callbacks": callbacks}
+        with trace:
+            if partial_objects:
+                for result in chain.stream(input_kwargs, config):
+                    stream.put(result)
+            else:
+                result = chain.invoke(input_kwargs, config)
+        _add_turn(sig, input_kwargs, result)
+        return result
+
+    return stream.iterate(invoke)
+
+
+def astream_chain(
+    *,
+    system: str | None = None,
+    instruction: str | None = None,
+    context: list[BaseMessage] = [],
+    memory: BaseChatMessageHistory | None = None,
+    settings_override: SettingsOverride = {},
+    llm: UniversalChatModel | None = None,
+    **input_kwargs: Any,
+) -> AsyncIterator[Any]:
+    """
+    Asyncronously generate response of llm for provided instructions and yield the tokens while generating.
+    For pydantic outputs partially filled models are yielded, the last one is the complete result.
+    """
+    trace = start_trace(get_parent_frame(2).function)
+    callbacks: Callbacks = None
+    sig, temp_images = _prepare_signature(
+        system, instruction, context, memory, settings_override, llm, input_kwargs, stream=True
+    )
+    trace.mark("introspection")
+    stream = AsyncTokenStream(sig.settings.stream_buffer)
+    partial_objects = sig.output_types != [str]
+    chain: Runnable[dict[str, Any], Any] = (
+        compile_chain(sig, temp_images) if partial_objects else _compile_streaming(sig, temp_images, stream.handler)
+    )
+    trace.mark("compile")
+    run_name = get_parent_frame(2).function
+
+    async def ainvoke() -> Any:
+        config: RunnableConfig = {"run_name": run_name, "callbacks": callbacks}
+        with trace:
+            if partial_objects:
+                async for result in chain.astream(input_kwargs, config):
+                    await stream.put(result)
+            else:
+                result = await chain.ainvoke(input_kwargs, config)
+        _add_turn(sig, input_kwargs, result)
+        return result
+
+    return stream.iterate(ainvoke)
+
+
+def _prepare_signature(
+    system: str | None,
+    instruction: str | None,
+    context: list[BaseMessage],
+    memory: BaseChatMessageHistory | None,
+    settings_override: SettingsOverride,
+    llm: UniversalChatModel | None,
+    input_kwargs: dict[str, Any],
+    stream: bool = False,
+) -> tuple[Signature, list[Image]]:
+    """
+    Gather the signature of the funcchain calling chain/achain/stream_chain/astream_chain
+    and move its arguments into input_kwargs (images are returned separately).
     """
     if llm:
-        settings_override["llm"] = llm
+        settings_override = {**settings_override, "llm": llm}
     settings = create_local_settings(settings_override)
-    callbacks: Callbacks = None
-    output_types = get_output_types()
-    input_args: list[tuple[str, type]] = args_from_parent()
+    # this helper adds one frame between the funcchain and the introspection
+    func = get_func_obj()
+    output_types = get_output_types(func)
+    if stream:
+        output_types = _stream_item_types(output_types)
+    input_args: list[tuple[str, type]] = args_from_parent(func)
 
-    memory = memory or ChatMessageHistory()
-    input_kwargs.update(kwargs_from_parent())
+    input_kwargs.update(get_parent_frame(3).frame.f_locals)
 
     # todo maybe this should be done in the prompt processor?
     system = system or settings.system_prompt
     if system:
         context = [SystemMessage(content=system)] + context
-    instruction = instruction or from_docstring()
+    instruction = instruction or from_docstring(func)
 
     # temp image handling
     temp_images: list[Image] = []
-    for v, k in input_kwargs.copy().items():
+    for k, v in input_kwargs.copy().items():
         if isinstance(v, Image):
             temp_images.append(v)
             input_kwargs.pop(k)
@@ -114,16 +206,46 @@ async def achain(
         input_args=input_args,
         output_types=output_types,
         history=context,
+        memory=memory,
         settings=settings,
     )
-    chain: Runnable[dict[str, Any], Any] = compile_chain(sig, temp_images)
-    result = await chain.ainvoke(input_kwargs, {"run_name": get_parent_frame(2).function, "callbacks": callbacks})
+    return sig, temp_images
 
-    if memory and isinstance(result, str):
-        # TODO: function calls?
-        memory.add_ai_message(result)
 
-    return result
+def _add_turn(sig: Signature, input_kwargs: dict[str, Any], result: Any) -> None:
+    """
+    Add the instruction (with the inputs) and the answer to the chat history, if the caller passed one.
+    Structured results (pydantic models, lists, numbers, ...) are added as their json.
+    """
+    if sig.memory is not None:
+        sig.memory.add_messages(
+            [
+                create_instruction_prompt(sig.instruction, [], dict(input_kwargs)).format(**input_kwargs),
+                AIMessage(content=result if isinstance(result, str) else to_json(result, fallback=str).decode()),
+            ]
+        )
+
+
+def _stream_item_types(output_types: list[type]) -> list[type]:
+    """
+    Unwrap the item type of Iterator[...] / AsyncIterator[...] return annotations.
+    """
+    if len(output_types) == 1 and get_origin(output_types[0]) in (Iterator, AsyncIterator, Generator, AsyncGenerator):
+        return [get_args(output_types[0])[0]]
+    return output_types
+
+
+def _compile_streaming(
+    sig: Signature, temp_images: list[Image], handler: AsyncStreamHandler
+) -> Runnable[dict[str, Any], Any]:
+    """
+    Compile the chain with the handler bound to the model of this call only.
+    """
+    token = stream_handler.set(handler)
+    try:
+        return compile_chain(sig, temp_images)
+    finally:
+        stream_handler.reset(token)
 
 
 ChainOut = TypeVar("ChainOut")
@@ -137,13 +259,15 @@ def compile_runnable(
     context: list = [],
     llm: UniversalChatModel = None,
     system: str = "",
+    memory: BaseChatMessageHistory | None = None,
     settings_override: SettingsOverride = {},
 ) -> Runnable[dict[str, Any], ChainOut]:
     """
     On the fly compilation of the funcchain syntax.
+    The current messages of the memory are inserted before the instruction on every call.
     """
     if llm:
-        settings_override["llm"] = llm
+        settings_override = {**settings_override, "llm": llm}
     instruction = "\n" + instruction
     settings = create_local_settings(settings_override)
     context = [SystemMessage(content=system)] + context
@@ -154,6 +278,7 @@ def compile_runnable(
         input_args=_input_args,
         output_types=output_types,
         history=context,
+        memory=memory,
         settings=settings,
     )
 
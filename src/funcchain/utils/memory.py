@@ -1,10 +1,111 @@
-from typing import Any
+import asyncio
+import inspect
+import json
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from threading import Lock, RLock, Thread, local
+from typing import Any, Awaitable, Callable, Optional, Sequence, Union
 
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import BaseMessage
-from langchain_core.pydantic_v1 import BaseModel, Field
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, message_to_dict, messages_from_dict
+from langchain_core.pydantic_v1 import BaseModel, Field, PrivateAttr
 
 from ..schema.types import ChatHistoryFactory
+from .token_counter import estimate_tokens
+
+
+class MessageStats:
+    """
+    Metadata of the messages of a chat history (tokens per message, image count),
+    updated incrementally for the messages appended since the last update.
+    """
+
+    def __init__(self) -> None:
+        self.tokens: deque[int] = deque()
+        """ Estimated tokens per message. """
+        self.total_tokens = 0
+        self.images = 0
+        """ Number of messages containing images. """
+        self._messages: Optional[list[BaseMessage]] = None
+        self._last: Optional[BaseMessage] = None
+
+    def add(self, message: BaseMessage) -> int:
+        self.tokens.append(tokens := message_tokens(message))
+        self.total_tokens += tokens
+        self.images += has_images(message)
+        return tokens
+
+    def evict(self, message: BaseMessage) -> None:
+        """
+        Remove the stats of the (first) message.
+        """
+        self.total_tokens -= self.tokens.popleft()
+        self.images -= has_images(message)
+
+    def update(self, messages: list[BaseMessage]) -> "MessageStats":
+        synced = len(self.tokens)
+        if (
+            messages is not self._messages
+            or len(messages) < synced
+            or (synced and messages[synced - 1] is not self._last)
+        ):
+            # replaced or modified before the end, start over
+            self.tokens, self.total_tokens, self.images, synced = deque(), 0, 0, 0
+        for message in messages[synced:]:
+            self.add(message)
+        self._messages, self._last = messages, messages[-1] if messages else None
+        return self
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """
+    Estimated tokens of the message text (and function call), plus the per message overhead.
+    """
+    text = message_text(message)
+    if function_call := message.additional_kwargs.get("function_call"):
+        text += function_call.get("arguments", "")
+    return estimate_tokens(text) + 4
+
+
+def message_text(message: BaseMessage) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in message.content)
+
+
+def message_size(message: BaseMessage) -> int:
+    """
+    Approximate memory size of the message content in bytes, including the (base64 data) urls of images.
+    """
+    parts = [message.content] if isinstance(message.content, str) else message.content
+    size = 0
+    for part in parts:
+        if isinstance(part, str):
+            size += len(part.encode())
+        elif part.get("type") == "image_url":
+            image_url = part.get("image_url", "")
+            size += len(image_url if isinstance(image_url, str) else image_url.get("url", ""))
+        else:
+            size += len(part.get("text", "").encode())
+    if function_call := message.additional_kwargs.get("function_call"):
+        size += len(function_call.get("arguments", "").encode())
+    return size
+
+
+def has_images(message: BaseMessage) -> bool:
+    return isinstance(message.content, list) and any(
+        isinstance(part, dict) and part.get("type") == "image_url" for part in message.content
+    )
+
+
+def history_stats(history: BaseChatMessageHistory) -> MessageStats:
+    """
+    Stats of the chat history, incrementally maintained by the funcchain histories.
+    """
+    if isinstance(stats := getattr(history, "stats", None), MessageStats):
+        return stats
+    return MessageStats().update(history.messages)
 
 
 class ChatMessageHistory(BaseChatMessageHistory, BaseModel):
@@ -18,6 +119,12 @@ class ChatMessageHistory(BaseChatMessageHistory, BaseModel):
 
     messages: list[BaseMessage] = Field(default_factory=list)
 
+    _stats: MessageStats = PrivateAttr(default_factory=MessageStats)
+
+    @property
+    def stats(self) -> MessageStats:
+        return self._stats.update(self.messages)
+
     def add_message(self, message: BaseMessage) -> None:
         """Add a self-created message to the store"""
         self.messages.append(message)
@@ -26,33 +133,521 @@ class ChatMessageHistory(BaseChatMessageHistory, BaseModel):
         self.messages = []
 
 
-_in_memory_database: dict[str, list[BaseMessage]] = {}
+class _Session:
+    __slots__ = ("messages", "size", "last_access")
+
+    def __init__(self, now: float) -> None:
+        self.messages: list[BaseMessage] = []
+        self.size = 0
+        self.last_access = now
+
+
+class SessionStore:
+    """
+    Thread safe store of the sessions of InMemoryChatMessageHistory.
+
+    Optionally bounded by the number of sessions (least recently used are evicted first),
+    an idle ttl in seconds and the size of the message contents of all sessions together
+    (in bytes, including images, see message_size).
+    Evicted sessions are passed to on_evict(session_id, messages), e.g. to spill them to disk.
+    The session in use is never evicted for the size limits.
+    """
+
+    def __init__(
+        self,
+        max_sessions: Optional[int] = None,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        on_evict: Optional[Callable[[str, list[BaseMessage]], None]] = None,
+    ) -> None:
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.total_bytes = 0
+        self._sessions: OrderedDict[str, _Session] = OrderedDict()
+        """ Sessions by least recent access. """
+        self._lock = RLock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def messages(self, session_id: str) -> list[BaseMessage]:
+        """
+        Messages of the session, created if missing.
+        """
+        with self._lock:
+            # expired sessions (including this one) first, then the size limits
+            evicted = self._evict()
+            session = self._touch(session_id)
+            evicted += self._evict(session_id)
+        self._notify(evicted)
+        return session.messages
+
+    def add(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        # sized before taking the lock shared by all sessions
+        size = sum(message_size(message) for message in messages)
+        with self._lock:
+            evicted = self._evict()
+            session = self._touch(session_id)
+            session.messages.extend(messages)
+            session.size += size
+            self.total_bytes += size
+            evicted += self._evict(session_id)
+        self._notify(evicted)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            if session := self._sessions.get(session_id):
+                del session.messages[:]
+                self.total_bytes -= session.size
+                session.size = 0
+
+    def pop(self, session_id: str) -> Optional[list[BaseMessage]]:
+        """
+        Remove the session (without calling on_evict).
+        """
+        with self._lock:
+            if session := self._sessions.pop(session_id, None):
+                self.total_bytes -= session.size
+                return session.messages
+        return None
+
+    def evict_expired(self) -> int:
+        """
+        Evict the sessions idle for longer than the ttl, e.g. from a periodic job.
+        Otherwise they are evicted on the next access of the store.
+        """
+        with self._lock:
+            evicted = self._evict()
+        self._notify(evicted)
+        return len(evicted)
+
+    def _touch(self, session_id: str) -> _Session:
+        now = time.monotonic()
+        if (session := self._sessions.get(session_id)) is None:
+            session = self._sessions[session_id] = _Session(now)
+        session.last_access = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _expired(self, session: _Session, now: float) -> bool:
+        return self.ttl is not None and now - session.last_access > self.ttl
+
+    def _evict(self, keep: Optional[str] = None) -> list[tuple[str, list[BaseMessage]]]:
+        evicted = []
+        now = time.monotonic()
+        # least recently used first, so the expired sessions are at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session_id == keep or not (
+                self._expired(session, now)
+                or (self.max_sessions is not None and len(self._sessions) > self.max_sessions)
+                or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+            ):
+                break
+            del self._sessions[session_id]
+            self.total_bytes -= session.size
+            evicted.append((session_id, session.messages))
+        return evicted
+
+    def _notify(self, evicted: list[tuple[str, list[BaseMessage]]]) -> None:
+        # outside of the lock, spilling to disk should not block the other sessions
+        if self.on_evict:
+            for session_id, messages in evicted:
+                self.on_evict(session_id, messages)
+
+
+_in_memory_database = SessionStore()
+""" Default store, unbounded unless configured (e.g. _in_memory_database.max_sessions = 10_000). """
 
 
 class InMemoryChatMessageHistory(BaseChatMessageHistory):
     """In memory implementation of chat message history.
 
-    Stores messages in an in memory list.
+    Stores messages in an in memory list of the session store (default: the unbounded module store).
     """
 
-    def __init__(self, session_id: str) -> None:
+    def __init__(self, session_id: str, store: Optional[SessionStore] = None) -> None:
         self.session_id = session_id
-        if session_id not in _in_memory_database:
-            _in_memory_database[session_id] = []
+        self.store = store if store is not None else _in_memory_database
+        self.store.messages(session_id)
+        self._stats = MessageStats()
+
+    @property
+    def stats(self) -> MessageStats:
+        return self._stats.update(self.messages)
 
     @property
     def messages(self) -> list[BaseMessage]:  # type: ignore
-        return _in_memory_database[self.session_id]
+        return self.store.messages(self.session_id)
 
     def add_message(self, message: BaseMessage) -> None:
-        _in_memory_database[self.session_id].append(message)
+        self.store.add(self.session_id, [message])
 
     def add_messages(self, messages: list[BaseMessage]) -> None:  # type: ignore
-        _in_memory_database[self.session_id].extend(messages)
+        self.store.add(self.session_id, messages)
 
     def clear(self) -> None:
         print(f"Clearing {self.session_id}")
-        del _in_memory_database[self.session_id][:]
+        self.store.clear(self.session_id)
+
+
+class _SQLiteDatabase:
+    """
+    Connections to a chat history database, shared by all sessions (and threads) of the process:
+    one write connection behind a lock and a read connection per thread,
+    so reads (in WAL mode) don't wait for the writes of other threads.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = Lock()
+        self._readers = local()
+        with self.lock, self.connection:
+            # with WAL commits are appended to the log and only fsynced at checkpoints
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS chat_messages "
+                "(id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, message TEXT NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS chat_messages_session_id ON chat_messages (session_id, id)"
+            )
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        rows = [(session_id, json.dumps(message_to_dict(message))) for message in messages]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT INTO chat_messages (session_id, message) VALUES (?, ?)", rows)
+
+    def select(self, session_id: str, limit: Optional[int], offset: int) -> list[BaseMessage]:
+        query = "SELECT message FROM chat_messages WHERE session_id = ? ORDER BY id DESC LIMIT ? OFFSET ?"
+        params = (session_id, -1 if limit is None else limit, offset)
+        if self.path == ":memory:":
+            # an in memory database only exists for its connection
+            with self.lock:
+                rows = self.connection.execute(query, params).fetchall()
+        else:
+            rows = self._reader().execute(query, params).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in reversed(rows)])
+
+    def _reader(self) -> sqlite3.Connection:
+        if (reader := getattr(self._readers, "connection", None)) is None:
+            reader = self._readers.connection = sqlite3.connect(self.path, timeout=30)
+        return reader
+
+    def delete(self, session_id: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+
+
+_sqlite_databases: dict[str, _SQLiteDatabase] = {}
+_sqlite_databases_lock = Lock()
+
+
+def _sqlite_database(path: str) -> _SQLiteDatabase:
+    with _sqlite_databases_lock:
+        if path not in _sqlite_databases:
+            _sqlite_databases[path] = _SQLiteDatabase(path)
+        return _sqlite_databases[path]
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat history persisted in a SQLite database, many sessions share one file.
+
+    The messages of each add_messages call (e.g. a turn) are written in one transaction,
+    in WAL mode without a fsync per commit. Only the last `window` messages are loaded
+    (default: the whole session), older ones can be paged with load().
+    """
+
+    def __init__(self, session_id: str, path: str = "funcchain_history.db", window: Optional[int] = None) -> None:
+        self.session_id = session_id
+        self.window = window
+        self._db = _sqlite_database(path)
+        self._messages: Optional[list[BaseMessage]] = None
+        """ Loaded window, kept in sync with the appended messages. """
+        self._stats = MessageStats()
+
+    @property
+    def stats(self) -> MessageStats:
+        return self._stats.update(self.messages)
+
+    @property
+    def messages(self) -> list[BaseMessage]:  # type: ignore
+        if self._messages is None:
+            self._messages = self.load(self.window)
+        return self._messages
+
+    def load(self, limit: Optional[int] = None, offset: int = 0) -> list[BaseMessage]:
+        """
+        Load the last `limit` messages of the session before the last `offset` ones.
+        """
+        return self._db.select(self.session_id, limit, offset)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self._db.append(self.session_id, messages)
+        if self._messages is not None:
+            self._messages.extend(messages)
+            if self.window is not None and len(self._messages) > self.window:
+                del self._messages[: len(self._messages) - self.window]
+
+    def clear(self) -> None:
+        self._db.delete(self.session_id)
+        self._messages = []
+
+
+class SlidingWindowChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat history keeping the system message and the most recent turns within a token budget.
+
+    A turn starts with a human message. When the history exceeds max_tokens
+    the oldest turns are evicted (passed to on_evict), but the last keep_turns turns are always kept.
+    Token counts are estimated once when a message is added.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 4096,
+        keep_turns: int = 1,
+        messages: Sequence[BaseMessage] = (),
+        on_evict: Optional[Callable[[list[BaseMessage]], None]] = None,
+        session_id: Optional[str] = None,
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+        self.on_evict = on_evict
+        self.session_id = session_id
+        self.system_message: Optional[SystemMessage] = None
+        self._system_tokens = 0
+        self._window: deque[BaseMessage] = deque()
+        self._turns: deque[int] = deque()
+        """ Number of messages per turn. """
+        self.stats = MessageStats()
+        """ Stats of the messages in the window (without the system message). """
+        self.add_messages(messages)
+
+    @property
+    def messages(self) -> list[BaseMessage]:  # type: ignore
+        return [self.system_message, *self._window] if self.system_message else list(self._window)
+
+    @messages.setter
+    def messages(self, messages: list[BaseMessage]) -> None:
+        self.clear()
+        self.add_messages(messages)
+
+    @property
+    def total_tokens(self) -> int:
+        return self._system_tokens + self.stats.total_tokens
+
+    def add_message(self, message: BaseMessage) -> None:
+        self._add(message)
+        self._evict()
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        for message in messages:
+            self._add(message)
+        self._evict()
+
+    def _add(self, message: BaseMessage) -> None:
+        if isinstance(message, SystemMessage):
+            self.system_message, self._system_tokens = message, message_tokens(message)
+            return
+        self._window.append(message)
+        self.stats.add(message)
+        if isinstance(message, HumanMessage) or not self._turns:
+            self._turns.append(1)
+        else:
+            self._turns[-1] += 1
+
+    def _evict(self) -> None:
+        evicted: list[BaseMessage] = []
+        while len(self._turns) > self.keep_turns and self.total_tokens > self.max_tokens:
+            for _ in range(self._turns.popleft()):
+                message = self._window.popleft()
+                self.stats.evict(message)
+                evicted.append(message)
+        if evicted and self.on_evict:
+            self.on_evict(evicted)
+
+    def clear(self) -> None:
+        self.system_message, self._system_tokens = None, 0
+        self._window.clear()
+        self._turns.clear()
+        self.stats = MessageStats()
+
+
+Summarizer = Callable[[str, str], Union[str, Awaitable[str]]]
+
+
+class SummarizingChatMessageHistory(SlidingWindowChatMessageHistory):
+    """
+    Sliding window chat history folding the evicted turns into a running summary
+    (a system message after the system message).
+
+    The summary is updated in the background after the turn was added,
+    as task of the running event loop or in a thread, and swapped in at once when done.
+    Until then the calls use the previous summary, so summarizing never delays a response.
+    The summarizer gets the previous summary and the evicted conversation
+    (default: the summarize_conversation funcchain using settings.summary_llm).
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 4096,
+        keep_turns: int = 1,
+        messages: Sequence[BaseMessage] = (),
+        summarizer: Optional[Summarizer] = None,
+        session_id: Optional[str] = None,
+    ) -> None:
+        self.summarizer = summarizer
+        self._summary: Optional[tuple[str, SystemMessage, int]] = None
+        """ Summary, summary message and its tokens, replaced at once. """
+        self._pending: list[BaseMessage] = []
+        self._batch: list[BaseMessage] = []
+        """ Batch the worker is summarizing. """
+        self._lock = Lock()
+        self._worker: Optional[Union[asyncio.Task, Thread]] = None
+        super().__init__(max_tokens, keep_turns, messages, on_evict=self._schedule, session_id=session_id)
+
+    @property
+    def summary(self) -> Optional[str]:
+        return self._summary[0] if self._summary else None
+
+    @property
+    def messages(self) -> list[BaseMessage]:  # type: ignore
+        summary = [self._summary[1]] if self._summary else []
+        system = [self.system_message] if self.system_message else []
+        return [*system, *summary, *self._window]
+
+    @messages.setter
+    def messages(self, messages: list[BaseMessage]) -> None:
+        # the summary (message) is kept and does not replace the system message
+        summary = self._summary[1] if self._summary else None
+        super().clear()
+        self.add_messages([message for message in messages if message != summary])
+
+    @property
+    def total_tokens(self) -> int:
+        return super().total_tokens + (self._summary[2] if self._summary else 0)
+
+    def _schedule(self, evicted: list[BaseMessage]) -> None:
+        with self._lock:
+            self._pending.extend(evicted)
+            if self._worker is not None:
+                if not _finished(self._worker):
+                    # the running worker picks them up
+                    return
+                self._reap(self._worker)
+            try:
+                task = asyncio.get_running_loop().create_task(self._asummarize())
+            except RuntimeError:
+                self._worker = Thread(target=self._summarize, daemon=True)
+                self._worker.start()
+            else:
+                self._worker = task
+                task.add_done_callback(self._worker_done)
+
+    def _worker_done(self, task: asyncio.Task) -> None:
+        with self._lock:
+            if self._worker is task:
+                self._reap(task)
+
+    def _reap(self, worker: Union[asyncio.Task, Thread]) -> None:
+        # a task cancelled or stuck on a closed event loop drops its batch, summarized by the next worker
+        if isinstance(worker, asyncio.Task) and (not worker.done() or worker.cancelled()):
+            self._pending[:0] = self._batch
+        self._batch, self._worker = [], None
+
+    def _next_batch(self) -> list[BaseMessage]:
+        with self._lock:
+            batch = self._batch = self._pending
+            self._pending = []
+            if not batch:
+                self._worker = None
+            return batch
+
+    def _swap(self, summary: str) -> None:
+        message = SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")
+        self._summary = (summary, message, message_tokens(message))
+
+    def _failed(self, batch: list[BaseMessage], error: Exception) -> None:
+        print(f"Warning: Summarizing the chat history failed: {error!r}")
+        with self._lock:
+            # retried with the next evicted turns
+            self._pending[:0] = batch
+            self._batch, self._worker = [], None
+
+    def _summarize(self) -> None:
+        while batch := self._next_batch():
+            try:
+                summary = self._call_summarizer(batch)
+                if inspect.isawaitable(summary):
+                    summary = asyncio.run(summary)  # type: ignore
+            except Exception as e:
+                return self._failed(batch, e)
+            self._swap(summary)  # type: ignore
+
+    async def _asummarize(self) -> None:
+        while batch := self._next_batch():
+            try:
+                if self.summarizer is None or inspect.iscoroutinefunction(self.summarizer):
+                    summary = self._call_summarizer(batch, asynchronous=True)
+                else:
+                    # sync summarizers don't block the event loop
+                    summary = await asyncio.to_thread(self._call_summarizer, batch)
+                if inspect.isawaitable(summary):
+                    summary = await summary
+            except Exception as e:
+                return self._failed(batch, e)
+            self._swap(summary)  # type: ignore
+
+    def _call_summarizer(self, batch: list[BaseMessage], asynchronous: bool = False) -> Union[str, Awaitable[str]]:
+        conversation = "\n".join(f"{message.type}: {message_text(message)}" for message in batch)
+        summarizer = self.summarizer
+        if summarizer is None:
+            from ..syntax.components.summary import asummarize_conversation, summarize_conversation
+
+            summarizer = asummarize_conversation if asynchronous else summarize_conversation
+        return summarizer(self.summary or "", conversation)
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait until the background summarization (in a thread) is done.
+        """
+        if isinstance(worker := self._worker, Thread):
+            worker.join(timeout)
+
+    async def await_summary(self) -> None:
+        """
+        Wait until the background summarization is done.
+        """
+        if isinstance(worker := self._worker, asyncio.Task) and not _finished(worker):
+            await asyncio.shield(worker)
+        elif isinstance(worker, Thread):
+            await asyncio.to_thread(worker.join)
+
+    def clear(self) -> None:
+        super().clear()
+        with self._lock:
+            self._summary, self._pending, self._batch = None, [], []
+
+
+def _finished(worker: Union[asyncio.Task, Thread]) -> bool:
+    """
+    The worker is done (or can never continue, as its event loop is closed).
+    """
+    if isinstance(worker, Thread):
+        return not worker.is_alive()
+    return worker.done() or worker.get_loop().is_closed()
 
 
 def create_history_factory(
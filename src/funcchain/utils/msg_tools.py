@@ -1,7 +1,9 @@
-from typing import Union
+from collections import defaultdict
+from typing import Any, Optional, Sequence, Union
 
+from langchain_core.messages import AIMessageChunk, BaseMessageChunk
 from langchain_core.messages import BaseMessage as _BaseMessage
-from langchain_core.messages import BaseMessageChunk
+from langchain_core.utils._merge import merge_dicts, merge_lists
 
 BaseMessage = Union[_BaseMessage, BaseMessageChunk]
 
@@ -22,3 +24,94 @@ def msg_to_str(msg: BaseMessage) -> str:
         if isinstance(msg.content[0], str)
         else msg.content[0]["text"]
     )
+
+
+def msg_arguments_delta(msg: BaseMessage) -> str:
+    """Return the function (or tool) call arguments streamed with the message chunk."""
+    if function_call := msg.additional_kwargs.get("function_call"):
+        return function_call.get("arguments") or ""
+    if tool_call_chunks := getattr(msg, "tool_call_chunks", None):
+        return "".join(tool_call.get("args") or "" for tool_call in tool_call_chunks)
+    return ""
+
+
+def join_message_chunks(chunks: Sequence[BaseMessageChunk]) -> BaseMessageChunk:
+    """
+    Aggregate streamed message chunks in linear time.
+    Adding up the chunks one by one copies the growing content and arguments on every step,
+    so the text, function and tool call arguments are collected, joined once and the message is built once.
+    """
+    if not chunks:
+        raise ValueError("No message chunks to join.")
+    if not all(isinstance(chunk.content, str) for chunk in chunks):
+        # multimodal content lists
+        message = chunks[0]
+        for chunk in chunks[1:]:
+            message += chunk
+        return message
+    text: list[str] = []
+    arguments: list[str] = []
+    # arguments of the streamed tool calls by index
+    tool_call_arguments: defaultdict[int, list[str]] = defaultdict(list)
+    tool_call_chunk_args: defaultdict[int, list[str]] = defaultdict(list)
+    additional_kwargs: dict[str, Any] = {}
+    response_metadata: dict[str, Any] = {}
+    tool_call_chunks: Optional[list] = []
+    for chunk in chunks:
+        text.append(chunk.content)  # type: ignore
+        kwargs = chunk.additional_kwargs
+        if function_call := kwargs.get("function_call"):
+            arguments.append(function_call.get("arguments") or "")
+            kwargs = {**kwargs, "function_call": {**function_call, "arguments": ""}}
+        if tool_calls := kwargs.get("tool_calls"):
+            kwargs = {**kwargs, "tool_calls": [_without_arguments(tc, tool_call_arguments) for tc in tool_calls]}
+        additional_kwargs = merge_dicts(additional_kwargs, kwargs)
+        response_metadata = merge_dicts(response_metadata, chunk.response_metadata)
+        if chunk_tool_calls := getattr(chunk, "tool_call_chunks", None):
+            tool_call_chunks = merge_lists(
+                tool_call_chunks, [_without_args(tc, tool_call_chunk_args) for tc in chunk_tool_calls]
+            )
+    if "function_call" in additional_kwargs:
+        additional_kwargs["function_call"]["arguments"] = "".join(arguments)
+    for tool_call in additional_kwargs.get("tool_calls") or []:
+        if (index := tool_call.get("index")) in tool_call_arguments:
+            tool_call["function"]["arguments"] = "".join(tool_call_arguments[index])
+    for tool_call in tool_call_chunks or []:
+        if (index := tool_call.get("index")) in tool_call_chunk_args:
+            tool_call["args"] = "".join(tool_call_chunk_args[index])
+
+    first = chunks[0]
+    fields = {
+        **first.dict(),
+        "content": "".join(text),
+        "additional_kwargs": additional_kwargs,
+        "response_metadata": response_metadata,
+    }
+    if isinstance(first, AIMessageChunk):
+        # the tool calls are parsed again from the joined tool call chunks
+        fields.pop("tool_calls", None)
+        fields.pop("invalid_tool_calls", None)
+        usages = [usage for chunk in chunks if (usage := getattr(chunk, "usage_metadata", None))]
+        fields["tool_call_chunks"] = tool_call_chunks
+        fields["usage_metadata"] = (
+            {key: sum(usage[key] for usage in usages) for key in ("input_tokens", "output_tokens", "total_tokens")}
+            if usages
+            else None
+        )
+    return first.__class__(**fields)
+
+
+def _without_arguments(tool_call: dict, arguments: defaultdict[int, list[str]]) -> dict:
+    """Copy of the streamed (openai) tool call without the function arguments, collected by index."""
+    if not isinstance(index := tool_call.get("index"), int) or not (function := tool_call.get("function")):
+        return tool_call
+    arguments[index].append(function.get("arguments") or "")
+    return {**tool_call, "function": {**function, "arguments": ""}}
+
+
+def _without_args(tool_call_chunk: dict, args: defaultdict[int, list[str]]) -> dict:
+    """Copy of the tool call chunk without the arguments, collected by index."""
+    if not isinstance(index := tool_call_chunk.get("index"), int):
+        return tool_call_chunk
+    args[index].append(tool_call_chunk.get("args") or "")
+    return {**tool_call_chunk, "args": ""}
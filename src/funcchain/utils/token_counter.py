@@ -1,3 +1,7 @@
+from functools import lru_cache
+from typing import Any
+
+
 def count_tokens(text: str, model: str = "gpt-4") -> int:
     if "gpt-4" in model:
         from tiktoken import encoding_for_model
@@ -5,3 +9,24 @@ def count_tokens(text: str, model: str = "gpt-4") -> int:
         return len(encoding_for_model(model).encode(text))
     else:
         raise NotImplementedError("Please sumbmit a PR or write an issue with your desired model.")
+
+
+@lru_cache(maxsize=1)
+def _default_encoding() -> Any:
+    try:
+        from tiktoken import get_encoding
+
+        return get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken not installed or encoding not downloadable (offline)
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Fast token estimate usable for every provider.
+    Falls back to ~4 characters per token if no tokenizer is available.
+    """
+    if encoding := _default_encoding():
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
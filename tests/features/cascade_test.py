@@ -0,0 +1,105 @@
+import asyncio
+from typing import Callable
+
+import pytest
+from funcchain import chain
+from funcchain.backend.cascade import CascadeChain, cascade_stats
+from funcchain.backend.settings import create_local_settings
+from funcchain.model.fake import FakeChatModel
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel
+
+
+def fails(_: dict) -> int:
+    raise OutputParserException("Invalid json output")
+
+
+def test_escalate_on_parse_failure() -> None:
+    cascade = CascadeChain(
+        [
+            ("ollama/llama3", RunnableLambda(fails)),
+            ("openai/gpt-4o", RunnableLambda(lambda _: 42)),
+        ]
+    )
+
+    assert cascade.invoke({}) == 42
+    assert asyncio.run(cascade.ainvoke({})) == 42
+
+    stats = cascade_stats()["ollama/llama3 > openai/gpt-4o"]
+    assert stats["ollama/llama3"]["parse_failures"] == 2
+    assert stats["openai/gpt-4o"]["success_rate"] == 1.0
+
+
+def test_escalate_on_confidence_check() -> None:
+    calls: list[str] = []
+
+    def tier(name: str, result: int) -> RunnableLambda:
+        return RunnableLambda(lambda _: calls.append(name) or result)
+
+    cascade = CascadeChain(
+        [("small", tier("small", 1)), ("medium", tier("medium", 5)), ("large", tier("large", 10))],
+        check=lambda x: x >= 5,
+    )
+
+    assert cascade.invoke({}) == 5
+    assert calls == ["small", "medium"]
+    assert cascade_stats()["small > medium > large"]["small"]["check_failures"] == 1
+
+
+def test_last_tier_raises() -> None:
+    cascade = CascadeChain([("a", RunnableLambda(fails)), ("b", RunnableLambda(fails))])
+
+    with pytest.raises(OutputParserException):
+        cascade.invoke({})
+
+
+def test_cascade_setting() -> None:
+    settings = create_local_settings({"cascade": ["ollama/llama3", "openai/gpt-4o"]})
+    assert settings.cascade == ["ollama/llama3", "openai/gpt-4o"]
+
+
+def test_lazy_tiers() -> None:
+    compiled: list[str] = []
+
+    def compile(name: str, result: int) -> Callable[[], RunnableLambda]:
+        return lambda: compiled.append(name) or RunnableLambda(lambda _: result)
+
+    cascade = CascadeChain([("small", compile("small", 1)), ("large", compile("large", 10))], check=lambda x: x > 1)
+    assert compiled == []
+    assert cascade.invoke({}) == 10 and cascade.invoke({}) == 10
+    assert compiled == ["small", "large"]
+
+
+class Ticket(BaseModel):
+    title: str
+    priority: int
+
+
+def triage(issue: str) -> Ticket:
+    """
+    Create a ticket for the issue.
+    """
+    return chain(
+        settings_override={
+            "cascade": [FakeChatModel(malformed_rate=1.0, model_name="fake-small"), "fake/gpt-4o"],
+            "retry_parse": 0,
+        }
+    )
+
+
+def test_chain_escalates_on_validation_failure() -> None:
+    assert isinstance(triage("the login page is down"), Ticket)
+
+    stats = cascade_stats()["fake/fake-small > fake/gpt-4o"]
+    assert stats["fake/fake-small"]["parse_failures"] == 1
+    assert stats["fake/gpt-4o"]["successes"] == 1
+
+
+if __name__ == "__main__":
+    test_escalate_on_parse_failure()
+    test_escalate_on_confidence_check()
+    test_last_tier_raises()
+    test_cascade_setting()
+    test_lazy_tiers()
+    test_chain_escalates_on_validation_failure()
@@ -0,0 +1,83 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import pytest
+from funcchain import achain, chain
+from funcchain.backend.cassette import record_cassette, replay_cassette
+from funcchain.backend.streaming import stream_to
+from pydantic import BaseModel
+
+
+class Recipe(BaseModel):
+    name: str
+    ingredients: list[str]
+    minutes: int
+
+
+def recipe(dish: str) -> Recipe:
+    """
+    Create a recipe for the dish.
+    """
+    return chain(settings_override={"llm": "fake/gpt-4o", "fake_model_kwargs": {"function_calling": True}})
+
+
+async def arecipe(dish: str) -> Recipe:
+    """
+    Create a recipe for the dish.
+    """
+    return await achain(
+        settings_override={"llm": "fake/gpt-4o", "fake_model_kwargs": {"ttft": 0.05, "chunk_rate": 200}}
+    )
+
+
+def describe(dish: str) -> str:
+    """
+    Describe the dish in one sentence.
+    """
+    return chain(settings_override={"llm": "fake/gpt-4o"})
+
+
+def test_record_replay() -> None:
+    path = os.path.join(tempfile.mkdtemp(), "cassette.json.gz")
+    with record_cassette(path) as cassette:
+        recorded = [recipe("pizza"), recipe("pasta"), describe("pizza")]
+        tokens: list[str] = []
+        with stream_to(tokens.append):
+            recorded.append(describe("pasta"))
+
+    assert len(cassette.interactions) == 4
+    assert cassette.models["fake/gpt-4o"]["kind"] in ("function_model", "chat_model")
+    assert cassette.interactions[0]["params"]["functions"][0]["name"] == "recipe"
+    assert "chunks" in cassette.interactions[3]
+
+    with replay_cassette(path, latency="zero"):
+        replayed = [recipe("pizza"), recipe("pasta"), describe("pizza")]
+        replayed_tokens: list[str] = []
+        with stream_to(replayed_tokens.append):
+            replayed.append(describe("pasta"))
+    assert replayed == recorded
+    assert "".join(replayed_tokens) == "".join(tokens)
+
+    with replay_cassette(path, latency="zero"), pytest.raises(LookupError):
+        describe("sushi")
+
+
+def test_replay_latency() -> None:
+    with record_cassette() as cassette:
+        recorded = asyncio.run(arecipe("curry"))
+    latency = cassette.interactions[0]["latency"]
+    assert latency >= 0.05
+
+    for mode in ("original", "zero"):
+        with replay_cassette(cassette, latency=mode):  # type: ignore
+            start = time.perf_counter()
+            assert asyncio.run(arecipe("curry")) == recorded
+            elapsed = time.perf_counter() - start
+        assert (elapsed >= latency * 0.9) if mode == "original" else (elapsed < latency)
+
+
+if __name__ == "__main__":
+    test_record_replay()
+    test_replay_latency()
@@ -0,0 +1,70 @@
+from funcchain.backend.prompt import create_chat_prompt, create_instruction_prompt
+from funcchain.utils.memory import ChatMessageHistory, InMemoryChatMessageHistory, history_stats
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+image = {"type": "image_url", "image_url": {"url": "data:image/png;base64,abc"}}
+
+
+def test_incremental_stats() -> None:
+    history = ChatMessageHistory()
+    history.add_user_message("hello there")
+    history.add_ai_message("hi, how can I help?")
+    stats = history.stats
+    assert len(stats.tokens) == 2 and stats.images == 0
+    assert stats.total_tokens == sum(stats.tokens)
+
+    history.add_message(HumanMessage(content=[{"type": "text", "text": "what is this?"}, image]))
+    assert history.stats is stats and len(stats.tokens) == 3 and stats.images == 1
+
+    # replaced or cleared messages are counted again
+    history.messages = history.messages[:1]
+    assert len(history.stats.tokens) == 1 and history.stats.images == 0
+    history.clear()
+    assert history.stats.total_tokens == 0
+
+    session = InMemoryChatMessageHistory("stats-test")
+    session.add_messages([HumanMessage(content="a"), AIMessage(content="b")])
+    assert len(history_stats(session).tokens) == 2
+    session.clear()
+    assert not history_stats(session).tokens
+
+
+def test_prompt_references_history() -> None:
+    history = ChatMessageHistory(messages=[SystemMessage(content="old system"), HumanMessage(content="hi")])
+    history.add_ai_message("hello")
+    instruction = create_instruction_prompt("Answer {question}", [], {"question": ""})
+    prompt = create_chat_prompt("Be nice.", instruction, [AIMessage(content="context")], history)
+
+    messages = prompt.invoke({"question": "why?"}).to_messages()
+    assert [m.type for m in messages] == ["system", "human", "ai", "ai", "human"]
+    assert messages[0].content == "Be nice."
+
+    # messages added later are part of the next prompt without building it again
+    history.add_user_message("and?")
+    history.add_ai_message("sure")
+    assert len(prompt.invoke({"question": "why?"}).to_messages()) == 7
+    # the history itself is not serialized with the prompt
+    assert "hello" not in str(prompt.to_json())
+
+
+def test_prompt_strips_images() -> None:
+    question = HumanMessage(content=[{"type": "text", "text": "what is this?"}, image])
+    history = ChatMessageHistory(messages=[question, AIMessage(content="a cat")])
+    instruction = create_instruction_prompt("Answer {question}", [], {"question": ""})
+    prompt = create_chat_prompt("", instruction, [], history, strip_images=True)
+
+    messages = prompt.invoke({"question": "why?"}).to_messages()
+    assert messages[0].content == [{"type": "text", "text": "what is this?"}]
+    # only the prompt is stripped, the history keeps the image
+    assert history.messages[0] == question and history.stats.images == 1
+
+    # without images the messages are inserted as they are
+    history.messages = [HumanMessage(content=[{"type": "text", "text": "hi"}]), AIMessage(content="hello")]
+    messages = prompt.invoke({"question": "why?"}).to_messages()
+    assert messages[0] is history.messages[0] and history.stats.images == 0
+
+
+if __name__ == "__main__":
+    test_incremental_stats()
+    test_prompt_references_history()
+    test_prompt_strips_images()
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from funcchain.backend.concurrency import (
+    AdaptiveConcurrencyLimiter,
+    ConcurrencyLimitedModel,
+    get_concurrency_limiter,
+    is_overload_error,
+)
+from funcchain.backend.metrics import metrics
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def test_overload_errors() -> None:
+    assert is_overload_error(RateLimitError())
+    assert not is_overload_error(ValueError("invalid json"))
+
+
+def test_limit_is_enforced() -> None:
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2)
+    running, peak, queue_depths = 0, 0, []
+
+    async def call() -> None:
+        nonlocal running, peak
+        async with limiter.slot():
+            running += 1
+            peak = max(peak, running)
+            queue_depths.append(limiter.queue_depth)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    async def main() -> None:
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert max(queue_depths) > 0
+    assert limiter.metrics()["in_flight"] == 0
+
+
+def test_additive_increase_multiplicative_decrease() -> None:
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+
+    async def succeed() -> None:
+        async with limiter.slot():
+            await asyncio.sleep(0.001)
+
+    async def overload() -> None:
+        async with limiter.slot():
+            raise RateLimitError()
+
+    async def main() -> None:
+        for _ in range(8):
+            await succeed()
+
+    asyncio.run(main())
+    assert limiter.metrics()["limit"] == 5
+
+    with pytest.raises(RateLimitError):
+        asyncio.run(overload())
+    assert 2 <= limiter.limit < 3
+
+
+def test_wrapped_model() -> None:
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1)
+    model = ConcurrencyLimitedModel(FakeListChatModel(responses=["Hello"]), limiter)
+
+    async def main() -> tuple[str, str]:
+        message = await model.ainvoke("Hi")
+        chunks = [chunk.content async for chunk in model.astream("Hi")]
+        return str(message.content), "".join(map(str, chunks))
+
+    assert asyncio.run(main()) == ("Hello", "Hello")
+    assert limiter.in_flight == 0
+
+
+def test_registry_reconfigure_and_metrics() -> None:
+    limiter = get_concurrency_limiter("test/model", initial_limit=4, max_limit=16)
+    limiter.limit = 10.0
+    # unchanged settings keep the learned limit, a lower max_limit caps it
+    assert get_concurrency_limiter("test/model", initial_limit=4, max_limit=16).limit == 10.0
+    assert get_concurrency_limiter("test/model", initial_limit=4, max_limit=6) is limiter and limiter.limit == 6.0
+    get_concurrency_limiter("test/model", initial_limit=2, max_limit=6)
+    assert limiter.limit == 2.0
+
+    snapshot = metrics.snapshot()
+    assert snapshot["funcchain_concurrency_limit"]["test/model"] == 2
+    assert snapshot["funcchain_concurrency_queue_depth"]["test/model"] == 0
+    assert 'funcchain_concurrency_limit{model="test/model"} 2' in metrics.to_prometheus()
+
+
+if __name__ == "__main__":
+    test_overload_errors()
+    test_limit_is_enforced()
+    test_additive_increase_multiplicative_decrease()
+    test_wrapped_model()
+    test_registry_reconfigure_and_metrics()
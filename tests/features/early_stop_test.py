@@ -0,0 +1,180 @@
+import asyncio
+import json
+from typing import Any, Iterator, Optional
+
+from funcchain import achain, chain, stream_chain
+from funcchain.backend.early_stop import FenceCompletion, JsonCompletion, stop_sequences_for
+from funcchain.backend.streaming import stream_to
+from funcchain.backend.tracing import trace_to
+from funcchain.parser.json_schema import RetryJsonPydanticParser
+from funcchain.syntax.output_types import CodeBlock
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.outputs import ChatGenerationChunk
+from pydantic import BaseModel
+
+
+class Task(BaseModel):
+    title: str
+    done: bool
+
+
+COMMENTARY = "\n\nThis is the task you asked for, let me know if you need anything else!" * 5
+
+
+class CountingModel(FakeListChatModel):
+    """
+    Fake streaming model counting the generated chunks.
+    """
+
+    generated: int = 0
+
+    def _stream(self, *args: Any, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        for chunk in super()._stream(*args, **kwargs):
+            self.generated += 1
+            yield chunk
+
+
+class LlamaLikeModel(CountingModel):
+    """
+    Fake streaming model passing the kwargs to its client next to stream=True, like ChatLlamaCpp.
+    """
+
+    def _stream(self, *args: Any, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        return self._client(*args, stream=True, **kwargs)
+
+    def _client(self, *args: Any, stream: bool, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        return super()._stream(*args, **kwargs)
+
+
+class StopModel(FakeListChatModel):
+    """
+    Fake model cutting the response at the stop sequences like a provider.
+    """
+
+    stops: list[Optional[list[str]]] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _call(self, messages: Any, stop: Optional[list[str]] = None, *args: Any, **kwargs: Any) -> str:
+        self.stops.append(stop)
+        response = super()._call(messages, stop, *args, **kwargs)
+        for stop_sequence in stop or []:
+            response = response.split(stop_sequence)[0]
+        return response
+
+
+def create_task(text: str, llm: FakeListChatModel) -> Task:
+    """
+    Create a task from the text.
+    """
+    return chain(llm=llm)
+
+
+async def acreate_task(text: str, llm: FakeListChatModel) -> Task:
+    """
+    Create a task from the text.
+    """
+    return await achain(llm=llm)
+
+
+def stream_task(text: str, llm: FakeListChatModel) -> Iterator[Task]:
+    """
+    Create a task from the text.
+    """
+    return stream_chain(llm=llm)
+
+
+def greet(name: str, llm: FakeListChatModel) -> str:
+    """
+    Greet the person.
+    """
+    return chain(llm=llm)
+
+
+def write_code(task: str, llm: FakeListChatModel) -> CodeBlock:
+    """
+    Write the code for the task.
+    """
+    return chain(llm=llm)
+
+
+task = Task(title="Write tests", done=False)
+
+
+def test_completion_checks() -> None:
+    json_check = JsonCompletion(Task)
+    text = "```json\n" + task.model_dump_json() + "\n```"
+    assert [i for i, char in enumerate(text) if json_check.feed(char)] == [len(text) - 5]
+
+    invalid = JsonCompletion(Task)
+    assert not any(invalid.feed(char) for char in '{"title": "no done field"} {"title": "x", "done": true}')
+
+    fence = FenceCompletion()
+    assert not any(fence.feed(char) for char in "```python\nprint('hi')\n``")
+    assert fence.feed("`")
+
+    markdown = FenceCompletion()
+    assert not any(markdown.feed(char) for char in "```markdown\n# Title\n```python\n```\n```")
+
+    assert stop_sequences_for(RetryJsonPydanticParser(pydantic_object=Task, retry=0)) == ["\n```\n"]
+
+
+def test_stream_stops_after_complete_object() -> None:
+    response = task.model_dump_json() + COMMENTARY
+    llm = CountingModel(responses=[response])
+
+    assert list(stream_task("...", llm))[-1] == task
+    assert llm.generated == len(task.model_dump_json())
+
+
+def test_streaming_invoke_stops_early() -> None:
+    response = "```python\nprint('hello')\n```" + COMMENTARY
+    llm = CountingModel(responses=[response, task.model_dump_json() + COMMENTARY])
+
+    tokens: list[str] = []
+    with stream_to(tokens.append):
+        code = write_code("say hello", llm)
+    assert code.code == "print('hello')\n" and code.language == "python"
+    assert "".join(tokens) == "```python\nprint('hello')\n```"
+
+    with stream_to(tokens.append):
+        assert asyncio.run(acreate_task("...", llm)) == task
+
+
+def test_streaming_with_kwargs_forwarding_model() -> None:
+    llm = LlamaLikeModel(responses=[task.model_dump_json() + COMMENTARY] * 2 + ["Hello Ada!"])
+
+    assert list(stream_task("...", llm))[-1] == task
+
+    tokens: list[str] = []
+    with trace_to(lambda trace: None), stream_to(tokens.append):
+        assert create_task("...", llm) == task
+        assert greet("Ada", llm) == "Hello Ada!"
+    assert "".join(tokens) == task.model_dump_json() + "Hello Ada!"
+
+
+def test_fenced_block_inside_string_field() -> None:
+    note = Task(title="Run\n```bash\nls\n```\nin the shell", done=False)
+    # raw newlines inside the string (accepted by the parser)
+    llm = StopModel(responses=[json.dumps(note.model_dump()).replace("\\n", "\n")])
+
+    assert create_task("...", llm) == note
+    assert llm.stops == [None]
+
+
+def test_without_streaming_the_full_response_is_generated() -> None:
+    llm = CountingModel(responses=[json.dumps(task.model_dump()) + COMMENTARY])
+
+    assert create_task("...", llm) == task
+    assert llm.generated == 0  # invoked without streaming
+
+
+if __name__ == "__main__":
+    test_completion_checks()
+    test_stream_stops_after_complete_object()
+    test_streaming_invoke_stops_early()
+    test_streaming_with_kwargs_forwarding_model()
+    test_fenced_block_inside_string_field()
+    test_without_streaming_the_full_response_is_generated()
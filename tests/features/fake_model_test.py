@@ -0,0 +1,99 @@
+import asyncio
+import random
+import time
+from typing import Literal, Optional
+
+import pytest
+from funcchain import achain, chain
+from funcchain.backend.concurrency import is_overload_error
+from funcchain.backend.metrics import parse_retries
+from funcchain.backend.streaming import stream_to
+from funcchain.model.fake import FakeChatModel, FakeRateLimitError, fake_instance
+from pydantic import BaseModel, Field, TypeAdapter
+
+
+class Task(BaseModel):
+    title: str
+    priority: int = Field(ge=1, le=5)
+    status: Literal["todo", "done"]
+    tags: list[str]
+    estimate: Optional[float] = None
+
+
+class Note(BaseModel):
+    text: str
+
+
+def plan(goal: str) -> Task:
+    """
+    Plan the next task to reach the goal.
+    """
+    return chain(settings_override={"llm": "fake/gpt-4o", "fake_model_kwargs": {"seed": 42}})
+
+
+async def aplan(goal: str) -> Task:
+    """
+    Plan the next task to reach the goal.
+    """
+    return await achain(settings_override={"llm": "fake/functions"})
+
+
+def organize(text: str) -> Task | Note:
+    """
+    Turn the text into a task or a note.
+    """
+    return chain(settings_override={"llm": "fake/functions"})
+
+
+def flaky_plan(goal: str, llm: FakeChatModel) -> Task:
+    """
+    Plan the next task to reach the goal.
+    """
+    return chain(llm=llm, settings_override={"retry_parse_sleep": 0})
+
+
+def describe(topic: str) -> str:
+    """
+    Describe the topic.
+    """
+    return chain(settings_override={"llm": "fake/gpt-4o", "fake_model_kwargs": {"ttft": 0.05, "chunk_rate": 200}})
+
+
+def test_schema_valid_outputs() -> None:
+    assert isinstance(task := plan("ship the release"), Task)
+    # a new model per call continues the random sequence of the selector
+    assert plan("ship the release") != task
+    assert isinstance(asyncio.run(aplan("ship the release")), Task)
+    assert isinstance(organize("buy milk"), (Task, Note))
+
+    schema = TypeAdapter(list[Task]).json_schema()
+    rng = random.Random(0)
+    for _ in range(50):
+        TypeAdapter(list[Task]).validate_python(fake_instance(schema, rng))
+
+
+def test_latency_and_streaming() -> None:
+    tokens: list[str] = []
+    start = time.perf_counter()
+    with stream_to(tokens.append):
+        text = describe("funcchain")
+    assert time.perf_counter() - start >= 0.05
+    assert len(tokens) > 1 and "".join(tokens) == text
+
+
+def test_error_injection() -> None:
+    before = parse_retries.get("Task")
+    llm = FakeChatModel(malformed_rate=0.5, seed=3)
+    for _ in range(5):
+        assert isinstance(flaky_plan("ship the release", llm), Task)
+    assert parse_retries.get("Task") > before
+
+    with pytest.raises(FakeRateLimitError) as error:
+        flaky_plan("ship the release", FakeChatModel(error_rate=1.0))
+    assert is_overload_error(error.value)
+
+
+if __name__ == "__main__":
+    test_schema_valid_outputs()
+    test_latency_and_streaming()
+    test_error_injection()
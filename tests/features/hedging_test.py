@@ -0,0 +1,118 @@
+import asyncio
+import time
+from typing import AsyncIterator
+
+from funcchain.backend.hedging import HedgedModel, LatencyTracker, get_latency_tracker
+from funcchain.backend.ratelimit import RateLimiter
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.runnables import RunnableGenerator, RunnableLambda
+
+llm = FakeListChatModel(responses=["unused"])
+
+
+def delayed(content: str, delay: float, calls: list[str]) -> RunnableLambda:
+    def invoke(_: str) -> AIMessage:
+        calls.append(content)
+        time.sleep(delay)
+        return AIMessage(content=content)
+
+    async def ainvoke(_: str) -> AIMessage:
+        calls.append(content)
+        await asyncio.sleep(delay)
+        return AIMessage(content=content)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
+
+
+def test_percentile() -> None:
+    tracker = LatencyTracker(window=100)
+    for i in range(1, 101):
+        tracker.record(i / 100)
+
+    assert tracker.percentile(0.5) == 0.51
+    assert tracker.percentile(0.95) == 0.96
+    assert LatencyTracker().percentile(0.95) is None
+
+
+def test_hedge_wins() -> None:
+    calls: list[str] = []
+    model = HedgedModel(
+        delayed("primary", 1.0, calls),
+        llm,
+        hedge=delayed("hedge", 0.01, calls),
+        default_delay=0.05,
+    )
+
+    start = time.monotonic()
+    assert asyncio.run(model.ainvoke("Hi")).content == "hedge"
+    assert time.monotonic() - start < 0.5
+    assert calls == ["primary", "hedge"]
+
+    calls.clear()
+    assert model.invoke("Hi").content == "hedge"
+
+
+def test_no_hedge_for_fast_requests() -> None:
+    calls: list[str] = []
+    model = HedgedModel(delayed("primary", 0.01, calls), llm, hedge=delayed("hedge", 0.01, calls), default_delay=0.5)
+
+    assert asyncio.run(model.ainvoke("Hi")).content == "primary"
+    assert calls == ["primary"]
+
+
+def test_hedge_respects_rate_limit() -> None:
+    calls: list[str] = []
+    limiter = RateLimiter(rpm=1)
+    model = HedgedModel(
+        delayed("primary", 0.1, calls),
+        llm,
+        hedge=delayed("hedge", 0.01, calls),
+        default_delay=0.05,
+        limiter=limiter,
+        max_tokens=100,
+    )
+
+    assert asyncio.run(model.ainvoke("Hi")).content == "hedge"
+    # the hedge used the only request of the budget
+    calls.clear()
+    assert asyncio.run(model.ainvoke("Hi")).content == "primary"
+    assert calls == ["primary"]
+
+
+def test_hedge_delay_from_latency() -> None:
+    model = HedgedModel(delayed("primary", 0, []), FakeListChatModel(responses=["a", "b"]), min_samples=10)
+    tracker = get_latency_tracker(model.model_id)
+    for _ in range(10):
+        tracker.record(0.2)
+
+    assert model.hedge_delay() == 0.2
+    assert model.hedge_delay("first_token") == model.default_delay
+
+
+def test_stream_hedge_on_first_token() -> None:
+    def slow_stream(delay: float, content: str) -> RunnableGenerator:
+        async def generate(_: AsyncIterator[str]) -> AsyncIterator[AIMessageChunk]:
+            await asyncio.sleep(delay)
+            for token in content.split():
+                yield AIMessageChunk(content=token)
+
+        return RunnableGenerator(generate)
+
+    model = HedgedModel(
+        slow_stream(1.0, "slow primary"), llm, hedge=slow_stream(0.01, "fast hedge"), default_delay=0.05
+    )
+
+    async def main() -> list[str]:
+        return [str(chunk.content) async for chunk in model.astream("Hi")]
+
+    assert asyncio.run(main()) == ["fast", "hedge"]
+
+
+if __name__ == "__main__":
+    test_percentile()
+    test_hedge_wins()
+    test_no_hedge_for_fast_requests()
+    test_hedge_respects_rate_limit()
+    test_hedge_delay_from_latency()
+    test_stream_hedge_on_first_token()
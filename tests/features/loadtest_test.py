@@ -0,0 +1,62 @@
+import asyncio
+
+from funcchain import achain, chain
+from funcchain.backend.loadtest import load_test, percentile
+from pydantic import BaseModel
+
+
+class Task(BaseModel):
+    title: str
+    priority: int
+
+
+async def plan(goal: str) -> Task:
+    """
+    Plan the next task to reach the goal.
+    """
+    return await achain(
+        settings_override={
+            "llm": "fake/gpt-4o",
+            "fake_model_kwargs": {"ttft": 0.01, "chunk_rate": 1000, "error_rate": 0.2, "seed": 7},
+        }
+    )
+
+
+def summarize(text: str) -> str:
+    """
+    Summarize the text.
+    """
+    return chain(settings_override={"llm": "fake/gpt-4o"})
+
+
+def test_closed_loop() -> None:
+    report = asyncio.run(load_test(plan, {"goal": "ship the release"}, requests=20, concurrency=4, stream=True))
+    assert report.requests == 20 and report.concurrency == 4
+    # the models of the selector share their random generator, so only some requests fail
+    assert 0 < report.failed == report.errors.get("FakeRateLimitError", 0) < report.requests
+    assert len(report.ttfts) == report.succeeded > 0
+    summary = report.to_dict()
+    assert summary["mode"] == "closed" and summary["latency"]["p50"] <= summary["latency"]["p99"]
+    assert "req/s" in str(report)
+
+
+def test_open_loop() -> None:
+    report = asyncio.run(
+        load_test(summarize, lambda i: {"text": f"text {i}"}, rate=100, duration=0.2, arrivals="uniform")
+    )
+    assert 0 < report.requests <= 21 and report.failed == 0
+    # not streamed, so no time to first token
+    assert report.to_dict()["mode"] == "open" and report.to_dict()["ttft"] is None
+
+
+def test_percentile() -> None:
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 0.5) == 51.0
+    assert percentile(values, 0.99) == 100.0
+    assert percentile([], 0.5) is None
+
+
+if __name__ == "__main__":
+    test_closed_loop()
+    test_open_loop()
+    test_percentile()
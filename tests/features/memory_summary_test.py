@@ -0,0 +1,136 @@
+import asyncio
+from threading import Event
+
+from funcchain import achain, chain, settings
+from funcchain.utils.memory import SummarizingChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+
+def answer(question: str, memory: SummarizingChatMessageHistory) -> str:
+    """
+    Answer the question.
+    """
+    return chain(memory=memory, settings_override={"llm": "fake/gpt-4o"})
+
+
+async def aanswer(question: str, memory: SummarizingChatMessageHistory) -> str:
+    """
+    Answer the question.
+    """
+    return await achain(memory=memory, settings_override={"llm": "fake/gpt-4o"})
+
+
+def test_background_summary() -> None:
+    release, summarized = Event(), []
+
+    def blocked_summarizer(summary: str, conversation: str) -> str:
+        release.wait(timeout=5)
+        summarized.append(conversation)
+        return f"{summary} | {conversation.count('human:')} turns".strip(" |")
+
+    memory = SummarizingChatMessageHistory(max_tokens=120, keep_turns=1, summarizer=blocked_summarizer)
+    memory.add_message(SystemMessage(content="You are a helpful assistant."))
+    answer("warmup", memory)
+    for i in range(4):
+        answer(f"question {i}", memory)
+    # the answers did not wait for the summarizer
+    assert not summarized
+    release.set()
+    memory.wait()
+    assert summarized
+    assert memory.summary and "turns" in memory.summary
+    messages = memory.messages
+    assert messages[0].content == "You are a helpful assistant."
+    assert isinstance(messages[1], SystemMessage) and "earlier conversation" in str(messages[1].content)
+    assert isinstance(messages[-1], AIMessage)
+
+
+def test_async_summary() -> None:
+    calls = []
+
+    async def summarizer(summary: str, conversation: str) -> str:
+        calls.append(conversation)
+        await asyncio.sleep(0.05)
+        return "the user asked questions"
+
+    async def conversation() -> SummarizingChatMessageHistory:
+        memory = SummarizingChatMessageHistory(max_tokens=100, keep_turns=1, summarizer=summarizer)
+        for i in range(4):
+            await aanswer(f"question {i}", memory)
+        await memory.await_summary()
+        return memory
+
+    memory = asyncio.run(conversation())
+    assert memory.summary == "the user asked questions" and calls
+
+
+def test_default_summarizer() -> None:
+    settings.summary_llm = "fake/cheap"
+    try:
+        memory = SummarizingChatMessageHistory(max_tokens=30, keep_turns=1)
+        memory.add_messages([HumanMessage(content="My name is Ada. " * 5), AIMessage(content="Hi Ada! " * 5)])
+        memory.add_messages([HumanMessage(content="What is my name?"), AIMessage(content="Ada.")])
+        memory.wait()
+        assert memory.summary and len(memory.messages) == 3
+    finally:
+        settings.summary_llm = None
+
+
+def test_failed_summary() -> None:
+    def failing(summary: str, conversation: str) -> str:
+        raise RuntimeError("model down")
+
+    memory = SummarizingChatMessageHistory(max_tokens=10, keep_turns=1, summarizer=failing)
+    memory.add_messages([HumanMessage(content="first " * 10), AIMessage(content="ok")])
+    memory.add_messages([HumanMessage(content="second " * 10), AIMessage(content="ok")])
+    memory.wait()
+    # kept to retry with the next evicted turns
+    assert memory.summary is None and len(memory._pending) == 2
+
+
+def test_set_messages_keeps_summary() -> None:
+    memory = SummarizingChatMessageHistory(max_tokens=10, keep_turns=1, summarizer=lambda summary, turns: "earlier")
+    memory.add_message(SystemMessage(content="You are a helpful assistant."))
+    memory.add_messages([HumanMessage(content="first " * 10), AIMessage(content="ok")])
+    memory.add_messages([HumanMessage(content="second " * 10), AIMessage(content="ok")])
+    memory.wait()
+    assert memory.summary == "earlier"
+
+    memory.messages = memory.messages
+    messages = memory.messages
+    assert memory.summary == "earlier" and len(messages) == 4
+    assert messages[0].content == "You are a helpful assistant."
+    assert "earlier conversation" in str(messages[1].content)
+
+
+def test_summary_after_closed_loop() -> None:
+    summarized = []
+
+    async def summarizer(summary: str, conversation: str) -> str:
+        if not summarized:
+            summarized.append("")
+            # never finishes, cancelled when the event loop is closed
+            await asyncio.sleep(10)
+        summarized.append(conversation)
+        return "earlier"
+
+    async def conversation(memory: SummarizingChatMessageHistory) -> None:
+        memory.add_messages([HumanMessage(content="first " * 10), AIMessage(content="ok")])
+        memory.add_messages([HumanMessage(content="second " * 10), AIMessage(content="ok")])
+        await asyncio.sleep(0)
+
+    memory = SummarizingChatMessageHistory(max_tokens=10, keep_turns=1, summarizer=summarizer)
+    asyncio.run(conversation(memory))
+    # the next turns are summarized in a thread together with the turn of the cancelled task
+    memory.add_messages([HumanMessage(content="third " * 10), AIMessage(content="ok")])
+    memory.wait()
+    assert memory.summary == "earlier" and "first" in summarized[-1] and "second" in summarized[-1]
+
+
+if __name__ == "__main__":
+    test_background_summary()
+    test_async_summary()
+    test_default_summarizer()
+    test_failed_summary()
+    test_set_messages_keeps_summary()
+    test_summary_after_closed_loop()
@@ -0,0 +1,119 @@
+from funcchain import chain
+from funcchain.backend.cassette import record_cassette
+from funcchain.model.fake import FakeChatModel
+from funcchain.syntax.components import RouterChat
+from funcchain.syntax.components.router import Routes
+from funcchain.utils.memory import SlidingWindowChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel
+
+
+def turn(i: int) -> list[BaseMessage]:
+    return [HumanMessage(content=f"question {i} " * 10), AIMessage(content=f"answer {i} " * 10)]
+
+
+def test_sliding_window() -> None:
+    evicted: list[BaseMessage] = []
+    memory = SlidingWindowChatMessageHistory(max_tokens=200, keep_turns=2, on_evict=evicted.extend)
+    memory.add_message(SystemMessage(content="You are a helpful assistant."))
+    for i in range(20):
+        memory.add_messages(turn(i))
+        assert memory.total_tokens <= 200 or len(memory.messages) == 5
+
+    messages = memory.messages
+    assert isinstance(messages[0], SystemMessage)
+    assert messages[-1].content == turn(19)[1].content
+    assert len(evicted) + len(messages) - 1 == 40
+    assert evicted[0].content == turn(0)[0].content
+    assert memory.stats.total_tokens == sum(memory.stats.tokens)
+
+    # the last turns are kept even if they exceed the budget
+    memory = SlidingWindowChatMessageHistory(max_tokens=10, keep_turns=1, messages=turn(0) + turn(1))
+    assert [m.content for m in memory.messages] == [m.content for m in turn(1)]
+
+
+def answer(question: str, memory: SlidingWindowChatMessageHistory) -> str:
+    """
+    Answer the question.
+    """
+    return chain(memory=memory, settings_override={"llm": "fake/gpt-4o"})
+
+
+def test_chain_memory() -> None:
+    memory = SlidingWindowChatMessageHistory(max_tokens=150, keep_turns=1)
+    with record_cassette() as cassette:
+        for i in range(6):
+            answer(f"question {i}", memory)
+
+    prompts = [interaction["messages"] for interaction in cassette.interactions]
+    # every call sees the previous turns (window) before the instruction
+    assert len(prompts[0]) == 1 and len(prompts[1]) == 3
+    assert "question 0" in prompts[1][0]["content"][0]["text"]
+    assert max(len(prompt) for prompt in prompts) < 12
+    assert memory.total_tokens <= 150 or len(memory.messages) == 2
+    assert isinstance(memory.messages[-1], AIMessage)
+
+
+class Answer(BaseModel):
+    text: str
+    confidence: float
+
+
+def structured_answer(question: str, memory: SlidingWindowChatMessageHistory) -> Answer:
+    """
+    Answer the question.
+    """
+    return chain(memory=memory, settings_override={"llm": "fake/gpt-4o"})
+
+
+def count_words(text: str, memory: SlidingWindowChatMessageHistory) -> int:
+    """
+    Count the words of the text.
+    """
+    return chain(memory=memory, settings_override={"llm": "fake/gpt-4o"})
+
+
+def test_structured_turns() -> None:
+    memory = SlidingWindowChatMessageHistory(max_tokens=1000, keep_turns=2)
+    result = structured_answer("question 0", memory)
+    count = count_words("one two three", memory)
+
+    # both turns are recorded for every result type, structured results as json
+    assert [m.type for m in memory.messages] == ["human", "ai", "human", "ai"]
+    assert "question 0" in str(memory.messages[0].content)
+    assert Answer.model_validate_json(str(memory.messages[1].content)) == result
+    assert memory.messages[3].content == str(count)
+
+
+def test_router_memory() -> None:
+    memory = SlidingWindowChatMessageHistory(max_tokens=1000, keep_turns=2)
+    router = RouterChat({}, llm=FakeChatModel(function_calling=True, seed=1), history=memory)
+    with record_cassette() as cassette:
+        for i in range(3):
+            router.invoke(HumanMessage(content=f"hello {i}"))
+    assert len(memory.messages) == 6 and memory.messages[-2].content == "hello 2"
+    # the route selector and the default handler see the previous turns
+    last_selection, last_answer = (str(interaction["messages"]) for interaction in cassette.interactions[-2:])
+    assert "hello 1" in last_selection and "hello 1" in last_answer
+
+
+def test_router_handler_history() -> None:
+    memory = SlidingWindowChatMessageHistory(max_tokens=1000, keep_turns=2)
+    memory.add_messages(turn(0))
+
+    def handler(request: HumanMessage, config: RunnableConfig) -> AIMessage:
+        history = config["configurable"]["history"]
+        return AIMessage(content=f"{len(history.messages)} messages before {request.content}")
+
+    routes: Routes = {"default": {"handler": handler, "description": "Everything."}}
+    router = RouterChat(routes, llm=FakeChatModel(function_calling=True), history=memory)
+    assert router.invoke(HumanMessage(content="hello")).content == "2 messages before hello"
+
+
+if __name__ == "__main__":
+    test_sliding_window()
+    test_chain_memory()
+    test_structured_turns()
+    test_router_memory()
+    test_router_handler_history()
@@ -0,0 +1,77 @@
+import pytest
+from funcchain import chain
+from funcchain.backend.metrics import MetricsRegistry, metrics
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from pydantic import BaseModel
+
+
+class Answer(BaseModel):
+    text: str
+    confidence: float
+
+
+def answer(question: str, llm: FakeListChatModel) -> Answer:
+    """
+    Answer the question.
+    """
+    return chain(llm=llm)
+
+
+def strict_answer(question: str, llm: FakeListChatModel) -> Answer:
+    """
+    Answer the question.
+    """
+    return chain(llm=llm, settings_override={"retry_parse": 0})
+
+
+VALID = '{"text": "blue", "confidence": 0.9}'
+
+
+def test_chain_metrics() -> None:
+    metrics.reset()
+    answer("What color is the sky?", FakeListChatModel(responses=[VALID]))
+    answer("What color is the sky?", FakeListChatModel(responses=['{"text": "blue"}', VALID]))
+    with pytest.raises(Exception):
+        strict_answer("What color is the sky?", FakeListChatModel(responses=['{"text": "blue"}']))
+
+    snapshot = metrics.snapshot()
+    assert snapshot["funcchain_calls_total"] == {"answer/ok": 2, "strict_answer/error": 1}
+    assert snapshot["funcchain_calls_in_flight"] == {"answer": 0, "strict_answer": 0}
+    assert snapshot["funcchain_call_duration_seconds"]["answer"]["count"] == 2
+    assert snapshot["funcchain_parse_retries_total"] == {"Answer": 1}
+    assert snapshot["funcchain_parse_errors_total"] == {"Answer": 1}
+    assert snapshot["funcchain_model_requests_total"] == {"fake-list-chat-model/ok": 4}
+    assert snapshot["funcchain_tokens_total"]["answer/fake-list-chat-model/completion"] > 0
+    assert "partial_field_adapters" in snapshot["funcchain_cache_hit_ratio"]
+
+    text = metrics.to_prometheus()
+    assert "# TYPE funcchain_call_duration_seconds histogram" in text
+    assert 'funcchain_calls_total{funcchain="answer",status="ok"} 2' in text
+    assert 'funcchain_call_duration_seconds_bucket{funcchain="answer",le="+Inf"} 2' in text
+    assert 'funcchain_call_duration_seconds_count{funcchain="answer"} 2' in text
+    assert "# TYPE funcchain_cache_hits_total counter" in text
+
+
+def test_registry() -> None:
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    assert registry.histogram("latency_seconds", "Latency.", ("route",)) is latency
+    with pytest.raises(ValueError):
+        registry.counter("latency_seconds", "Latency.")
+    with pytest.raises(ValueError):
+        latency.observe(0.5)
+
+    for value in (0.05, 0.5, 0.5, 5.0):
+        latency.observe(value, 'say "hi"')
+    assert latency.quantile(0.5, 'say "hi"') == 1.0
+    assert latency.quantile(0.99, 'say "hi"') == float("inf")
+    assert latency.quantile(0.5, "other") is None
+    assert 'latency_seconds_bucket{route="say \\"hi\\"",le="0.1"} 1' in registry.to_prometheus()
+    snapshot = registry.snapshot()["latency_seconds"]['say "hi"']
+    assert snapshot["count"] == 4 and snapshot["sum"] == pytest.approx(6.05)
+    assert snapshot["buckets"] == {0.1: 1, 1.0: 2, float("inf"): 1}
+
+
+if __name__ == "__main__":
+    test_chain_metrics()
+    test_registry()
@@ -0,0 +1,193 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from funcchain import astream_chain, stream_chain
+from funcchain.model.fake import FakeChatModel
+from funcchain.parser.json_schema import RetryJsonPydanticParser
+from funcchain.parser.openai_functions import RetryOpenAIFunctionPydanticParser
+from funcchain.parser.partial import ItemsReset, PartialJsonScanner
+from funcchain.parser.primitive_types import RetryJsonPrimitiveTypeParser
+from langchain_core.exceptions import OutputParserException
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from pydantic import BaseModel
+
+
+class Address(BaseModel):
+    street: str
+    city: str
+
+
+class Profile(BaseModel):
+    name: str
+    age: int
+    address: Address
+    bio: str
+
+
+profile = Profile(name="Ada", age=36, address=Address(street="Main St, 1", city="London"), bio='She "wrote" code.')
+
+
+def test_scanner() -> None:
+    scanner = PartialJsonScanner()
+    completed = [scanner.fields() for char in "```json\n" + profile.model_dump_json() if scanner.feed(char)]
+
+    assert completed == [
+        {"name": "Ada"},
+        {"name": "Ada", "age": 36},
+        {"name": "Ada", "age": 36, "address": {"street": "Main St, 1", "city": "London"}},
+    ]
+    assert scanner.done
+
+    bracket_scanner = PartialJsonScanner(track_fields=False)
+    assert not any(bracket_scanner.feed(char) for char in profile.model_dump_json() + "\n```")
+    assert bracket_scanner.done and bracket_scanner.completed == {}
+    assert bracket_scanner.object_text() == profile.model_dump_json()
+
+
+def test_json_parser_transform() -> None:
+    parser = RetryJsonPydanticParser(pydantic_object=Profile, retry=0)
+    text = profile.model_dump_json()
+    outputs = list(parser.transform(iter(text[i : i + 3] for i in range(0, len(text), 3))))
+
+    assert [o.model_fields_set for o in outputs[:-1]] == [{"name"}, {"name", "age"}, {"name", "age", "address"}]
+    assert outputs[1].age == 36 and outputs[1].address is None
+    assert outputs[-1] == profile
+
+
+def test_function_arguments_transform() -> None:
+    parser = RetryOpenAIFunctionPydanticParser(pydantic_schema=Profile, retry=0)
+    arguments = profile.model_dump_json()
+    chunks = [AIMessageChunk(content="", additional_kwargs={"function_call": {"name": "profile", "arguments": ""}})]
+    chunks += [
+        AIMessageChunk(content="", additional_kwargs={"function_call": {"arguments": arguments[i : i + 5]}})
+        for i in range(0, len(arguments), 5)
+    ]
+
+    async def collect() -> list[Profile]:
+        async def agen() -> AsyncIterator[AIMessageChunk]:
+            for chunk in chunks:
+                yield chunk
+
+        return [output async for output in parser.atransform(agen())]
+
+    outputs = asyncio.run(collect())
+    assert len(outputs) == 4
+    assert outputs[0].name == "Ada"
+    assert outputs[-1] == profile
+
+
+class Team(BaseModel):
+    name: str
+    members: list[Address]
+
+
+def test_list_items_transform() -> None:
+    parser = RetryJsonPrimitiveTypeParser(primitive_type=list[Address], retry=0)
+    addresses = [Address(street=f"Street {i}", city="Vienna") for i in range(50)]
+    text = json.dumps({"value": [a.model_dump() for a in addresses]}, indent=2)
+
+    chunks = list(parser.transform(iter(text[i : i + 7] for i in range(0, len(text), 7))))
+    assert all(len(chunk) == 1 for chunk in chunks)
+    assert sum(chunks, []) == addresses
+
+    numbers = RetryJsonPrimitiveTypeParser(primitive_type=list[int], retry=0)
+    assert list(numbers.transform(iter('{"value": [1, 2,3 ]}'))) == [[1], [2], [3]]
+    assert list(numbers.transform(iter('{"value": []}'))) == [[]]
+
+
+def test_list_field_fills_item_by_item() -> None:
+    parser = RetryJsonPydanticParser(pydantic_object=Team, retry=0)
+    team = Team(name="core", members=[Address(street="a", city="b")] * 3)
+
+    outputs = list(parser.transform(iter(team.model_dump_json())))
+    assert [len(o.members or []) for o in outputs] == [0, 1, 2, 3, 3]
+    assert outputs[-1] == team
+
+
+def extract(text: str, llm: FakeListChatModel) -> Iterator[Profile]:
+    """
+    Extract the profile.
+    """
+    return stream_chain(llm=llm)
+
+
+def aextract(text: str, llm: FakeListChatModel) -> AsyncIterator[Profile]:
+    """
+    Extract the profile.
+    """
+    return astream_chain(llm=llm)
+
+
+def test_stream_chain_partial_objects() -> None:
+    llm = FakeListChatModel(responses=[json.dumps(profile.model_dump())])
+
+    outputs = list(extract("...", llm))
+    assert outputs[0].model_fields_set == {"name"}
+    assert outputs[-1] == profile
+
+    async def main() -> list[Profile]:
+        return [output async for output in aextract("...", llm)]
+
+    assert asyncio.run(main())[-1] == profile
+
+
+def extract_addresses(text: str, llm: FakeListChatModel) -> Iterator[list[Address]]:
+    """
+    Extract all addresses.
+    """
+    return stream_chain(llm=llm)
+
+
+def test_stream_chain_list_items() -> None:
+    addresses = [Address(street=f"Street {i}", city="Vienna") for i in range(5)]
+    llm = FakeListChatModel(responses=[json.dumps({"value": [a.model_dump() for a in addresses]})])
+
+    assert [item for [item] in extract_addresses("...", llm)] == addresses
+
+
+class RecordingModel(FakeChatModel):
+    outputs: list[str] = []
+
+    def _respond(self, messages: list[BaseMessage], stop: Optional[list[str]], **kwargs: Any) -> AIMessage:
+        message = super()._respond(messages, stop, **kwargs)
+        self.outputs.append(str(message.content))
+        return message
+
+
+def extract_numbers(text: str, llm: FakeChatModel) -> Iterator[list[int]]:
+    """
+    Extract all numbers.
+    """
+    return stream_chain(llm=llm, settings_override={"retry_budget": 1000})
+
+
+def test_list_items_reset_after_retry() -> None:
+    resets = 0
+    for seed in range(40):
+        llm = RecordingModel(malformed_rate=0.5, seed=seed, chunk_size=3, outputs=[])
+        try:
+            chunks = list(extract_numbers("...", llm))
+        except OutputParserException:
+            continue  # no retries left
+        # the last output is the one that was parsed
+        result = json.loads(llm.outputs[-1])["value"]
+        if isinstance(chunks[-1], ItemsReset):
+            # items of a malformed output were streamed before the retry
+            resets += 1
+            assert len(llm.outputs) > 1 and chunks[-1] == result
+        else:
+            assert sum(chunks, []) == result
+    assert resets
+
+
+if __name__ == "__main__":
+    test_scanner()
+    test_json_parser_transform()
+    test_function_arguments_transform()
+    test_list_items_transform()
+    test_list_field_fills_item_by_item()
+    test_stream_chain_partial_objects()
+    test_stream_chain_list_items()
+    test_list_items_reset_after_retry()
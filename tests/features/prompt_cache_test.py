@@ -0,0 +1,32 @@
+from funcchain.backend.prompt import _compile_instruction, create_instruction_prompt
+
+
+def test_compiled_once() -> None:
+    _compile_instruction.cache_clear()
+    for topic in ("cats", "dogs", "birds"):
+        prompt = create_instruction_prompt("Write a poem about {topic}.", [], {"topic": topic, "style": "haiku"})
+        text = prompt.format(topic=topic, style="haiku").content[0]["text"]  # type: ignore
+        assert text == f"STYLE:\nhaiku\nWrite a poem about {topic}."
+    info = _compile_instruction.cache_info()
+    assert info.misses == 1 and info.hits == 2
+
+    # other input variables or format instructions compile a new template
+    create_instruction_prompt("Write a poem about {topic}.", [], {"topic": "cats"})
+    create_instruction_prompt("Write a poem about {topic}.\n{format_instructions}", [], {"topic": "cats"}, "JSON")
+    assert _compile_instruction.cache_info().misses == 3
+
+
+def test_jinja_rendering() -> None:
+    prompt = create_instruction_prompt(
+        "List {% for item in items %}{{ item }} {% endfor %}\n{format_instructions}",
+        [],
+        {"items": "abc", "mood": "happy"},
+        format_instructions="Answer in JSON.",
+    )
+    text = prompt.format(items=["a", "b"], mood="happy").content[0]["text"]  # type: ignore
+    assert text == "MOOD:\nhappy\nList a b \nAnswer in JSON."
+
+
+if __name__ == "__main__":
+    test_compiled_once()
+    test_jinja_rendering()
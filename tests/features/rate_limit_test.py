@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from funcchain.backend.ratelimit import RateLimiter, get_rate_limiter, rate_limiter_for
+from funcchain.backend.settings import FuncchainSettings
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+
+def test_rpm_reservations_are_fifo() -> None:
+    limiter = RateLimiter(rpm=60)
+    waits = [limiter.reserve() for _ in range(63)]
+
+    assert waits[:60] == [0.0] * 60
+    assert 0.9 < waits[60] < waits[61] < waits[62] <= 3.0
+
+
+def test_tpm_accounts_for_tokens() -> None:
+    limiter = RateLimiter(tpm=600)
+
+    assert limiter.reserve(tokens=500) == 0.0
+    # 100 tokens are left, 200 are missing at a rate of 10 tokens per second
+    assert 19.5 < limiter.reserve(tokens=300) <= 20.0
+
+
+def test_concurrent_callers_queue() -> None:
+    limiter = RateLimiter(rpm=600)
+    for _ in range(600):
+        limiter.reserve()
+
+    async def call() -> float:
+        await limiter.aacquire()
+        return time.monotonic()
+
+    async def main() -> list[float]:
+        return await asyncio.gather(*(call() for _ in range(3)))
+
+    start = time.monotonic()
+    finished = asyncio.run(main())
+    assert 0.25 < max(finished) - start < 0.5
+
+
+def test_cancelled_waiter_refunds() -> None:
+    limiter = RateLimiter(rpm=60, tpm=6000)
+    limiter.reserve(tokens=6000)
+
+    async def main() -> None:
+        with_timeout = asyncio.wait_for(limiter.aacquire(tokens=600), timeout=0.05)
+        try:
+            await with_timeout
+        except asyncio.TimeoutError:
+            pass
+
+    asyncio.run(main())
+    # only the first reservation is left (less the refill)
+    assert limiter._requests is not None and limiter._requests.tokens > 58
+    assert limiter._tokens is not None and limiter._tokens.tokens > -10
+
+
+def test_reconfigure_refills_first() -> None:
+    limiter = RateLimiter(rpm=600)
+    for _ in range(600):
+        limiter.reserve()
+    time.sleep(0.2)
+    # about 2 requests were refilled at the old rate before the limit changed, the rest stays used
+    limiter.configure(rpm=60)
+    assert limiter._requests is not None and 60 - 598.1 < limiter._requests.tokens < 60 - 596
+
+
+def test_limits_from_settings() -> None:
+    llm = FakeListChatModel(responses=["Hello"])
+    settings = FuncchainSettings(rate_limits={"fake-list-chat-model": {"rpm": 100}})
+
+    limiter = rate_limiter_for(llm, settings.rate_limits)
+    assert limiter is not None and limiter.rpm == 100
+    assert limiter is get_rate_limiter("fake-list-chat-model", {"rpm": 100})
+    assert rate_limiter_for(llm, {}) is None
+
+    # changed limits reconfigure the shared limiter, keeping the reservations
+    limiter.reserve()
+    changed = get_rate_limiter("fake-list-chat-model", {"rpm": 60, "tpm": 1000})
+    assert changed is limiter and (limiter.rpm, limiter.tpm) == (60, 1000)
+    assert limiter._requests is not None and limiter._requests.tokens < 60
+
+
+if __name__ == "__main__":
+    test_rpm_reservations_are_fifo()
+    test_tpm_accounts_for_tokens()
+    test_concurrent_callers_queue()
+    test_cancelled_waiter_refunds()
+    test_reconfigure_refills_first()
+    test_limits_from_settings()
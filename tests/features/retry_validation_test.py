@@ -1 +1,129 @@
-# TODO: implement tests for retry validation
+import asyncio
+import time
+from typing import Iterator
+from unittest.mock import Mock, patch
+
+import pytest
+from funcchain import settings
+from funcchain.backend.retry import RetryBudget, RetryPolicy, shared_budget
+from funcchain.backend.settings import create_local_settings
+from funcchain.parser.json_schema import RetryJsonPydanticParser, RetryJsonPydanticUnionParser
+from funcchain.parser.selector import parser_for
+from langchain_core.exceptions import OutputParserException
+from pydantic import BaseModel
+
+
+class Task(BaseModel):
+    name: str
+    difficulty: int
+
+
+class Note(BaseModel):
+    text: str
+
+
+def test_backoff_override() -> None:
+    policy = create_local_settings(
+        {
+            "retry_parse_sleep": 1.0,
+            "retry_parse_backoff": 3.0,
+            "retry_parse_max_sleep": 5.0,
+        }
+    ).retry_policy()
+
+    override = policy.next_override(retry=2)
+    assert override["retry_parse"] == 2
+    assert override["retry_parse_sleep"] == 3.0
+
+    next_policy = create_local_settings(override).retry_policy()
+    assert next_policy.next_override(retry=1)["retry_parse_sleep"] == 5.0
+
+
+def test_jitter() -> None:
+    policy = RetryPolicy(sleep=1.0, jitter=0.5)
+    for _ in range(100):
+        assert 0.5 <= policy.delay() <= 1.0
+
+    assert RetryPolicy(sleep=1.0, jitter=0.0).delay() == 1.0
+    assert RetryPolicy(sleep=20.0, max_sleep=2.0, jitter=0.0).delay() == 2.0
+
+
+def test_budget_refill() -> None:
+    budget = RetryBudget(capacity=2, refill_rate=100)
+    assert budget.try_acquire()
+    assert budget.try_acquire()
+    assert not budget.try_acquire()
+    time.sleep(0.02)
+    assert budget.try_acquire()
+
+
+@pytest.fixture
+def empty_budget() -> Iterator[RetryBudget]:
+    budget = shared_budget(1, 0)
+    yield budget
+    budget.reset()
+
+
+def test_exhausted_budget_stops_retries(empty_budget: RetryBudget) -> None:
+    policy = RetryPolicy(budget=1, budget_refill=0)
+    parser = RetryJsonPydanticParser(pydantic_object=Task, retry=3, retry_policy=policy)
+
+    assert policy.acquire()
+    with pytest.raises(OutputParserException):
+        parser.parse('{"name": "cleanup", "difficulty": "hard"}')
+
+    # other configurations have their own budget and keep it
+    assert RetryPolicy().acquire()
+    assert not policy.acquire() and empty_budget.available == 0
+    override = policy.next_override(retry=1)
+    assert create_local_settings(override).retry_policy().budget == 1
+
+
+def test_async_backoff_does_not_block() -> None:
+    policy = RetryPolicy(sleep=0.2, jitter=0.0, budget=100)
+    parser = RetryJsonPydanticParser(pydantic_object=Task, retry=1, retry_llm="fake/gpt-4o", retry_policy=policy)
+
+    async def parse() -> tuple[Task, int]:
+        ticks = 0
+
+        async def tick() -> None:
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.create_task(tick())
+        task = await parser.aparse('{"name": "cleanup", "difficulty": "hard"}')
+        ticker.cancel()
+        return task, ticks
+
+    # no thread is blocked by time.sleep
+    blocking = Mock(monotonic=time.monotonic, sleep=Mock(side_effect=AssertionError("blocking sleep")))
+    with patch("funcchain.backend.retry.time", blocking):
+        task, ticks = asyncio.run(parse())
+    # the event loop kept running during the backoff
+    assert isinstance(task, Task) and ticks >= 10
+
+
+def test_parsers_use_settings_policy() -> None:
+    settings.retry_budget = 3
+    try:
+        assert parser_for([int], retry=1).retry_policy.budget == 3  # type: ignore
+        union = parser_for([Task, Note], retry=2, llm="fake/gpt-4o")
+        assert isinstance(union, RetryJsonPydanticUnionParser) and union.retry_policy.budget == 3
+    finally:
+        settings.retry_budget = 10.0
+
+    assert union.parse('Sure: {"text": "buy milk"}') == Note(text="buy milk")
+    assert isinstance(union.parse('{"name": "cleanup", "difficulty": "hard"}'), (Task, Note))
+    with pytest.raises(OutputParserException):
+        RetryJsonPydanticUnionParser(output_types=[Task, Note]).parse('{"name": "cleanup"}')
+
+
+if __name__ == "__main__":
+    test_backoff_override()
+    test_jitter()
+    test_budget_refill()
+    test_exhausted_budget_stops_retries(shared_budget(1, 0))
+    test_async_backoff_does_not_block()
+    test_parsers_use_settings_policy()
@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from funcchain.utils.memory import InMemoryChatMessageHistory, SessionStore, create_history_factory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+
+def test_lru_sessions() -> None:
+    spilled: dict[str, list[BaseMessage]] = {}
+    store = SessionStore(max_sessions=2, on_evict=lambda session_id, messages: spilled.update({session_id: messages}))
+    factory = create_history_factory(InMemoryChatMessageHistory, {"store": store})
+
+    a, b = factory("a"), factory("b")
+    a.add_user_message("hi from a")
+    b.add_user_message("hi from b")
+    a.messages  # a is used more recently than b
+    factory("c").add_user_message("hi from c")
+
+    assert len(store) == 2 and "b" not in store and "a" in store
+    assert [m.content for m in spilled["b"]] == ["hi from b"]
+
+
+def test_size_cap() -> None:
+    store = SessionStore(max_bytes=200)
+    for i in range(10):
+        store.add(f"user-{i}", [HumanMessage(content="hello " * 10)])
+    assert store.total_bytes <= 200 and "user-9" in store and "user-0" not in store
+
+    # the session in use is kept even if it exceeds the cap alone
+    store.add("user-9", [AIMessage(content="word " * 100)])
+    assert list(store._sessions) == ["user-9"] and store.total_bytes > 200
+
+    store.clear("user-9")
+    assert store.total_bytes == 0 and store.messages("user-9") == []
+
+
+def test_size_cap_counts_images() -> None:
+    store = SessionStore(max_bytes=10_000)
+    image = {"type": "image_url", "image_url": {"url": "data:image/png;base64," + "A" * 8_000}}
+    store.add("text", [HumanMessage(content="hello")])
+    store.add("image", [HumanMessage(content=[{"type": "text", "text": "what is this?"}, image])])
+    assert store.total_bytes > 8_000 and "text" in store
+
+    store.add("image-2", [HumanMessage(content=[image])])
+    assert list(store._sessions) == ["image-2"]
+
+
+def test_idle_ttl() -> None:
+    evicted: list[str] = []
+    store = SessionStore(ttl=0.2, on_evict=lambda session_id, messages: evicted.append(session_id))
+    history = InMemoryChatMessageHistory("idle", store)
+    history.add_user_message("hello")
+    time.sleep(0.12)
+    store.add("active", [HumanMessage(content="hello")])
+    time.sleep(0.12)
+    store.messages("active")
+    assert evicted == ["idle"] and "active" in store
+
+    # an expired session starts over
+    time.sleep(0.25)
+    assert store.evict_expired() == 1 and evicted == ["idle", "active"]
+    assert history.messages == [] and len(store) == 1
+
+
+def test_concurrent_access() -> None:
+    store = SessionStore(max_sessions=16)
+
+    def chat(i: int) -> None:
+        history = InMemoryChatMessageHistory(f"session-{i % 32}", store)
+        history.add_messages([HumanMessage(content=f"question {i}"), AIMessage(content="answer")])
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(chat, range(1000)))
+    assert len(store) == 16
+    assert store.total_bytes == sum(session.size for session in store._sessions.values())
+
+
+if __name__ == "__main__":
+    test_lru_sessions()
+    test_size_cap()
+    test_size_cap_counts_images()
+    test_idle_ttl()
+    test_concurrent_access()
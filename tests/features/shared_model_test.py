@@ -0,0 +1,322 @@
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Iterator
+
+import httpx
+import pytest
+from funcchain import achain, astream_chain, chain
+from funcchain.backend.cassette import ReplayChatModel
+from funcchain.backend.streaming import astream_to, stream_to
+from funcchain.model.patches.llamacpp import ChatLlamaCpp
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+
+
+class Weather(BaseModel):
+    city: str
+    temperature: int
+
+
+class Person(BaseModel):
+    name: str
+    age: int
+
+
+answers: dict[str, dict[str, Any]] = {
+    "weather": {"city": "Vienna", "temperature": 21},
+    "person": {"name": "Ada", "age": 36},
+}
+
+
+def answer_for(text: str) -> dict[str, Any]:
+    """
+    Answer of the output type whose fields all appear in the text (as keys of the schema or strings of the grammar).
+    """
+    return next(
+        answer
+        for answer in answers.values()
+        if all(f"{field}:" in text or f'\\"{field}\\"' in text for field in answer)
+    )
+
+
+class EchoModel(ChatOpenAI):
+    """
+    Offline function calling model answering only based on the per call configuration.
+    """
+
+    def _respond(self, messages: list[BaseMessage], **kwargs: Any) -> AIMessage:
+        time.sleep(random.random() / 100)
+        if kwargs.get("response_format") or self.model_kwargs.get("response_format"):
+            # json mode: answer the output type named in the format instructions
+            return AIMessage(content=json.dumps(answer_for(str(messages[-1].content))))
+        if "functions" in kwargs:
+            name = kwargs["function_call"]["name"]
+            return AIMessage(
+                content="",
+                additional_kwargs={"function_call": {"name": name, "arguments": json.dumps(answers[name])}},
+            )
+        return AIMessage(content="no per call configuration")
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages, **kwargs))])
+
+    async def _agenerate(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(random.random() / 100)
+        return self._generate(messages, **kwargs)
+
+    def _stream(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        message = self._respond(messages, **kwargs)
+        if function_call := message.additional_kwargs.get("function_call"):
+            # argument deltas like the openai api
+            name, arguments = function_call["name"], function_call["arguments"]
+            yield ChatGenerationChunk(
+                message=AIMessageChunk(content="", additional_kwargs={"function_call": {"name": name, "arguments": ""}})
+            )
+            for i in range(0, len(arguments), 4):
+                yield ChatGenerationChunk(
+                    message=AIMessageChunk(
+                        content="", additional_kwargs={"function_call": {"arguments": arguments[i : i + 4]}}
+                    )
+                )
+            return
+        for token in str(message.content).split(" "):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token + " "))
+
+    async def _astream(
+        self, messages: list[BaseMessage], *args: Any, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        for chunk in self._stream(messages, **kwargs):
+            yield chunk
+
+
+# explicit clients, the model never connects anyway
+llm = EchoModel(model="gpt-4", api_key="sk-offline", http_client=httpx.Client(), http_async_client=httpx.AsyncClient())
+
+
+def weather(text: str) -> Weather:
+    """
+    Extract the weather from the text.
+    """
+    return chain(llm=llm)
+
+
+def person(text: str) -> Person:
+    """
+    Extract the person from the text.
+    """
+    return chain(llm=llm)
+
+
+async def aweather(text: str) -> Weather:
+    """
+    Extract the weather from the text.
+    """
+    return await achain(llm=llm)
+
+
+async def aperson(text: str) -> Person:
+    """
+    Extract the person from the text.
+    """
+    return await achain(llm=llm)
+
+
+def astream_person(text: str) -> AsyncIterator[Person]:
+    """
+    Extract the person from the text.
+    """
+    return astream_chain(llm=llm)
+
+
+def streamed_person(text: str) -> Person:
+    tokens: list[str] = []
+    with stream_to(tokens.append):
+        result = person(text)
+    assert json.loads("".join(tokens)) == answers["person"]
+    return result
+
+
+def test_shared_model_threads() -> None:
+    tasks = [(weather, Weather), (person, Person), (streamed_person, Person)] * 30
+    random.shuffle(tasks)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        futures = [(executor.submit(fn, "some text"), output_type) for fn, output_type in tasks]
+        for future, output_type in futures:
+            result = future.result()
+            assert isinstance(result, output_type)
+            assert result.model_dump() == answers[output_type.__name__.lower()]
+
+    # the shared instance was never modified
+    assert llm.streaming is False
+    assert llm.model_kwargs == {}
+    assert llm.callbacks is None
+
+
+def test_function_call_streaming() -> None:
+    async def main() -> list[Any]:
+        tokens: list[str] = []
+        async with astream_to(tokens.append):
+            result = await aweather("some text")
+        assert json.loads("".join(tokens)) == answers["weather"]
+        return [result, *[partial async for partial in astream_person("...")]]
+
+    weather, *people = asyncio.run(main())
+    assert weather == Weather(**answers["weather"])
+    assert people[0].model_fields_set == {"name"}
+    assert people[-1] == Person(**answers["person"])
+
+
+def test_shared_model_tasks() -> None:
+    async def main() -> list[Any]:
+        return await asyncio.gather(*(aweather("some text") for _ in range(25)), *(aperson("...") for _ in range(25)))
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, Weather) for result in results[:25])
+    assert all(isinstance(result, Person) for result in results[25:])
+    assert llm.model_kwargs == {}
+
+
+class JsonModeModel(ReplayChatModel):
+    """
+    Offline json mode model (compiled like a recorded json mode model), answering only in json mode.
+    """
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(random.random() / 100)
+        assert kwargs.get("response_format") == {"type": "json_object"}
+        message = AIMessage(content=json.dumps(answer_for(str(messages[-1].content))))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(random.random() / 100)
+        return self._generate(messages, **kwargs)
+
+
+class GrammarClient:
+    """
+    llama.cpp client answering with the output type of the grammar passed with the call.
+    """
+
+    def __init__(self) -> None:
+        self.grammars: list[Any] = []
+
+    def __call__(self, prompt: str, stream: bool, grammar: Any = None, **kwargs: Any) -> Iterator[dict]:
+        time.sleep(random.random() / 100)
+        self.grammars.append(grammar)
+        yield {"choices": [{"text": json.dumps(answer_for(prompt)), "logprobs": None}]}
+
+
+def weather_with(text: str, llm: BaseChatModel) -> Weather:
+    """
+    Extract the weather from the text.
+    """
+    return chain(llm=llm)
+
+
+def person_with(text: str, llm: BaseChatModel) -> Person:
+    """
+    Extract the person from the text.
+    """
+    return chain(llm=llm)
+
+
+async def aweather_with(text: str, llm: BaseChatModel) -> Weather:
+    """
+    Extract the weather from the text.
+    """
+    return await achain(llm=llm)
+
+
+async def aperson_with(text: str, llm: BaseChatModel) -> Person:
+    """
+    Extract the person from the text.
+    """
+    return await achain(llm=llm)
+
+
+def run_concurrently(llm: BaseChatModel) -> None:
+    """
+    Extract both output types with the same model instance from threads and tasks.
+    """
+    tasks = [(weather_with, Weather), (person_with, Person)] * 20
+    random.shuffle(tasks)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [(executor.submit(fn, "some text", llm), output_type) for fn, output_type in tasks]
+        for future, output_type in futures:
+            assert future.result() == output_type(**answers[output_type.__name__.lower()])
+
+    async def main() -> list[Any]:
+        return await asyncio.gather(
+            *(aweather_with("some text", llm) for _ in range(20)), *(aperson_with("...", llm) for _ in range(20))
+        )
+
+    results = asyncio.run(main())
+    assert results[:20] == [Weather(**answers["weather"])] * 20
+    assert results[20:] == [Person(**answers["person"])] * 20
+
+
+def test_shared_json_mode_model() -> None:
+    # the model asserts that response_format was passed with every call
+    run_concurrently(
+        JsonModeModel(model_name="llama3-70b", recorded_type="groq-chat", kind="json_model", cassette=None)
+    )
+
+
+def test_shared_ollama_model() -> None:
+    pytest.importorskip("langchain_community")
+    from funcchain.model.patches.ollama import ChatOllama
+
+    class GrammarOllama(ChatOllama):
+        def _generate(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> ChatResult:
+            time.sleep(random.random() / 100)
+            # the grammar of this call decides the answer
+            message = AIMessage(content=json.dumps(answer_for(kwargs["grammar"])))
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        async def _agenerate(self, messages: list[BaseMessage], *args: Any, **kwargs: Any) -> ChatResult:
+            return self._generate(messages, **kwargs)
+
+    ollama = GrammarOllama(model="llama3")
+    run_concurrently(ollama)
+    assert ollama.grammar is None
+
+
+def test_shared_llamacpp_model() -> None:
+    LlamaGrammar = pytest.importorskip("llama_cpp").LlamaGrammar
+    client = GrammarClient()
+    llamacpp = ChatLlamaCpp.construct(client=client, model_path="offline.gguf")
+    run_concurrently(llamacpp)
+
+    # every call got its own grammar, the shared instance none
+    assert len(client.grammars) == 80 and all(isinstance(grammar, LlamaGrammar) for grammar in client.grammars)
+    assert len({id(grammar) for grammar in client.grammars}) == 80
+    assert llamacpp.grammar is None
+
+
+if __name__ == "__main__":
+    test_shared_model_threads()
+    test_function_call_streaming()
+    test_shared_model_tasks()
+    test_shared_json_mode_model()
+    test_shared_ollama_model()
+    test_shared_llamacpp_model()
@@ -0,0 +1,80 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from funcchain import chain
+from funcchain.utils.memory import SQLiteChatMessageHistory, create_history_factory
+from langchain_core.messages import AIMessage, HumanMessage
+
+
+def test_sqlite_history(tmp_path: Path) -> None:
+    path = str(tmp_path / "history.db")
+    factory = create_history_factory(SQLiteChatMessageHistory, {"path": path, "window": 4})
+
+    history = factory("alice")
+    for i in range(5):
+        history.add_messages([HumanMessage(content=f"question {i}"), AIMessage(content=f"answer {i}")])
+    factory("bob").add_user_message("hello")
+    assert [m.content for m in history.messages] == ["question 3", "answer 3", "question 4", "answer 4"]
+
+    # a new process only loads the window, older messages are paged
+    reopened = SQLiteChatMessageHistory("alice", path, window=2)
+    assert [m.content for m in reopened.messages] == ["question 4", "answer 4"]
+    assert [m.content for m in reopened.load(2, offset=2)] == ["question 3", "answer 3"]
+    assert len(reopened.load()) == 10 and isinstance(reopened.load()[1], AIMessage)
+
+    reopened.clear()
+    assert not factory("alice").messages and factory("bob").messages[0].content == "hello"
+
+    connection = sqlite3.connect(path)
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall() == [
+        ("chat_messages_session_id",)
+    ]
+
+
+def test_turn_in_one_transaction(tmp_path: Path) -> None:
+    history = SQLiteChatMessageHistory("session", str(tmp_path / "history.db"))
+    statements: list[str] = []
+    history._db.connection.set_trace_callback(statements.append)
+
+    def answer(question: str) -> str:
+        """
+        Answer the question.
+        """
+        return chain(memory=history, settings_override={"llm": "fake/gpt-4o"})
+
+    answer("what is funcchain?")
+    answer("and why?")
+    history._db.connection.set_trace_callback(None)
+
+    assert [m.type for m in SQLiteChatMessageHistory("session", str(tmp_path / "history.db")).messages] == [
+        "human",
+        "ai",
+        "human",
+        "ai",
+    ]
+    assert sum(statement.startswith("BEGIN") for statement in statements) == 2
+
+
+def test_reads_during_write(tmp_path: Path) -> None:
+    history = SQLiteChatMessageHistory("session", str(tmp_path / "history.db"))
+    history.add_messages([HumanMessage(content="hello"), AIMessage(content="hi")])
+
+    # another thread writing doesn't block the reads
+    with history._db.lock, ThreadPoolExecutor(1) as pool:
+        messages = pool.submit(history.load).result(timeout=5)
+    assert [m.content for m in messages] == ["hello", "hi"]
+
+    memory = SQLiteChatMessageHistory("session", ":memory:")
+    memory.add_user_message("hello")
+    assert [m.content for m in memory.load()] == ["hello"]
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as directory:
+        test_sqlite_history(Path(directory))
+        test_turn_in_one_transaction(Path(directory))
+        test_reads_during_write(Path(directory))
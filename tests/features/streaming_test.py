@@ -1 +1,155 @@
-# TODO: implement tests for streaming
+import asyncio
+from typing import Any, AsyncIterator, Iterator
+
+from funcchain import astream_chain, chain, stream_chain
+from funcchain.backend.streaming import AsyncStreamHandler, astream_to, stream_handler, stream_to
+from funcchain.model.patches.llamacpp import ChatLlamaCpp
+from funcchain.utils.msg_tools import join_message_chunks
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessageChunk
+
+
+def answer(question: str, llm: FakeListChatModel) -> Iterator[str]:
+    """
+    Answer the question.
+    """
+    return stream_chain(llm=llm)
+
+
+def aanswer(question: str, llm: FakeListChatModel) -> AsyncIterator[str]:
+    """
+    Answer the question.
+    """
+    return astream_chain(llm=llm)
+
+
+def test_stream_chain() -> None:
+    llm = FakeListChatModel(responses=["Hello world"])
+
+    assert "".join(answer("Hi?", llm)) == "Hello world"
+    assert stream_handler.get() is None
+
+
+def test_concurrent_astream_chains() -> None:
+    async def collect(response: str) -> str:
+        llm = FakeListChatModel(responses=[response], sleep=0.001)
+        return "".join([token async for token in aanswer("Hi?", llm)])
+
+    async def main() -> list[str]:
+        return await asyncio.gather(*(collect(f"answer number {i}") for i in range(20)))
+
+    assert asyncio.run(main()) == [f"answer number {i}" for i in range(20)]
+
+
+def test_backpressure_and_early_close() -> None:
+    llm = FakeListChatModel(responses=["a" * 100])
+
+    async def main() -> list[str]:
+        tokens = aanswer("Hi?", llm)
+        first = [await anext(tokens), await anext(tokens)]
+        await tokens.aclose()  # type: ignore
+        return first
+
+    assert asyncio.run(main()) == ["a", "a"]
+
+    tokens = answer("Hi?", llm)
+    assert next(tokens) == "a"
+    tokens.close()  # type: ignore
+
+
+def test_async_sink_is_awaited() -> None:
+    received: list[str] = []
+
+    async def sink(token: str) -> None:
+        await asyncio.sleep(0)
+        received.append(token)
+
+    async def main() -> None:
+        async with astream_to(sink) as handler:
+            await handler.on_llm_new_token("Hi", run_id=None)  # type: ignore
+        assert stream_handler.get() is None
+
+    asyncio.run(main())
+    assert received == ["Hi"]
+
+    with stream_to(received.append):
+        assert isinstance(stream_handler.get(), AsyncStreamHandler)
+    assert stream_handler.get() is None
+
+
+def test_token_coalescing() -> None:
+    received: list[str] = []
+    llm = FakeListChatModel(responses=["a" * 25])
+
+    with stream_to(received.append, coalesce_chars=10):
+        assert answer_once("Hi?", llm) == "a" * 25
+    assert received == ["a" * 10, "a" * 10, "a" * 5]
+
+    received.clear()
+    with stream_to(received.append, coalesce_interval=60):
+        answer_once("Hi?", llm)
+    assert received == ["a" * 25]  # flushed at the end of the run
+
+
+def answer_once(question: str, llm: FakeListChatModel) -> str:
+    """
+    Answer the question.
+    """
+    return chain(llm=llm)
+
+
+class LlamaClient:
+    def __call__(self, prompt: str, stream: bool, **kwargs: Any) -> Iterator[dict]:
+        for i in range(1000):
+            yield {"choices": [{"text": f"{i} ", "logprobs": None}]}
+
+
+def test_llamacpp_aggregation() -> None:
+    llm = ChatLlamaCpp.construct(client=LlamaClient(), model_path="offline.gguf")
+    tokens: list[str] = []
+
+    with stream_to(tokens.append):
+        assert answer_once("Count!", llm) == "".join(f"{i} " for i in range(1000))  # type: ignore
+    assert len(tokens) == 1000  # one callback per chunk
+
+    # generation without streaming aggregates the chunks
+    tokens.clear()
+    message = llm.invoke("Count!", config={"callbacks": [AsyncStreamHandler(tokens.append, {})]})
+    assert message.content == "".join(tokens) and len(tokens) == 1000
+
+
+def test_join_message_chunks() -> None:
+    chunks = [AIMessageChunk(content="", additional_kwargs={"function_call": {"name": "f", "arguments": ""}})]
+    chunks += [AIMessageChunk(content="", additional_kwargs={"function_call": {"arguments": c}}) for c in '{"a": 1}']
+    assert join_message_chunks(chunks).additional_kwargs == {"function_call": {"name": "f", "arguments": '{"a": 1}'}}
+    assert join_message_chunks([AIMessageChunk(content=c) for c in "hello"]).content == "hello"
+
+    # tool call chunks are joined by index, the usage is added up
+    chunks = [
+        AIMessageChunk(
+            content="",
+            tool_call_chunks=[{"name": "f", "args": "", "id": "call", "index": 0}],
+            usage_metadata={"input_tokens": 3, "output_tokens": 0, "total_tokens": 3},
+        )
+    ]
+    chunks += [
+        AIMessageChunk(content="", tool_call_chunks=[{"name": None, "args": c, "id": None, "index": 0}])
+        for c in '{"a": 1}'
+    ]
+    chunks.append(AIMessageChunk(content="", usage_metadata={"input_tokens": 0, "output_tokens": 9, "total_tokens": 9}))
+    message = join_message_chunks(chunks)
+    expected = chunks[0]
+    for chunk in chunks[1:]:
+        expected += chunk
+    assert message == expected and message.tool_calls == [{"name": "f", "args": {"a": 1}, "id": "call"}]  # type: ignore
+    assert chunks[1].tool_call_chunks[0]["args"] == "{"  # type: ignore
+
+
+if __name__ == "__main__":
+    test_stream_chain()
+    test_concurrent_astream_chains()
+    test_backpressure_and_early_close()
+    test_async_sink_is_awaited()
+    test_token_coalescing()
+    test_llamacpp_aggregation()
+    test_join_message_chunks()
@@ -0,0 +1,118 @@
+import asyncio
+from typing import Annotated, Any, Iterator
+
+from funcchain import achain, chain
+from funcchain.backend.streaming import stream_to
+from funcchain.backend.tracing import Trace, add_trace_hook, current_trace, remove_trace_hook, start_trace, trace_to
+from funcchain.syntax.params import Depends
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import BaseMessageChunk
+from pydantic import BaseModel
+
+
+class Answer(BaseModel):
+    text: str
+    confidence: float
+
+
+def answer(question: str, llm: FakeListChatModel) -> Answer:
+    """
+    Answer the question.
+    """
+    return chain(llm=llm)
+
+
+async def aanswer(question: str, llm: FakeListChatModel) -> Answer:
+    """
+    Answer the question.
+    """
+    return await achain(llm=llm)
+
+
+def answer_with_facts(
+    question: str,
+    llm: FakeListChatModel,
+    facts: Annotated[str, Depends(lambda _: "the sky is blue")] = "",
+) -> str:
+    """
+    Answer the question using the facts.
+    """
+    return chain(llm=llm)
+
+
+class StreamCountingModel(FakeListChatModel):
+    streams: int = 0
+
+    def stream(self, *args: Any, **kwargs: Any) -> Iterator[BaseMessageChunk]:
+        self.streams += 1
+        yield from super().stream(*args, **kwargs)
+
+
+VALID = '{"text": "blue", "confidence": 0.9}'
+
+
+def stages(trace: Trace) -> list[str]:
+    return [span.stage for span in trace.spans]
+
+
+def test_latency_breakdown() -> None:
+    traces: list[Trace] = []
+    with trace_to(traces.append):
+        answer("What color is the sky?", FakeListChatModel(responses=[VALID]))
+        asyncio.run(aanswer("What color is the sky?", FakeListChatModel(responses=[VALID])))
+
+    for trace, name in zip(traces, ["answer", "aanswer"]):
+        assert trace.name == name and trace.error is None
+        assert stages(trace) == ["introspection", "compile", "prompt_format", "generation", "parse"]
+        breakdown = trace.breakdown()
+        assert sum(breakdown[stage] for stage in stages(trace)) <= breakdown["total"]
+    assert current_trace.get() is None
+
+
+def test_dependencies_retries_and_ttft() -> None:
+    traces: list[Trace] = []
+    hook = add_trace_hook(traces.append)
+    try:
+        answer_with_facts("What color is the sky?", FakeListChatModel(responses=["blue"]))
+        answer("?", FakeListChatModel(responses=['{"text": "blue"}', VALID]))
+        with stream_to(lambda token: None):
+            answer("?", FakeListChatModel(responses=[VALID]))
+    finally:
+        remove_trace_hook(hook)
+
+    deps, retried, streamed = traces
+    assert "dependencies" in stages(deps)
+    assert stages(retried).count("generation") == 2 and stages(retried).count("retry") == 1
+    assert [span.attributes for span in retried.spans if span.stage == "retry"] == [
+        {"output_type": "Answer", "retries_left": 3}
+    ]
+    assert "ttft" in stages(streamed)
+    ttft, generation = (next(s for s in streamed.spans if s.stage == stage) for stage in ("ttft", "generation"))
+    assert ttft.duration <= generation.duration
+    assert "ttft" not in stages(deps)  # not streamed, not measured
+
+    # the retried generation and parse are nested in the retry (and parse) span but only counted once
+    breakdown = retried.breakdown()
+    retry = next(span for span in retried.spans if span.stage == "retry")
+    nested = [span for span in retried.spans if span is not retry and retry.start <= span.start <= retry.end]
+    assert breakdown["retry"] <= retry.duration - sum(span.duration for span in nested) + 1e-9
+    assert sum(breakdown[stage] for stage in set(stages(retried))) <= breakdown["total"]
+
+
+def test_tracing_does_not_stream_invoke() -> None:
+    llm = StreamCountingModel(responses=["blue"])
+    with trace_to(lambda trace: None), stream_to(lambda token: None):
+        assert answer_with_facts("What color is the sky?", llm) == "blue"
+    assert llm.streams == 0
+
+
+def test_no_hooks_no_trace() -> None:
+    assert start_trace("answer").spans == []
+    assert answer("?", FakeListChatModel(responses=[VALID])).text == "blue"
+
+
+if __name__ == "__main__":
+    test_latency_breakdown()
+    test_dependencies_retries_and_ttft()
+    test_tracing_does_not_stream_invoke()
+    test_no_hooks_no_trace()
@@ -0,0 +1,113 @@
+import asyncio
+from typing import Any, Iterator
+
+import pytest
+from funcchain import achain, chain
+from funcchain.backend import usage as usage_module
+from funcchain.backend.streaming import stream_to
+from funcchain.backend.usage import track_usage, usage_registry
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.fake_chat_models import FakeListChatModel, GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGenerationChunk
+
+
+def summarize(text: str, llm: BaseChatModel) -> str:
+    """
+    Summarize the text.
+    """
+    return chain(llm=llm, settings_override={"token_prices": {"generic-fake-chat-model": {"input": 2, "output": 10}}})
+
+
+def translate(text: str, llm: FakeListChatModel) -> str:
+    """
+    Translate the text to german.
+    """
+    return chain(llm=llm)
+
+
+async def atranslate(text: str, llm: FakeListChatModel) -> str:
+    """
+    Translate the text to german.
+    """
+    return await achain(llm=llm)
+
+
+USAGE: UsageMetadata = {"input_tokens": 1000, "output_tokens": 100, "total_tokens": 1100}
+
+
+class ReportingModel(GenericFakeChatModel):
+    """
+    Reports the usage with the message, when streaming with the last chunk.
+    """
+
+    def _stream(self, *args: Any, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        yield from super()._stream(*args, **kwargs)
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=USAGE))
+
+
+class SlowModel(FakeListChatModel):
+    """
+    Takes too long to answer.
+    """
+
+    async def _agenerate(self, *args: Any, **kwargs: Any) -> Any:
+        await asyncio.sleep(10)
+        return await super()._agenerate(*args, **kwargs)
+
+
+def reporting_model() -> GenericFakeChatModel:
+    return ReportingModel(messages=iter([AIMessage(content="A summary.", usage_metadata=USAGE)]))
+
+
+def test_usage_per_chain_and_model() -> None:
+    with track_usage() as usage:
+        summarize("some long text " * 100, reporting_model())
+        translate("Hello world!", FakeListChatModel(responses=["Hallo Welt!"]))
+        translate("Good morning!", FakeListChatModel(responses=["Guten Morgen!"]))
+
+    chains = usage.by_chain()
+    assert chains["summarize"]["prompt_tokens"] == 1000 and chains["summarize"]["completion_tokens"] == 100
+    assert chains["summarize"]["cost"] == (1000 * 2 + 100 * 10) / 1_000_000
+    assert chains["summarize"]["estimated_calls"] == 0
+    assert chains["translate"]["calls"] == 2 and chains["translate"]["estimated_calls"] == 2
+    assert chains["translate"]["completion_tokens"] > 0 and chains["translate"]["cost"] == 0
+
+    assert set(usage.by_model()) == {"generic-fake-chat-model", "fake-list-chat-model"}
+    assert usage.total()["calls"] == 3
+    assert usage.top_chains("total_tokens")[0][0] == "summarize"
+    # the process wide registry includes the scoped usage
+    assert usage_registry.by_chain()["summarize"]["calls"] >= 1
+
+
+def test_reported_usage_is_not_estimated(monkeypatch: pytest.MonkeyPatch) -> None:
+    def estimate_tokens(text: str) -> int:
+        raise AssertionError("estimated although the usage was reported")
+
+    monkeypatch.setattr(usage_module, "estimate_tokens", estimate_tokens)
+    with track_usage() as usage:
+        summarize("some long text", reporting_model())
+    assert usage.total()["prompt_tokens"] == 1000
+
+
+def test_cancelled_call_usage() -> None:
+    with track_usage() as usage:
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(asyncio.wait_for(atranslate("Hello world!", SlowModel(responses=["Hallo Welt!"])), 0.1))
+
+    chains = usage.by_chain()
+    assert chains["atranslate"]["calls"] == 1 and chains["atranslate"]["prompt_tokens"] > 0
+
+
+def test_stream_handler_usage() -> None:
+    with stream_to(lambda token: None) as handler:
+        summarize("some long text", reporting_model())
+    assert handler.tokens == 1100
+    assert handler.cost == (1000 * 2 + 100 * 10) / 1_000_000
+
+
+if __name__ == "__main__":
+    test_usage_per_chain_and_model()
+    test_cancelled_call_usage()
+    test_stream_handler_usage()